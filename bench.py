@@ -0,0 +1,863 @@
+# bench.py
+"""
+محاكاة يوم كامل بدون شبكة لقياس الجدولة قبل النشر.
+
+    python bench.py                          # 100 / 1000 / 10000 قروب
+    python bench.py --groups 50000 --latency 0.05 --flood 0.01 --dead 0.02
+    python bench.py --registry 100000        # ذاكرة registry وتكلفة الـ tick فقط (بدون يوم كامل)
+    python bench.py --transport 1 10 50 200  # طبقة HTTP مقابل Bot API وهمي محلي (وقت حقيقي)
+
+- ساعة افتراضية: event loop يقفز مباشرة إلى أقرب timer بدل الانتظار، و time.time/monotonic
+  و datetime.now في main تقرأ نفس الساعة؛ 24 ساعة تمر في ثوانٍ.
+- Bot وهمي يسجل كل نداء (latency افتراضي، 429 بنسبة --flood، شاتات ميتة --dead) ويمر
+  عبر الطابور الحقيقي (outbound.queue) كما في الإنتاج.
+- التخزين من storage.py (memory أو sqlite عبر --storage) مع عدّ كل round-trip.
+- job_queue وهمي فوق نفس الساعة: startup_job و scheduler_job اليومي و close_job/open_job و /announce.
+
+كل حجم يعمل في عملية مستقلة (ذاكرة قصوى وكاش نظيفين). التقرير: زمن الـ tick، نداءات API لكل
+انتقال، round-trips لـ DB، تأخر الإغلاق/الفتح عن موعده، الذاكرة القصوى، وفحوص الصحة
+(إغلاق فائت، فتح فائت، إغلاق مكرر، انتقال خارج النافذة، حالة نهائية خاطئة).
+"""
+import os
+
+# قبل استيراد config: بدون شبكة ولا Mongo حقيقي
+BOT_TOKEN_BENCH = "123456:bench"
+os.environ.setdefault("BOT_TOKEN", BOT_TOKEN_BENCH)
+# التخزين: memory (الافتراضي) أو sqlite عبر --storage؛ لا يلمس Mongo أبدًا
+if os.environ.get("STORAGE_BACKEND") not in ("memory", "sqlite"):
+    os.environ["STORAGE_BACKEND"] = "memory"
+os.environ["PRAYER_SOURCE"] = "local"
+os.environ["WORKER_MODE"] = "single"
+os.environ["SLOW_TICK_SECONDS"] = "0"
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import resource
+import shutil
+import tempfile
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from datetime import time as dtime
+from multiprocessing import get_context
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from urllib.parse import parse_qs
+
+from telegram import ChatPermissions
+from telegram.error import BadRequest, Forbidden, RetryAfter
+from telegram.ext import ExtBot
+from telegram.request import HTTPXRequest
+
+import burst
+import database as db
+import events
+import health
+import main
+import outbound
+import registry
+import updates
+import scheduler
+import transport
+
+logger = logging.getLogger("bench")
+
+# مواقع القروبات الوهمية (نصف القروبات بدون إعدادات = الافتراضي من config)
+LOCATIONS = [
+    {"lat": 35.6971, "lon": -0.6308, "method": 3, "timezone": "Africa/Algiers"},
+    {"lat": 21.4225, "lon": 39.8262, "method": 4, "timezone": "Asia/Riyadh"},
+    {"lat": 30.0444, "lon": 31.2357, "method": 5, "timezone": "Africa/Cairo"},
+    {"lat": 48.8566, "lon": 2.3522, "method": 12, "timezone": "Europe/Paris"},
+]
+
+
+# ===================== الساعة الافتراضية =====================
+class VirtualClock:
+    """
+    ساعة افتراضية تبدأ من start (unix). monotonic() و loop.time() تبدأ من قيمة monotonic
+    الحقيقية (حتى تبقى متوافقة مع buckets أُنشئت عند الاستيراد) وتبقى صغيرة:
+    عند ~1.7e9 ثانية لا تكفي دقة float لخطوات token bucket الصغيرة.
+    """
+
+    def __init__(self, start: float):
+        self.base = time.monotonic()
+        self.start = start - self.base
+        self.mono = self.base
+
+    def time(self) -> float:
+        return self.start + self.mono
+
+    def monotonic(self) -> float:
+        return self.mono
+
+    def advance(self, seconds: float):
+        self.mono += seconds
+
+
+class _VirtualSelector:
+    """
+    selector لا ينتظر أبدًا: بدل النوم حتى أقرب timer نقدّم الساعة إليه.
+    الوقت الحقيقي الذي استغرقه الكود بين دورتين يُضاف أيضًا، فـ tick بطيء يؤخر الانتقالات كما في الإنتاج.
+    """
+
+    def __init__(self, selector, clock: VirtualClock):
+        self._selector = selector
+        self._clock = clock
+        self._last = time.perf_counter()
+
+    def select(self, timeout=None):
+        busy = time.perf_counter() - self._last
+        self._clock.advance(busy)
+        events = self._selector.select(0)
+        if not events and timeout and timeout > busy:
+            self._clock.advance(timeout - busy)
+        self._last = time.perf_counter()
+        return events
+
+    def __getattr__(self, name):
+        return getattr(self._selector, name)
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    def __init__(self, clock: VirtualClock):
+        super().__init__()
+        self._clock = clock
+        self._selector = _VirtualSelector(self._selector, clock)
+
+    def time(self) -> float:
+        return self._clock.mono
+
+
+def _virtual_datetime(clock: VirtualClock):
+    class VirtualDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.fromtimestamp(clock.time(), tz)
+    return VirtualDatetime
+
+
+# ===================== Bot و job_queue وهميان =====================
+class SimMessage:
+    _ids = itertools.count(1)
+
+    def __init__(self, bot, chat_id: int):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = next(self._ids)
+
+    async def reply_text(self, text: str, **kwargs):
+        return await self.bot.send_message(chat_id=self.chat_id, text=text, **kwargs)
+
+    async def edit_text(self, text: str, **kwargs):
+        return await self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self.message_id, **kwargs)
+
+
+class SimBot:
+    """
+    Bot وهمي: كل نداء يمر عبر outbound.queue (الأولويات، الـ buckets، RetryAfter) ثم يُسجَّل.
+    يحتفظ بحالة كل شات (مغلق/مفتوح) ويسجل كل تغيير حقيقي بوقته الافتراضي.
+    """
+
+    def __init__(self, clock: VirtualClock, latency: float = 0.0, flood: float = 0.0, retry_after: int = 3,
+                 dead: set = None, seed: int = 0):
+        self.clock = clock
+        self.latency = latency
+        self.flood = flood
+        self.retry_after = retry_after
+        self.dead = dead or set()
+        self.rng = random.Random(seed)
+        self.calls = Counter()
+        self.dead_calls = 0
+        self.closed: Dict[int, bool] = {}
+        self.events: Dict[int, list] = defaultdict(list)  # chat_id -> [(t, closed)]
+        self.redundant = 0
+
+    async def _request(self, endpoint: str, data: dict, rate_limit_args=None):
+        return await outbound.queue.process_request(self._do, (endpoint, data), {}, endpoint, data, rate_limit_args)
+
+    async def _do(self, endpoint: str, data: dict):
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        chat_id = data.get("chat_id")
+        if chat_id in self.dead:
+            self.dead_calls += 1
+            raise Forbidden("Forbidden: bot was kicked from the supergroup chat")
+        if self.flood and self.rng.random() < self.flood:
+            raise RetryAfter(self.retry_after)
+        if endpoint in ("closeForumTopic", "reopenForumTopic", "setChatPermissions"):
+            if endpoint == "setChatPermissions":
+                closed = not data["permissions"].can_send_messages
+            else:
+                closed = endpoint == "closeForumTopic"
+            if self.closed.get(chat_id, False) == closed:
+                self.redundant += 1
+                raise BadRequest("Topic_not_modified" if endpoint != "setChatPermissions" else "Chat_not_modified")
+            self.closed[chat_id] = closed
+            self.events[chat_id].append((self.clock.time(), closed))
+            return True
+        if endpoint in ("sendMessage", "copyMessage"):
+            return SimMessage(self, chat_id)
+        return True
+
+    async def send_message(self, chat_id, text, rate_limit_args=None, **kwargs):
+        return await self._request("sendMessage", dict(kwargs, chat_id=chat_id, text=text), rate_limit_args)
+
+    async def copy_message(self, chat_id, from_chat_id, message_id, rate_limit_args=None, **kwargs):
+        data = dict(kwargs, chat_id=chat_id, from_chat_id=from_chat_id, message_id=message_id)
+        return await self._request("copyMessage", data, rate_limit_args)
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, rate_limit_args=None, **kwargs):
+        data = dict(kwargs, chat_id=chat_id, message_id=message_id, text=text)
+        return await self._request("editMessageText", data, rate_limit_args)
+
+    async def close_forum_topic(self, chat_id, message_thread_id, rate_limit_args=None):
+        data = {"chat_id": chat_id, "message_thread_id": message_thread_id}
+        return await self._request("closeForumTopic", data, rate_limit_args)
+
+    async def reopen_forum_topic(self, chat_id, message_thread_id, rate_limit_args=None):
+        data = {"chat_id": chat_id, "message_thread_id": message_thread_id}
+        return await self._request("reopenForumTopic", data, rate_limit_args)
+
+    async def set_chat_permissions(self, chat_id, permissions, rate_limit_args=None, **kwargs):
+        data = dict(kwargs, chat_id=chat_id, permissions=permissions)
+        return await self._request("setChatPermissions", data, rate_limit_args)
+
+
+class SimJob:
+    def __init__(self, queue, callback, at: float, name: Optional[str], data, daily: Optional[dtime] = None):
+        self.queue = queue
+        self.callback = callback
+        self.at = at
+        self.name = name
+        self.data = data
+        self.daily = daily
+        self.removed = False
+        self.handle = None
+
+    def schedule_removal(self):
+        self.removed = True
+        if self.handle is not None:
+            self.handle.cancel()
+        self.queue._forget(self)
+
+
+class SimContext:
+    """ما تستعمله callbacks و أوامر main.py من CallbackContext."""
+
+    def __init__(self, app, job: SimJob = None, args: List[str] = None):
+        self.application = app
+        self.bot = app.bot
+        self.job_queue = app.job_queue
+        self.job = job
+        self.args = args or []
+
+
+class SimJobQueue:
+    """run_once / run_daily / get_jobs_by_name فوق call_at في الـ loop الافتراضي (مثل PTB JobQueue)."""
+
+    def __init__(self, app, clock: VirtualClock):
+        self.app = app
+        self.clock = clock
+        self._by_name: Dict[Optional[str], list] = defaultdict(list)
+        self._running = set()
+        # callback -> مدة كل تشغيل بالوقت الحقيقي (تشمل ما نفّذته المهام الأخرى أثناء انتظاره)
+        self.timings: Dict[str, list] = defaultdict(list)
+        self.errors = 0
+
+    def _schedule(self, job: SimJob):
+        self._by_name[job.name].append(job)
+        job.handle = asyncio.get_running_loop().call_at(job.at - self.clock.start, self._fire, job)
+        return job
+
+    def _forget(self, job: SimJob):
+        jobs = self._by_name.get(job.name)
+        if jobs and job in jobs:
+            jobs.remove(job)
+            if not jobs:
+                del self._by_name[job.name]
+
+    def run_once(self, callback, when, data=None, name=None, job_kwargs=None):
+        if isinstance(when, datetime):
+            at = when.timestamp()
+        elif isinstance(when, timedelta):
+            at = self.clock.time() + when.total_seconds()
+        else:
+            at = self.clock.time() + when
+        return self._schedule(SimJob(self, callback, at, name, data))
+
+    def run_daily(self, callback, time: dtime, data=None, name=None, **kwargs):
+        return self._schedule(SimJob(self, callback, self._next_daily(time), name, data, daily=time))
+
+    def _next_daily(self, t: dtime) -> float:
+        now = datetime.fromtimestamp(self.clock.time(), t.tzinfo)
+        at = datetime.combine(now.date(), t.replace(tzinfo=None), tzinfo=t.tzinfo)
+        if at <= now:
+            at = datetime.combine(now.date() + timedelta(days=1), t.replace(tzinfo=None), tzinfo=t.tzinfo)
+        return at.timestamp()
+
+    def get_jobs_by_name(self, name: str):
+        return tuple(self._by_name.get(name, ()))
+
+    def jobs(self):
+        return tuple(j for jobs in self._by_name.values() for j in jobs)
+
+    def _fire(self, job: SimJob):
+        self._forget(job)
+        if job.removed:
+            return
+        if job.daily is not None:
+            self._schedule(SimJob(self, job.callback, self._next_daily(job.daily), job.name, job.data, job.daily))
+        task = asyncio.get_running_loop().create_task(self._run(job))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, job: SimJob):
+        start = time.perf_counter()
+        try:
+            await job.callback(SimContext(self.app, job))
+        except Exception:
+            self.errors += 1
+            logger.exception("job %s failed", job.name)
+        finally:
+            self.timings[job.callback.__name__].append(time.perf_counter() - start)
+
+    async def stop(self, timeout: float = 600):
+        """إلغاء الـ jobs القادمة وانتظار الجارية (بالوقت الافتراضي)."""
+        for job in self.jobs():
+            job.schedule_removal()
+        if self._running:
+            await asyncio.wait(list(self._running), timeout=timeout)
+
+
+# ===================== السيناريو =====================
+def make_groups(n: int, seed: int) -> List[dict]:
+    """n قروب: نصفها بالإعدادات الافتراضية، 60% مواضيع forum، وبعضها بمدد إغلاق خاصة."""
+    rng = random.Random(seed)
+    groups = []
+    for i in range(n):
+        doc = {"chat_id": -1000000000000 - i, "thread_id": rng.randint(2, 5000) if rng.random() < 0.6 else None}
+        if rng.random() < 0.5:
+            doc.update(rng.choice(LOCATIONS))
+        if rng.random() < 0.1:
+            doc["durations"] = {"Maghrib": 20, "Isha": 30}
+        groups.append(doc)
+    return groups
+
+
+def _quantiles(values: List[float]) -> dict:
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "max": 0.0}
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {"p50": pick(0.5), "p95": pick(0.95), "max": values[-1]}
+
+
+async def expected_blocks(groups: List[dict], start: datetime, end: datetime) -> Dict[int, list]:
+    """نوافذ الإغلاق المتوقعة لكل قروب بين start و end (تُحسب مرة لكل سلة إعدادات)."""
+    by_settings, out = {}, {}
+    for g in groups:
+        settings = main.group_settings(g)
+        key = (scheduler.bucket_key(settings["lat"], settings["lon"], settings["method"], settings["timezone"]),
+               tuple(sorted(settings["durations"].items())))
+        if key not in by_settings:
+            blocks = {}
+            t = start - timedelta(days=1)
+            while t <= end + timedelta(days=1):
+                for b in await main.load_blocks(t, settings):
+                    blocks.setdefault(b.start, b)
+                t += timedelta(hours=12)
+            by_settings[key] = sorted(blocks.values(), key=lambda b: b.start)
+        out[g["chat_id"]] = by_settings[key]
+    return out
+
+
+def check_events(blocks: list, events: list, start: float, end: float, horizon: float, report: dict):
+    """مقارنة تغييرات الحالة الفعلية لشات واحد مع نوافذه المتوقعة."""
+    inside = 0
+    for i, b in enumerate(blocks):
+        b_start, b_end = max(b.start.timestamp(), start), b.end.timestamp()
+        if b_end <= start or b_start > end:
+            continue
+        closes = [t for t, closed in events if closed and b_start <= t < b_end]
+        inside += len(closes)
+        if not closes:
+            report["missed_close"] += 1
+        else:
+            report["close_lag"].append(closes[0] - b_start)
+            report["doubled"] += len(closes) - 1
+        if b_end > end:
+            continue
+        next_start = blocks[i + 1].start.timestamp() if i + 1 < len(blocks) else horizon
+        opens = [t for t, closed in events if not closed and b_end <= t < min(next_start, horizon)]
+        if closes and not opens:
+            report["missed_open"] += 1
+        elif opens:
+            report["open_lag"].append(opens[0] - b_end)
+    report["out_of_window"] += sum(1 for t, closed in events if closed and start <= t <= end) - inside
+
+
+async def simulate(n: int, opts: dict, clock: VirtualClock) -> dict:
+    stats = db.db.stats
+    db.db.latency = opts["db_latency"]
+    await db.ensure_indexes()
+    groups = make_groups(n, opts["seed"])
+    await db.groups_col.insert_many(groups)
+    rng = random.Random(opts["seed"] + 1)
+    dead = {g["chat_id"] for g in groups if rng.random() < opts["dead"]}
+
+    bot = SimBot(clock, opts["latency"], opts["flood"], opts["retry_after"], dead, opts["seed"])
+    app = SimpleNamespace(bot=bot)
+    app.job_queue = jq = SimJobQueue(app, clock)
+    await health.refresh(force=True)
+    stats.clear()
+
+    start = clock.time()
+    end = start + opts["hours"] * 3600
+    horizon = end + opts["drain"] * 3600
+    wall = time.perf_counter()
+    jq.run_once(main.startup_job, when=0, name=main.PLAN_JOB)
+    jq.run_daily(main.scheduler_job, time=dtime(0, 1, tzinfo=main.tz), name=main.PLAN_JOB)
+    broadcast_at = None
+    if opts["announce_at"]:
+        hh, mm = map(int, opts["announce_at"].split(":"))
+        at = datetime.fromtimestamp(start, main.tz).replace(hour=hh, minute=mm, second=0)
+        if at.timestamp() <= start:
+            at += timedelta(days=1)
+
+        async def announce_job(ctx):
+            nonlocal broadcast_at
+            broadcast_at = clock.time()
+            update = SimpleNamespace(
+                message=SimMessage(bot, main.OWNER_ID),
+                effective_chat=SimpleNamespace(id=main.OWNER_ID, type="private"),
+                effective_user=SimpleNamespace(id=main.OWNER_ID),
+            )
+            update.message.reply_to_message = None
+            await main.announce_all(update, SimContext(app, args=["bench", "announcement"]))
+            # الإرسال نفسه مهمة في الخلفية (updates.background)
+            await asyncio.gather(*updates.pending())
+            broadcast_at = clock.time() - broadcast_at
+
+        jq.run_once(announce_job, when=at)
+    await asyncio.sleep(horizon - start)
+    await jq.stop()
+    await events.close()
+    wall = time.perf_counter() - wall
+
+    report = Counter()
+    report["close_lag"], report["open_lag"] = [], []
+    live = [g for g in groups if g["chat_id"] not in dead]
+    expected = await expected_blocks(live, datetime.fromtimestamp(start, main.tz), datetime.fromtimestamp(horizon, main.tz))
+    wrong_final = 0
+    for g in live:
+        chat_id = g["chat_id"]
+        check_events(expected[chat_id], bot.events.get(chat_id, []), start, end, horizon, report)
+        should_close = scheduler.active_block(datetime.fromtimestamp(horizon, main.tz), expected[chat_id]) is not None
+        wrong_final += bot.closed.get(chat_id, False) != should_close
+
+    transitions = sum(len(e) for e in bot.events.values())
+    api_calls = sum(bot.calls.values())
+    db_trips = sum(stats.values())
+    events_logged = await db.events_col.count_documents({})
+    ticks = {name: jq.timings.get(name, []) for name in ("startup_job", "scheduler_job")}
+    return {
+        "groups": n,
+        "wall_seconds": wall,
+        "startup_tick_seconds": max(ticks["startup_job"], default=0.0),
+        "daily_tick_seconds": max(ticks["scheduler_job"], default=0.0),
+        "transitions": transitions,
+        "api_calls": api_calls,
+        "api_calls_by_endpoint": dict(bot.calls),
+        "api_per_transition": api_calls / max(1, transitions),
+        "db_round_trips": db_trips,
+        "db_round_trips_by_op": dict(stats.most_common(12)),
+        "db_per_transition": db_trips / max(1, transitions),
+        "close_lag": _quantiles(report["close_lag"]),
+        "open_lag": _quantiles(report["open_lag"]),
+        "broadcast_seconds": broadcast_at,
+        "queue": outbound.queue.stats(),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "missed_close": report["missed_close"],
+        "missed_open": report["missed_open"],
+        "doubled": report["doubled"],
+        "redundant_calls": bot.redundant,
+        "out_of_window": report["out_of_window"],
+        "wrong_final_state": wrong_final,
+        "dead_chats": len(dead),
+        "dead_chat_calls": bot.dead_calls,
+        "job_errors": jq.errors,
+        "events_logged": events_logged,
+        "stats_text": await events.stats_text(opts["hours"] + opts["drain"]),
+    }
+
+
+async def registry_bench(n: int, opts: dict, clock: VirtualClock) -> dict:
+    """
+    registry وحده عند n قروب: التحميل من التخزين، الذاكرة لكل قروب (tracemalloc)، جدولة الانتقال القادم
+    لكل القروبات (tick التشغيل بدون نداءات Telegram)، ثم tick يومي وأول دفعة مستحقة.
+    للمقارنة: القاموس الذي كانت تبنيه get_groups_db في كل tick (dict لكل قروب بمفتاح str).
+    """
+    groups = make_groups(n, opts["seed"])
+    await db.groups_col.insert_many(groups)
+    del groups
+    app = SimpleNamespace(bot=None)
+    app.job_queue = jq = SimJobQueue(app, clock)
+    ctx = SimContext(app)
+    await health.refresh(force=True)
+    out = {"groups": n}
+    wall = time.perf_counter()
+
+    async def measure(name: str, fn, reset):
+        """fn مرتين: بدون tracemalloc للزمن، ثم بعد reset() معه للذاكرة التي تبقى (بايت لكل قروب)."""
+        start = time.perf_counter()
+        await fn()
+        out[f"{name}_seconds"] = time.perf_counter() - start
+        await reset()
+        tracemalloc.start()
+        kept = await fn()
+        out[f"{name}_bytes"] = tracemalloc.get_traced_memory()[0] / n
+        tracemalloc.stop()
+        return kept
+
+    async def old_dict():
+        return {str(doc["chat_id"]): dict(doc) async for doc in db.groups_col.find({}, {"_id": 0})}
+
+    async def nothing():
+        pass
+
+    async def empty_registry():
+        registry.reset()
+
+    async def unscheduled_registry():
+        registry.reset()
+        burst._cohorts.clear()
+        await db.load_groups_db()
+
+    now = datetime.now(main.tz)
+
+    async def plan_everything():
+        blocks_of = {}
+        for g in registry.groups():
+            key = id(g.profile)
+            if key not in blocks_of:
+                blocks_of[key] = await main.load_blocks(now, main.group_settings(g.profile))
+            await main.schedule_group(jq, g.chat_id, g.thread_id, blocks_of[key], now, saves=[])
+
+    old = await measure("dict", old_dict, nothing)
+    del old
+    await measure("load", db.load_groups_db, empty_registry)
+    await measure("plan", plan_everything, unscheduled_registry)
+    start = time.perf_counter()
+    await main.plan_all_groups(ctx)
+    out["daily_tick_seconds"] = time.perf_counter() - start
+
+    first = registry.next_due()
+    start = time.perf_counter()
+    due = registry.pop_due(first)
+    out["due_seconds"] = time.perf_counter() - start
+    out["due_groups"] = len(due)
+    out["scheduled"] = registry.scheduled() + len(due)
+    out["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    out["wall_seconds"] = time.perf_counter() - wall
+    await jq.stop()
+    return out
+
+
+# ===================== طبقة HTTP (transport.py) =====================
+
+
+class MockBotAPI:
+    """
+    خادم Bot API محلي (HTTP/1.1 مع keep-alive، وقت حقيقي) في عملية مستقلة حتى لا يشارك العميل المُقاس
+    المعالج: كل رد بعد latency، وأول رد على كل اتصال جديد يتأخر handshake إضافية (TCP + TLS).
+    """
+
+    def __init__(self, latency: float, handshake: float):
+        ctx = get_context("spawn")
+        self.connections = ctx.Value("i", 0)  # عدد الاتصالات المفتوحة منذ البدء (يكتبه الخادم)
+        self._port = ctx.Value("i", 0)
+        self._ready = ctx.Event()
+        self._process = ctx.Process(target=_run_mock_server, daemon=True,
+                                    args=(latency, handshake, self.connections, self._port, self._ready))
+
+    def start(self) -> str:
+        self._process.start()
+        self._ready.wait()
+        return f"http://127.0.0.1:{self._port.value}/bot"
+
+    def stop(self):
+        self._process.terminate()
+        self._process.join()
+
+
+def _run_mock_server(latency: float, handshake: float, connections, port, ready):
+    async def serve(reader, writer):
+        connections.value += 1
+        delay = handshake + latency
+        try:
+            while True:
+                head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+                length = 0
+                for line in head[1:]:
+                    name, _, value = line.partition(":")
+                    if name.lower() == "content-length":
+                        length = int(value)
+                body = parse_qs((await reader.readexactly(length)).decode()) if length else {}
+                await asyncio.sleep(delay)
+                delay = latency
+                result = _mock_result(head[0].split()[1].rsplit("/", 1)[-1], body)
+                payload = json.dumps({"ok": True, "result": result}).encode()
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n"
+                             % len(payload) + payload)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def main():
+        server = await asyncio.start_server(serve, "127.0.0.1", 0)
+        port.value = server.sockets[0].getsockname()[1]
+        ready.set()
+        await server.serve_forever()
+
+    asyncio.run(main())
+
+
+def _mock_result(endpoint: str, body: dict):
+    if endpoint == "getMe":
+        return {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+    if endpoint == "sendMessage":
+        chat_id = int(body.get("chat_id", ["0"])[0])
+        return {"message_id": 1, "date": 0, "chat": {"id": chat_id, "type": "supergroup"}, "text": "x"}
+    return True
+
+
+TRANSPORTS = {
+    # ما كان يبنيه Application.builder() بدون request: pool واحد 256، keep-alive افتراضي httpx (5 ثوانٍ)
+    "default": lambda: HTTPXRequest(connection_pool_size=256),
+    "tuned": transport.bot_request,
+}
+
+
+async def transport_bench(concurrency: int, opts: dict) -> dict:
+    """
+    لكل إعداد: concurrency مُرسِل جماعي (BULK) بلا توقف لمدة --seconds، مع نداء إغلاق (CRITICAL)
+    كل 20ms يُقاس زمنه؛ ثم خمول --idle ثانية ودفعة من concurrency إغلاقًا (هل بقيت الاتصالات مفتوحة؟).
+    الطابور الحقيقي (OutboundQueue) بدون حد معدل: القياس للنقل وحده.
+    """
+    out = {"concurrency": concurrency}
+    wall = time.perf_counter()
+    for name, make in TRANSPORTS.items():
+        api = MockBotAPI(opts["latency"], opts["handshake"])
+        base = api.start()
+        queue = outbound.OutboundQueue(rate=1e6, per_chat_rate=1e6, per_chat_burst=1e6)
+        bot = ExtBot(BOT_TOKEN_BENCH, base_url=base, request=make(), rate_limiter=queue)
+        await bot.initialize()
+        chats = itertools.count(1)
+        sent = errors = 0
+        critical = []
+        stop_at = time.perf_counter() + opts["seconds"]
+
+        async def bulk_sender():
+            nonlocal sent, errors
+            while time.perf_counter() < stop_at:
+                try:
+                    await bot.send_message(next(chats), "x", rate_limit_args={"priority": outbound.BULK})
+                    sent += 1
+                except Exception:
+                    errors += 1
+
+        async def close_one(into: list):
+            nonlocal errors
+            start = time.perf_counter()
+            try:
+                await bot.set_chat_permissions(next(chats), ChatPermissions(can_send_messages=False),
+                                               rate_limit_args={"priority": outbound.CRITICAL})
+                into.append(time.perf_counter() - start)
+            except Exception:
+                errors += 1
+
+        async def critical_sender():
+            pending = []
+            while time.perf_counter() < stop_at:
+                pending.append(asyncio.create_task(close_one(critical)))
+                await asyncio.sleep(0.02)
+            await asyncio.gather(*pending)
+
+        connected = api.connections.value
+        start = time.perf_counter()
+        await asyncio.gather(critical_sender(), *(bulk_sender() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        load_connections = api.connections.value - connected
+
+        await asyncio.sleep(opts["idle"])
+        connected = api.connections.value
+        after_idle = []
+        await asyncio.gather(*(close_one(after_idle) for _ in range(concurrency)))
+        out[name] = {
+            "throughput": sent / elapsed,
+            "critical": _quantiles([v * 1000 for v in critical]),
+            "connections": load_connections,
+            "after_idle": _quantiles([v * 1000 for v in after_idle]),
+            "reconnects": api.connections.value - connected,
+            "errors": errors,
+        }
+        await bot.shutdown()
+        await queue.shutdown()
+        api.stop()
+    out["wall_seconds"] = time.perf_counter() - wall
+    return out
+
+
+def run_one(n: int, opts: dict) -> dict:
+    """محاكاة حجم واحد داخل loop افتراضي (تُستدعى في عملية مستقلة)."""
+    logging.getLogger().setLevel(logging.DEBUG if opts["verbose"] else logging.ERROR)
+    day = date.fromisoformat(opts["date"])
+    start = datetime.combine(day, dtime(0, 0), tzinfo=main.tz) - timedelta(minutes=2)
+    clock = VirtualClock(start.timestamp())
+    loop = VirtualTimeLoop(clock)
+    saved = time.time, time.monotonic
+    time.time, time.monotonic = clock.time, clock.monotonic
+    main.datetime = _virtual_datetime(clock)
+    try:
+        asyncio.set_event_loop(loop)
+        scenario = registry_bench if opts.get("registry") else simulate
+        return loop.run_until_complete(scenario(n, opts, clock))
+    finally:
+        time.time, time.monotonic = saved
+        main.datetime = datetime
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+ROWS = [
+    ("wall time (s)", lambda r: f"{r['wall_seconds']:.1f}"),
+    ("startup tick (real s)", lambda r: f"{r['startup_tick_seconds']:.2f}"),
+    ("daily tick (real s)", lambda r: f"{r['daily_tick_seconds']:.2f}"),
+    ("transitions", lambda r: r["transitions"]),
+    ("API calls", lambda r: r["api_calls"]),
+    ("API calls / transition", lambda r: f"{r['api_per_transition']:.2f}"),
+    ("DB round-trips", lambda r: r["db_round_trips"]),
+    ("DB round-trips / transition", lambda r: f"{r['db_per_transition']:.2f}"),
+    ("close lag p50/p95/max (s)", lambda r: "{p50:.0f}/{p95:.0f}/{max:.0f}".format(**r["close_lag"])),
+    ("open lag p50/p95/max (s)", lambda r: "{p50:.0f}/{p95:.0f}/{max:.0f}".format(**r["open_lag"])),
+    ("broadcast (s)", lambda r: "-" if r["broadcast_seconds"] is None else f"{r['broadcast_seconds']:.0f}"),
+    ("peak RSS (MB)", lambda r: f"{r['peak_rss_mb']:.0f}"),
+    ("missed closes", lambda r: r["missed_close"]),
+    ("missed opens", lambda r: r["missed_open"]),
+    ("doubled closes", lambda r: r["doubled"]),
+    ("redundant API calls", lambda r: r["redundant_calls"]),
+    ("closes out of window", lambda r: r["out_of_window"]),
+    ("wrong final state", lambda r: r["wrong_final_state"]),
+    ("dead chats / calls to them", lambda r: f"{r['dead_chats']}/{r['dead_chat_calls']}"),
+    ("job errors", lambda r: r["job_errors"]),
+    ("events logged", lambda r: r["events_logged"]),
+]
+
+
+REGISTRY_ROWS = [
+    ("load from storage (s)", lambda r: f"{r['load_seconds']:.2f}"),
+    ("registry bytes / group", lambda r: f"{r['load_bytes']:.0f}"),
+    ("old dict build (s)", lambda r: f"{r['dict_seconds']:.2f}"),
+    ("old dict bytes / group", lambda r: f"{r['dict_bytes']:.0f}"),
+    ("plan all groups (s)", lambda r: f"{r['plan_seconds']:.2f}"),
+    ("scheduled bytes / group", lambda r: f"{r['plan_bytes']:.0f}"),
+    ("scheduled groups", lambda r: r["scheduled"]),
+    ("daily tick (s)", lambda r: f"{r['daily_tick_seconds']:.3f}"),
+    ("first due batch (groups)", lambda r: r["due_groups"]),
+    ("first due batch pop (ms)", lambda r: f"{r['due_seconds'] * 1000:.1f}"),
+    ("peak RSS (MB)", lambda r: f"{r['peak_rss_mb']:.0f}"),
+]
+
+
+TRANSPORT_ROWS = [
+    (f"{name}: {label}", lambda r, name=name, fn=fn: fn(r[name]))
+    for name in TRANSPORTS
+    for label, fn in [
+        ("bulk throughput (req/s)", lambda t: f"{t['throughput']:.0f}"),
+        ("close latency p50/p95/max (ms)", lambda t: "{p50:.0f}/{p95:.0f}/{max:.0f}".format(**t["critical"])),
+        ("connections opened", lambda t: t["connections"]),
+        ("after idle p50/p95/max (ms)", lambda t: "{p50:.0f}/{p95:.0f}/{max:.0f}".format(**t["after_idle"])),
+        ("reconnects after idle", lambda t: t["reconnects"]),
+        ("errors", lambda t: t["errors"]),
+    ]
+]
+
+
+def print_table(reports: List[dict], rows=ROWS, key: str = "groups"):
+    header = [key] + [str(r[key]) for r in reports]
+    rows = [header] + [[name] + [str(fn(r)) for r in reports] for name, fn in rows]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    for row in rows:
+        print("  ".join(cell.ljust(w) if i == 0 else cell.rjust(w) for i, (cell, w) in enumerate(zip(row, widths))))
+
+
+def main_cli():
+    p = argparse.ArgumentParser(description="محاكاة يوم كامل للجدولة بدون شبكة")
+    p.add_argument("--groups", type=int, nargs="+", default=[100, 1000, 10000])
+    p.add_argument("--registry", type=int, nargs="+", metavar="GROUPS",
+                   help="قياس registry فقط (ذاكرة لكل قروب وتكلفة الـ tick) بدل محاكاة اليوم")
+    p.add_argument("--transport", type=int, nargs="+", metavar="CONCURRENCY",
+                   help="قياس طبقة HTTP (transport.py) مقابل Bot API وهمي محلي بدل محاكاة اليوم")
+    p.add_argument("--handshake", type=float, default=0.15, help="--transport: تكلفة كل اتصال جديد (TCP+TLS، ثوانٍ)")
+    p.add_argument("--seconds", type=float, default=3, help="--transport: مدة الحمل لكل مستوى (ثوانٍ)")
+    p.add_argument("--idle", type=float, default=8, help="--transport: الخمول قبل دفعة الإغلاق الثانية (ثوانٍ)")
+    p.add_argument("--date", default="2025-03-01", help="اليوم المحاكى (YYYY-MM-DD، بمنطقة TIMEZONE)")
+    p.add_argument("--hours", type=float, default=24)
+    p.add_argument("--drain", type=float, default=2, help="ساعات إضافية بعد النهاية لإكمال الانتقالات المتأخرة")
+    p.add_argument("--latency", type=float, default=0.05, help="زمن كل نداء Bot API (ثوانٍ افتراضية)")
+    p.add_argument("--flood", type=float, default=0.0, help="نسبة النداءات التي تُرجع 429")
+    p.add_argument("--retry-after", type=int, default=3)
+    p.add_argument("--dead", type=float, default=0.0, help="نسبة الشاتات التي طُرد منها البوت")
+    p.add_argument("--storage", choices=("memory", "sqlite"), default="memory")
+    p.add_argument("--db-latency", type=float, default=0.0, help="زمن كل round-trip لـ DB (ثوانٍ افتراضية)")
+    p.add_argument("--announce-at", default="13:00", help="وقت /announce (HH:MM)، فارغ لتعطيله")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--json", help="حفظ التقرير الكامل في ملف JSON")
+    p.add_argument("--verbose", action="store_true")
+    args = p.parse_args()
+    opts = {k: v for k, v in vars(args).items() if k not in ("groups", "json", "storage", "registry", "transport")}
+    opts["registry"] = bool(args.registry)
+    opts["transport"] = bool(args.transport)
+    # العمليات الفرعية تقرأ التخزين من البيئة عند استيراد database
+    os.environ["STORAGE_BACKEND"] = args.storage
+    tmp = tempfile.mkdtemp(prefix="prayerbot-bench-")
+
+    reports = []
+    for n in args.transport or args.registry or args.groups:
+        if args.transport:
+            logging.getLogger().setLevel(logging.DEBUG if opts["verbose"] else logging.ERROR)
+            # شبكة حقيقية على localhost (بدون ساعة افتراضية)؛ الخادم الوهمي في عملية فرعية
+            reports.append(asyncio.run(transport_bench(n, opts)))
+            print(f"{n} concurrent: {reports[-1]['wall_seconds']:.1f}s", flush=True)
+            continue
+        os.environ["SQLITE_PATH"] = os.path.join(tmp, f"bench-{n}.sqlite3")
+        # عملية جديدة لكل حجم: ذاكرة قصوى وكاش و metrics مستقلة
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as ex:
+            report = ex.submit(run_one, n, opts).result()
+        print(f"{n} groups: {report['wall_seconds']:.1f}s", flush=True)
+        if opts["verbose"] and report.get("stats_text"):
+            print(report["stats_text"], flush=True)
+        reports.append(report)
+    shutil.rmtree(tmp, ignore_errors=True)
+    print()
+    if args.transport:
+        print_table(reports, TRANSPORT_ROWS, key="concurrency")
+    else:
+        print_table(reports, REGISTRY_ROWS if args.registry else ROWS)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,188 @@
+# broadcast.py
+"""
+محرك إرسال جماعي (fan-out) مشترك لـ /announce و /close_all و /open_all.
+
+- عدد محدود من العمّال المتزامنين بدل حلقة متسلسلة مع sleep ثابت.
+- كل النداءات تمر عبر الطابور المركزي (outbound) بأولوية BULK: حدود عامة + لكل شات،
+  RetryAfter، ولا تتقدّم على الإغلاق/الفتح المجدول.
+- تحديث رسالة الحالة عند المالك أثناء التقدّم.
+- event (إن وُجد): نتيجة كل قروب تُسجَّل في events (التأخر عن event_at، بداية المهمة افتراضيًا).
+- نتيجة كل هدف: ok (نداءات Telegram نجحت)، failed، أو بدون نداء: skipped (breaker مفتوح)، noop
+  (الحالة مطبّقة أصلًا أو نية أحدث)، forwarded (أُحيل إلى العامل المالك في وضع front)؛
+  هذه الثلاث لا تُحسب نجاحًا ولا تمسّ health.
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from telegram.error import BadRequest
+
+import events
+import health
+import outbound
+import transitions
+from config import BROADCAST_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_INTERVAL = 3.0  # ثوانٍ بين تحديثات رسالة الحالة
+CHECKPOINT_EVERY = 20  # عدد النتائج قبل حفظ نقطة استئناف
+
+# حالة كل هدف (نفس القيم في broadcast_targets)
+OK, FAILED, SKIPPED, NOOP, FORWARDED = "ok", "failed", "skipped", "noop", "forwarded"
+# ما يُرجعه action: None = أرسل بنفسه عبر call (يُسجَّل النجاح في health هنا)، أو نتيجة transitions.apply
+# (utils يسجل health بنفسه عند النداءات الفعلية)، أو OK لإرسال سجّل health بنفسه، أو FORWARDED
+OUTCOMES = {
+    None: OK, OK: OK, transitions.APPLIED: OK,
+    transitions.NOOP: NOOP, transitions.STALE: NOOP, transitions.SKIPPED: SKIPPED, FORWARDED: FORWARDED,
+}
+EVENT_RESULTS = {OK: events.SENT, SKIPPED: transitions.SKIPPED, NOOP: transitions.NOOP, FORWARDED: FORWARDED}
+# عدّادات المهمة (نفس الأسماء في سجل المهمة وفي FanOutResult)؛ ok يُعدّ في sent
+COUNTERS = ("sent", "failed", "skipped", "noop", "forwarded")
+
+
+class StatusMessage:
+    """رسالة حالة معروفة بـ (chat_id, message_id) فقط — لتحديثها بعد إعادة التشغيل."""
+
+    def __init__(self, bot, chat_id: int, message_id: int):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+
+    async def edit_text(self, text: str):
+        return await self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self.message_id)
+
+
+class FanOutResult:
+    def __init__(self, total: int):
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+        self.noop = 0
+        self.forwarded = 0
+        self.ok: List[int] = []
+        self.errors: List[str] = []
+
+    @property
+    def done(self) -> int:
+        return sum(self.counts().values())
+
+    def count(self, outcome: str):
+        name = counter(outcome)
+        setattr(self, name, getattr(self, name) + 1)
+
+    def counts(self) -> Dict[str, int]:
+        return {name: getattr(self, name) for name in COUNTERS}
+
+
+def counter(status: str) -> str:
+    """اسم العدّاد لحالة هدف."""
+    return "sent" if status == OK else status
+
+
+def other_text(counts: Dict[str, int]) -> str:
+    """"، بدون تغيير N، متوقف M، أُحيل K" (فقط غير الصفرية) لرسائل التقدم والملخص؛ counts: سجل المهمة أو counts()."""
+    names = (("noop", "بدون تغيير"), ("skipped", "متوقف"), ("forwarded", "أُحيل للعمّال"))
+    return "".join(f"، {label} {counts[k]}" for k, label in names if counts.get(k))
+
+
+async def fan_out(
+    targets: List[Tuple[int, Optional[int]]],
+    action: Callable[[int, Optional[int], Callable], Awaitable],
+    status_message=None,
+    title: str = "📣",
+    concurrency: int = BROADCAST_CONCURRENCY,
+    priority: int = outbound.BULK,
+    checkpoint: Callable[[List[Tuple[int, str, Optional[str]]]], Awaitable] = None,
+    done_before: Dict[str, int] = None,
+    event: str = None,
+    event_at: float = None,
+) -> FanOutResult:
+    """
+    تنفيذ action(chat_id, thread_id, call) لكل هدف بعدد محدود من العمّال؛ action يرفع استثناء عند الفشل
+    ويُرجع نتيجته (انظر OUTCOMES).
+    call(chat_id, fn, *args, **kwargs) يمرّر نداءات Bot API عبر الطابور المركزي بالأولوية priority.
+    status_message (إن وُجدت) تُحدَّث بالتقدّم كل PROGRESS_INTERVAL ثانية.
+    checkpoint (إن وُجد) يستقبل دفعات [(chat_id, status, error)] كل CHECKPOINT_EVERY نتيجة وفي النهاية.
+    done_before: العدّادات (COUNTERS) من تشغيل سابق لنفس المهمة — للعرض فقط عند الاستئناف.
+    event: نوع الحدث في events لكل نتيجة (None: لا تسجيل)؛ event_at: الموعد المرجعي للتأخر.
+    """
+    if event is not None and event_at is None:
+        event_at = time.time()
+    call = outbound.caller(priority)
+    result = FanOutResult(len(targets))
+    pending_results: List[Tuple[int, str, Optional[str]]] = []
+    checkpoint_lock = asyncio.Lock()
+
+    async def flush(force: bool = False):
+        if checkpoint is None or not pending_results:
+            return
+        if not force and len(pending_results) < CHECKPOINT_EVERY:
+            return
+        async with checkpoint_lock:
+            batch = pending_results[:]
+            del pending_results[:]
+            try:
+                await checkpoint(batch)
+            except Exception:
+                logger.exception("fan_out: checkpoint failed")
+
+    queue: asyncio.Queue = asyncio.Queue()
+    for t in targets:
+        queue.put_nowait(t)
+
+    async def worker():
+        while True:
+            try:
+                chat_id, thread_id = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                returned = await action(chat_id, thread_id, call)
+                outcome = OUTCOMES[returned]
+                result.count(outcome)
+                if outcome == OK:
+                    result.ok.append(chat_id)
+                pending_results.append((chat_id, outcome, None))
+                if event is not None:
+                    events.record(event, chat_id, EVENT_RESULTS[outcome], event_at)
+                if returned is None:
+                    await health.record_success(chat_id)
+            except Exception as e:
+                # أخطاء الإغلاق/الفتح تُسجَّل في utils وتصل هنا كـ RuntimeError (لا تُحسب مرتين)
+                await health.record_failure(chat_id, e)
+                logger.warning("fan_out: failed for %s/%s: %s", chat_id, thread_id, e)
+                result.failed += 1
+                result.errors.append(f"{chat_id}: {e}")
+                pending_results.append((chat_id, FAILED, str(e)))
+                if event is not None:
+                    events.record(event, chat_id, events.FAILED, event_at, error=type(e).__name__)
+            await flush()
+
+    async def reporter():
+        last = None
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            before = {k: (done_before or {}).get(k, 0) for k in COUNTERS}
+            counts = {k: before[k] + n for k, n in result.counts().items()}
+            text = (f"{title} جارٍ التنفيذ: {sum(counts.values())}/{sum(before.values()) + result.total} "
+                    f"(نجاح {counts['sent']}، فشل {counts['failed']}{other_text(counts)})")
+            if text != last:
+                try:
+                    await status_message.edit_text(text)
+                    last = text
+                except BadRequest:
+                    pass
+                except Exception:
+                    logger.debug("fan_out: progress update failed", exc_info=True)
+
+    progress = asyncio.create_task(reporter()) if status_message is not None else None
+    try:
+        await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, len(targets))))))
+    finally:
+        if progress is not None:
+            progress.cancel()
+        await flush(force=True)
+    return result
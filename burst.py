@@ -0,0 +1,220 @@
+# burst.py
+"""
+تشكيل دفعات الإغلاق المجدول.
+
+كل قروبات المنطقة الزمنية الواحدة تُغلق في نفس الدقيقة (الأذان)، وبحد Bot API العام (BROADCAST_RATE)
+يصل آخرها متأخرًا بعدد القروبات × نداءين / المعدل. لذلك يُقسم الإغلاق المجدول إلى مرحلتين:
+
+1. رسائل التنبيه ("سيتم غلق...") تُرسل مبكرًا، موزعة على نافذة قبل الموعد طولها
+   lead = عدد قروبات الدفعة / المعدل المقاس × LEAD_FACTOR (بين BURST_MIN_LEAD و BURST_MAX_LEAD).
+2. عند الموعد بالضبط: إغلاق الموضوع/تغيير الصلاحيات فقط (نداء واحد لكل قروب)، والطابور يخدم
+   الأقرب موعدًا أولًا (deadline في outbound).
+
+الدفعة = كل الإغلاقات المخططة لنفس اللحظة في هذه العملية. بعد كل دفعة: كم تأخر كل إغلاق عن موعده
+(p50/p95/max) في اللوج و /queue_stats و /metrics، والمعدل المحقق فعلًا يُستعمل لحساب lead الدفعات القادمة.
+القروبات التي لم يصلها التنبيه مبكرًا (إعادة تشغيل، إعادة محاولة) تأخذه مع الإغلاق كالسابق.
+"""
+import logging
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+from zoneinfo import ZoneInfo
+
+import broadcast
+import database as db
+import health
+import metrics
+import registry
+import sharding
+from config import BROADCAST_RATE, BURST_MAX_LEAD, BURST_MIN_LEAD, TIMEZONE
+from utils import send_notice
+
+logger = logging.getLogger(__name__)
+
+tz = ZoneInfo(TIMEZONE)
+
+LEAD_FACTOR = 1.2
+# إعادة جدولة التنبيهات فقط إذا تقدم موعد بدئها بأكثر من هذا (ثوانٍ) مع نمو الدفعة أثناء التخطيط
+RESCHEDULE_SECONDS = 1.0
+
+
+class Cohort:
+    __slots__ = ("at", "chats", "taken", "lateness", "other", "lead", "expected", "noticed",
+                 "notice_at", "notice_job", "started", "reported")
+
+    def __init__(self, at: float):
+        self.at = at
+        self.chats: Set[int] = set()
+        self.taken: Set[int] = set()  # التنبيه أُرسل (أو أُخذ) لهذه الشاتات
+        self.lateness: List[float] = []
+        self.other = 0  # إغلاقات لم تُطبق (فشل / مطبق مسبقًا / متوقف)
+        self.lead = 0.0
+        self.expected = 0
+        self.noticed = 0
+        self.notice_at = 0.0
+        self.notice_job = None
+        self.started = False
+        self.reported = False
+
+
+_cohorts: Dict[float, Cohort] = {}
+_rate = float(BROADCAST_RATE)
+last_report: Optional[dict] = None
+
+
+def lead_for(n: int) -> float:
+    return min(BURST_MAX_LEAD, max(BURST_MIN_LEAD, n / _rate * LEAD_FACTOR))
+
+
+def plan(job_queue, chat_id: int, at: float):
+    """
+    تسجيل إغلاق مخطط في دفعته (الموعد والنص في registry). موعد بدء التنبيهات (at - lead) يتقدم
+    مع نمو الدفعة أثناء التخطيط؛ الدفعة تبقى حتى BURST_MAX_LEAD بعد موعدها (تقرير + منع تكرار التنبيه).
+    """
+    cohort = _cohorts.get(at)
+    if cohort is None:
+        cohort = _cohorts[at] = Cohort(at)
+        job_queue.run_once(_report_job, when=max(0.0, at + BURST_MAX_LEAD - time.time()), name=f"burst:{at:.0f}", data=at)
+    cohort.chats.add(chat_id)
+    if cohort.started:
+        return  # التنبيهات بدأت: هذا القروب يأخذ تنبيهه مع الإغلاق
+    lead = lead_for(len(cohort.chats))
+    if cohort.notice_job is None or at - lead < cohort.notice_at - RESCHEDULE_SECONDS:
+        if cohort.notice_job is not None:
+            cohort.notice_job.schedule_removal()
+        cohort.lead, cohort.notice_at = lead, at - lead
+        cohort.notice_job = job_queue.run_once(
+            _notice_job, when=max(0.0, cohort.notice_at - time.time()), name=f"burst:{at:.0f}", data=at
+        )
+
+
+def _planned(chat_id: int, at: float) -> Optional[str]:
+    """نص التنبيه إن كان الانتقال القادم للقروب (registry) ما زال هذا الإغلاق؛ وإلا None."""
+    g = registry.get(chat_id)
+    return g.text if g is not None and g.action == "close" and g.at == at else None
+
+
+def _members(cohort: Cohort) -> List[int]:
+    """القروبات التي ما زال إغلاقها القادم هو هذه الدفعة (ومملوكة لهذه العملية وغير متوقفة)."""
+    return [
+        c for c in cohort.chats
+        if _planned(c, cohort.at) is not None and sharding.owns(c) and health.allowed(c)
+    ]
+
+
+async def _notice_job(ctx):
+    cohort = _cohorts.get(ctx.job.data)
+    if cohort is None or cohort.started:
+        return
+    cohort.started = True
+    members = _members(cohort)
+    cohort.expected = len(members)
+    states = await db.get_states_db(members)
+    targets = []
+    for c in members:
+        # مغلق أصلًا أو حُذف القروب -> لا تنبيه
+        if states[c].get("closed") or await db.get_group_db(c) is None:
+            continue
+        targets.append((c, await db.get_group_thread_db(c)))
+
+    async def notify(chat_id, thread_id, call):
+        text = _planned(chat_id, cohort.at)
+        # أُعيد تخطيط القروب، أو الإغلاق نفسه بدأ (التنبيهات تأخرت) فيرسله مع الإغلاق
+        if text is None or not take_notice(chat_id, cohort.at):
+            return broadcast.NOOP
+        if not await send_notice(chat_id, thread_id, ctx, text, cohort.at):
+            # التنبيه لم يصل: الإغلاق نفسه يرسله
+            cohort.taken.discard(chat_id)
+            raise RuntimeError("notice failed")
+        return broadcast.OK  # send_notice سجّل النجاح في health
+
+    start = time.time()
+    res = await broadcast.fan_out(targets, notify)
+    cohort.noticed = res.sent
+    logger.info("burst %s: %d notices in %.1fs, %.1fs before the deadline (lead %.0fs, %d failed)",
+                _fmt(cohort.at), res.sent, time.time() - start, cohort.at - time.time(), cohort.lead, res.failed)
+
+
+def take_notice(chat_id: int, at: Optional[float]) -> bool:
+    """
+    True لمن يجب أن يرسل رسالة التنبيه (مرة واحدة لكل قروب في الدفعة): مرحلة التنبيه أو
+    الإغلاق نفسه إن سبقها. خارج الدفعات (at=None، إعادة محاولة) دائمًا True.
+    """
+    cohort = _cohorts.get(at) if at is not None else None
+    if cohort is None or chat_id not in cohort.chats:
+        return True
+    if chat_id in cohort.taken:
+        return False
+    cohort.taken.add(chat_id)
+    return True
+
+
+def landed(chat_id: int, at: Optional[float], applied: bool):
+    """بعد الإغلاق المجدول: تسجيل كم تأخر عن موعده؛ آخر قروب في الدفعة يُصدر التقرير."""
+    cohort = _cohorts.get(at) if at is not None else None
+    if applied and at is not None:
+        lateness = max(0.0, time.time() - at)
+        metrics.CLOSE_LANDED.observe(lateness)
+        if cohort is not None:
+            cohort.lateness.append(lateness)
+    elif cohort is not None:
+        cohort.other += 1
+    if cohort is not None and cohort.expected and len(cohort.lateness) + cohort.other >= cohort.expected:
+        _report(cohort)
+
+
+async def _report_job(ctx):
+    cohort = _cohorts.pop(ctx.job.data, None)
+    if cohort is not None:
+        _report(cohort)
+
+
+def _quantile(values: List[float], q: float) -> float:
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def _report(cohort: Cohort):
+    global _rate, last_report
+    if cohort.reported:
+        return
+    cohort.reported = True
+    values = sorted(cohort.lateness)
+    applied = len(values)
+    # المعدل المحقق: فقط إذا كانت الدفعة كبيرة بما يكفي لتشبع الطابور (> ثانيتين من النداءات)
+    if applied >= 2 * _rate and values[-1] > 0:
+        measured = applied / values[-1]
+        _rate = min(float(BROADCAST_RATE), max(1.0, 0.5 * _rate + 0.5 * measured))
+        metrics.BURST_RATE.set(_rate)
+    last_report = {
+        "at": cohort.at,
+        "groups": cohort.expected,
+        "lead": cohort.lead,
+        "noticed": cohort.noticed,
+        "applied": applied,
+        "other": cohort.other,
+        "p50": _quantile(values, 0.5),
+        "p95": _quantile(values, 0.95),
+        "max": values[-1] if values else 0.0,
+        "rate": _rate,
+    }
+    logger.info(
+        "burst %s: %d/%d closed (%d other), lateness p50=%.1fs p95=%.1fs max=%.1fs, %d notices %.0fs ahead, rate %.1f/s",
+        _fmt(cohort.at), applied, cohort.expected, cohort.other, last_report["p50"], last_report["p95"],
+        last_report["max"], cohort.noticed, cohort.lead, _rate,
+    )
+
+
+def _fmt(at: float) -> str:
+    return datetime.fromtimestamp(at, tz).strftime("%H:%M")
+
+
+def report_text() -> Optional[str]:
+    """سطر لـ /queue_stats عن آخر دفعة إغلاق."""
+    r = last_report
+    if r is None:
+        return None
+    return (
+        f"آخر دفعة إغلاق ({_fmt(r['at'])}): {r['applied']}/{r['groups']} قروب، "
+        f"التأخر p50 {r['p50']:.1f}s / p95 {r['p95']:.1f}s / الأقصى {r['max']:.1f}s، "
+        f"التنبيهات قبل {r['lead']:.0f}s، المعدل {r['rate']:.1f}/s"
+    )
@@ -2,6 +2,10 @@ import os
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 OWNER_ID = int(os.getenv("OWNER_ID", "0"))
+# التخزين: mongo (الافتراضي) | sqlite (ملف محلي، لنشر على خادم واحد) | memory (اختبارات/تجارب، لا شيء يُحفظ)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mongo")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "data/prayerbot.sqlite3")
+SQLITE_COMMIT_MS = int(os.getenv("SQLITE_COMMIT_MS", "50"))
 MONGO_URI = os.getenv("MONGO_URI")
 DB_NAME = os.getenv("DB_NAME", "prayerbot")
 RENDER_EXTERNAL_URL = os.getenv("RENDER_EXTERNAL_URL")
@@ -10,3 +14,55 @@ TIMEZONE = os.getenv("TIMEZONE", "Africa/Algiers")
 LAT = float(os.getenv("LAT", "36.7538"))
 LON = float(os.getenv("LON", "3.0588"))
 METHOD = int(os.getenv("PRAYER_METHOD", "3"))
+TIMES_CACHE_FILE = os.getenv("TIMES_CACHE_FILE", "data/prayer_times.json")
+# جدول الأوقات السنوي المحسوب مسبقًا (timetable.py)
+TIMETABLE_DIR = os.getenv("TIMETABLE_DIR", "data/timetable")
+# نسخة محلية من الأدمن والقروبات لتسخين الكاش عند التشغيل البارد ("" لتعطيلها)
+SNAPSHOT_FILE = os.getenv("SNAPSHOT_FILE", "data/snapshot.json")
+PRAYER_SOURCE = os.getenv("PRAYER_SOURCE", "api")  # api (Aladhan + fallback محلي) أو local
+MONGO_POOL_SIZE = int(os.getenv("MONGO_POOL_SIZE", "50"))
+MONGO_TIMEOUT_MS = int(os.getenv("MONGO_TIMEOUT_MS", "10000"))
+# الإرسال الجماعي (حدود Bot API: ~30 رسالة/ثانية عامة، ~1/ثانية لكل شات)
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+PER_CHAT_RATE = float(os.getenv("PER_CHAT_RATE", "1"))
+PER_CHAT_BURST = float(os.getenv("PER_CHAT_BURST", "3"))
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", "3"))
+# عدد التحديثات (أوامر/رسائل) التي تُعالج بالتوازي؛ تحديثات نفس الشات تبقى بالترتيب
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "16"))
+# الإغلاق المجدول لعدة قروبات في نفس اللحظة: رسائل التنبيه تُرسل مبكرًا بين هذين الحدين (ثوانٍ، انظر burst.py)
+BURST_MIN_LEAD = float(os.getenv("BURST_MIN_LEAD", "5"))
+BURST_MAX_LEAD = float(os.getenv("BURST_MAX_LEAD", "600"))
+# كاش الأدمن وربط chat->thread (ثوانٍ)
+CACHE_TTL = int(os.getenv("CACHE_TTL", "300"))
+CACHE_POLL_SECONDS = int(os.getenv("CACHE_POLL_SECONDS", "30"))
+# وضع التشغيل: single (كل شيء في عملية واحدة) | front (webhook وأوامر فقط) | worker (جدولة shards)
+WORKER_MODE = os.getenv("WORKER_MODE", "single")
+WORKER_ID = os.getenv("WORKER_ID") or f"{os.uname().nodename}-{os.getpid()}"
+NUM_SHARDS = int(os.getenv("NUM_SHARDS", "32"))
+LEASE_SECONDS = int(os.getenv("LEASE_SECONDS", "30"))
+# الشاتات الميتة: عدد الأخطاء الدائمة المتتالية قبل إيقاف الإرسال للشات، ومدة الانتظار قبل تجربته مجددًا (ساعات)
+DEAD_CHAT_THRESHOLD = int(os.getenv("DEAD_CHAT_THRESHOLD", "3"))
+DEAD_CHAT_PROBE_HOURS = float(os.getenv("DEAD_CHAT_PROBE_HOURS", "24"))
+# تسجيل تفاصيل مراحل tick الجدولة إذا تجاوز هذه المدة (ثوانٍ؛ 0 لتعطيله)
+SLOW_TICK_SECONDS = float(os.getenv("SLOW_TICK_SECONDS", "5"))
+# اتصالات HTTP (transport.py): pool لنداءات الجدولة والأوامر، و pool منفصل للإرسال الجماعي.
+# يكفي BROADCAST_RATE × زمن النداء؛ pool أكبر من الحاجة يبطئ كل نداء (httpx يفحص كل اتصالاته عند كل طلب)
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "32"))
+HTTP_BULK_POOL_SIZE = int(os.getenv("HTTP_BULK_POOL_SIZE", "16"))
+# مدة بقاء الاتصال الخامل مفتوحًا (ثوانٍ)، و HTTP/2 (يتطلب python-telegram-bot[http2])
+HTTP_KEEPALIVE = float(os.getenv("HTTP_KEEPALIVE", "120"))
+HTTP2 = os.getenv("HTTP2", "0") == "1"
+# المهل (ثوانٍ): الاتصال، القراءة الافتراضية، وانتظار اتصال حر من الـ pool
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "5"))
+# عدد طلبات Aladhan المتزامنة عند بناء الجدول السنوي
+ALADHAN_CONCURRENCY = int(os.getenv("ALADHAN_CONCURRENCY", "4"))
+# سجل الأحداث (events.py): كتابة دفعة كل EVENTS_FLUSH_SECONDS أو عند EVENTS_BATCH حدث، الاحتفاظ بالأيام،
+# والحد الأقصى في الذاكرة إن تعذرت الكتابة؛ انتقال "في وقته" إذا تأخر EVENTS_ON_TIME_SECONDS أو أقل
+EVENTS_FLUSH_SECONDS = float(os.getenv("EVENTS_FLUSH_SECONDS", "5"))
+EVENTS_BATCH = int(os.getenv("EVENTS_BATCH", "1000"))
+EVENTS_TTL_DAYS = float(os.getenv("EVENTS_TTL_DAYS", "30"))
+EVENTS_MAX_BUFFER = int(os.getenv("EVENTS_MAX_BUFFER", "100000"))
+EVENTS_ON_TIME_SECONDS = float(os.getenv("EVENTS_ON_TIME_SECONDS", "60"))
@@ -0,0 +1,8 @@
+# conftest.py
+import os
+
+# الاختبارات لا تلمس Mongo: database.py يُحمَّل فوق التخزين في الذاكرة (storage.py)
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+# test_mongo.py سكربت يدوي لفحص الاتصال بـ MONGO_URI (ينهي العملية بدونه)، ليس اختبارًا
+collect_ignore = ["test_mongo.py"]
@@ -1,53 +1,644 @@
-from pymongo import MongoClient
-from config import MONGO_URI, DB_NAME
-from typing import Optional
+from pymongo import AsyncMongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from config import (MONGO_URI, DB_NAME, MONGO_POOL_SIZE, MONGO_TIMEOUT_MS, CACHE_TTL, CACHE_POLL_SECONDS,
+                    STORAGE_BACKEND, SQLITE_PATH, SQLITE_COMMIT_MS, WORKER_MODE, SNAPSHOT_FILE, EVENTS_TTL_DAYS)
+from typing import Dict, Iterable, List, Optional, Tuple
+import asyncio
+import functools
+import json
+import logging
+import os
+import secrets
 import time
 
-if not MONGO_URI:
-    raise RuntimeError("MONGO_URI is not set in environment")
+import metrics
+import registry
+import storage
 
-client = MongoClient(MONGO_URI)
-db = client[DB_NAME]
+logger = logging.getLogger(__name__)
+
+if STORAGE_BACKEND == "mongo":
+    if not MONGO_URI:
+        raise RuntimeError("MONGO_URI is not set in environment")
+    # عميل غير متزامن: كل الدوال async ولا تحجز event loop الخاص بـ Telegram
+    client = AsyncMongoClient(
+        MONGO_URI,
+        connect=False,
+        maxPoolSize=MONGO_POOL_SIZE,
+        serverSelectionTimeoutMS=MONGO_TIMEOUT_MS,
+        connectTimeoutMS=MONGO_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_TIMEOUT_MS,
+    )
+    db = client[DB_NAME]
+else:
+    # sqlite / memory بنفس واجهة المجموعات (storage.py): كل الدوال أدناه تعمل كما هي
+    if WORKER_MODE != "single":
+        # العمّال المتعددون يتشاركون leases/commands عبر القاعدة: يحتاجون MongoDB
+        raise RuntimeError(f"STORAGE_BACKEND={STORAGE_BACKEND} requires WORKER_MODE=single")
+    client = None
+    db = storage.open_store(STORAGE_BACKEND, SQLITE_PATH, SQLITE_COMMIT_MS)
 
 admins_col = db["admins"]
 groups_col = db["groups"]
 state_col = db["state"]
+broadcasts_col = db["broadcasts"]
+broadcast_targets_col = db["broadcast_targets"]
+meta_col = db["meta"]
+jobs_col = db["jobs"]
+leases_col = db["leases"]
+workers_col = db["workers"]
+commands_col = db["commands"]
+chat_health_col = db["chat_health"]
+events_col = db["events"]
+
+
+class TTLCache:
+    """قيمة محمّلة بالكامل من Mongo تبقى صالحة ttl ثانية أو حتى invalidate()."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.value = None
+        self.loaded_at = 0.0
+
+    def get(self):
+        if self.value is not None and time.monotonic() - self.loaded_at < self.ttl:
+            return self.value
+        return None
+
+    def set(self, value):
+        self.value = value
+        self.loaded_at = time.monotonic()
+
+    def invalidate(self):
+        self.value = None
+
+
+admins_cache = TTLCache(CACHE_TTL)  # set(user_id)
+# القروبات: registry.py (سجل مقيم يُحمَّل على دفعات ويُحدَّث في مكانه، بدون TTL)
+GROUP_SETTINGS = registry.SETTINGS
+GROUPS_BATCH = 1000
+_invalidation_task: Optional[asyncio.Task] = None
+_groups_task: Optional[asyncio.Task] = None
+_state_index_task: Optional[asyncio.Task] = None
+# إصدارات الكاش التي كتبتها هذه العملية (ولم يرها _poll_version بعد): طبّقناها محليًا فلا إعادة تحميل لها
+_own_versions: set = set()
+
+
+def _state_index() -> asyncio.Task:
+    """فهرس state.chat_id الفريد (مرة واحدة؛ بعد فشل يُعاد عند الطلب التالي)."""
+    global _state_index_task
+    if _state_index_task is None or (_state_index_task.done() and
+                                     (_state_index_task.cancelled() or _state_index_task.exception() is not None)):
+        _state_index_task = asyncio.create_task(state_col.create_index("chat_id", unique=True))
+    return _state_index_task
+
+async def state_index_ready():
+    """
+    begin_transition_db يعتمد على الفهرس الفريد ليتحول upsert لنية قديمة إلى DuplicateKeyError بدل وثيقة
+    حالة ثانية؛ فأول انتقال ينتظره حتى لو بدأ قبل أن تنتهي ensure_indexes (warm_up بالتوازي).
+    """
+    await asyncio.shield(_state_index())
+
+
+async def ensure_indexes():
+    """فهارس chat_id/user_id (تُنشأ عند التشغيل؛ لا شيء يحدث إن كانت موجودة)."""
+    await admins_col.create_index("user_id", unique=True)
+    await groups_col.create_index("chat_id", unique=True)
+    await state_index_ready()
+    await broadcasts_col.create_index("state")
+    await broadcast_targets_col.create_index([("job_id", 1), ("chat_id", 1)], unique=True)
+    await broadcast_targets_col.create_index([("job_id", 1), ("status", 1)])
+    await commands_col.create_index([("shard", 1), ("created_at", 1)])
+    await chat_health_col.create_index("chat_id", unique=True)
+    await events_col.create_index([("actual", 1)])
+    if client is not None:
+        # TTL: MongoDB يحذف الأحداث الأقدم من EVENTS_TTL_DAYS بنفسه (sqlite/memory: prune_events_db)
+        await events_col.create_index("ts", expireAfterSeconds=int(EVENTS_TTL_DAYS * 86400))
+
+
+async def close():
+    global _invalidation_task
+    if _invalidation_task is not None:
+        _invalidation_task.cancel()
+        _invalidation_task = None
+    if _groups_task is not None:
+        _groups_task.cancel()
+    if client is not None:
+        await client.close()
+    else:
+        await db.close()
+
+
+# Caches: إبطال عبر change streams (عند توفرها) أو عبر عدّاد إصدار في meta (polling)
+async def _bump_cache_version():
+    doc = await meta_col.find_one_and_update({"_id": "cache_version"}, {"$inc": {"v": 1}}, upsert=True,
+                                             return_document=ReturnDocument.AFTER)
+    _own_versions.add(doc["v"])
+
+
+async def _watch_changes():
+    pipeline = [{"$match": {"ns.coll": {"$in": [admins_col.name, groups_col.name]}}}]
+    async with await db.watch(pipeline, full_document="updateLookup") as stream:
+        logger.info("cache invalidation: using change streams")
+        async for change in stream:
+            if change["ns"]["coll"] == admins_col.name:
+                admins_cache.invalidate()
+            elif change.get("fullDocument"):
+                # القروب المتغير فقط؛ الحذف لا يحمل chat_id -> إعادة تحميل
+                registry.put(change["fullDocument"])
+            else:
+                _refresh_groups()
+
+
+async def _poll_version():
+    logger.info("cache invalidation: polling every %ss", CACHE_POLL_SECONDS)
+    last = None
+    while True:
+        try:
+            doc = await meta_col.find_one({"_id": "cache_version"})
+            version = doc.get("v") if doc else 0
+            # إعادة التحميل فقط إن كتبت عملية أخرى أحد الإصدارات الجديدة (كتاباتنا طُبقت على registry محليًا)
+            if last is not None and version != last and (
+                    version < last or any(v not in _own_versions for v in range(last + 1, version + 1))):
+                admins_cache.invalidate()
+                _refresh_groups()
+            _own_versions.difference_update([v for v in _own_versions if v <= version])
+            last = version
+        except Exception:
+            logger.warning("cache invalidation: poll failed", exc_info=True)
+        await asyncio.sleep(CACHE_POLL_SECONDS)
+
+
+async def _invalidation_loop():
+    # change streams في Mongo فقط؛ ملف sqlite المشترك بين عمليات نفس الخادم يُراقب بالـ polling
+    if client is not None:
+        try:
+            await _watch_changes()
+        except OperationFailure as e:
+            # standalone mongod لا يدعم change streams
+            logger.info("cache invalidation: change streams unavailable (%s)", e.code)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.warning("cache invalidation: change stream failed", exc_info=True)
+    await _poll_version()
+
+
+def start_cache_invalidation():
+    """تشغيل مهمة إبطال الكاش بين عدة نسخ من البوت تشترك في نفس القاعدة."""
+    global _invalidation_task
+    if STORAGE_BACKEND == "memory":
+        # الذاكرة خاصة بهذه العملية: لا نسخ أخرى لإبطال كاشها
+        return None
+    if _invalidation_task is None:
+        _invalidation_task = asyncio.create_task(_invalidation_loop())
+    return _invalidation_task
+
 
 # Admins
-def add_admin_db(user_id: int):
-    admins_col.update_one({"user_id": user_id}, {"$set": {"user_id": user_id}}, upsert=True)
+async def add_admin_db(user_id: int):
+    await admins_col.update_one({"user_id": user_id}, {"$set": {"user_id": user_id}}, upsert=True)
+    cached = admins_cache.get()
+    if cached is not None:
+        cached.add(user_id)
+    await _bump_cache_version()
 
-def remove_admin_db(user_id: int):
-    admins_col.delete_one({"user_id": user_id})
+async def remove_admin_db(user_id: int):
+    await admins_col.delete_one({"user_id": user_id})
+    cached = admins_cache.get()
+    if cached is not None:
+        cached.discard(user_id)
+    await _bump_cache_version()
 
-def get_admins():
-    return [d["user_id"] for d in admins_col.find({}, {"user_id": 1})]
+async def get_admins():
+    return [d["user_id"] async for d in admins_col.find({}, {"user_id": 1})]
 
-def is_admin_db(user_id: int) -> bool:
-    return admins_col.find_one({"user_id": user_id}) is not None
+async def is_admin_db(user_id: int) -> bool:
+    admins = admins_cache.get()
+    if admins is None:
+        admins = set(await get_admins())
+        admins_cache.set(admins)
+    return user_id in admins
 
-# Groups (chat + optional thread/topic id)
-def add_group_db(chat_id: int, thread_id: Optional[int] = None):
-    groups_col.update_one({"chat_id": chat_id}, {"$set": {"chat_id": chat_id, "thread_id": thread_id}}, upsert=True)
+# Groups (chat + optional thread/topic id + optional settings: lat/lon/method/timezone/durations)
+def _group_projection() -> dict:
+    return {"_id": 0, "chat_id": 1, "thread_id": 1, **{k: 1 for k in GROUP_SETTINGS}}
 
-def get_groups_db():
-    out = {}
-    for doc in groups_col.find({}):
-        out[str(doc["chat_id"])] = {
-            "chat_id": doc["chat_id"],
-            "thread_id": doc.get("thread_id")
-        }
-    return out
+async def load_groups_db():
+    """
+    كل القروبات إلى registry باستعلام واحد يُقرأ على دفعات (GROUPS_BATCH وثيقة لكل round-trip)
+    مع ترك الـ event loop بين الدفعات. السجلات الموجودة تُحدَّث في مكانها (انتقالها القادم يبقى)،
+    والقروبات التي لم تعد في القاعدة تُحذف.
+    """
+    registry.begin_load()
+    n = 0
+    async for doc in groups_col.find({}, _group_projection()).batch_size(GROUPS_BATCH):
+        registry.put(doc)
+        n += 1
+        if n % GROUPS_BATCH == 0:
+            await asyncio.sleep(0)
+    registry.end_load()
+    return n
+
+def _refresh_groups() -> asyncio.Task:
+    """تحميل القروبات (مرة واحدة حتى لو طلبه عدة مستدعين)."""
+    global _groups_task
+    if _groups_task is None or _groups_task.done():
+        _groups_task = asyncio.create_task(load_groups_db())
+        _groups_task.add_done_callback(_groups_loaded)
+    return _groups_task
+
+def _groups_loaded(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("groups: load failed", exc_info=task.exception())
+
+async def groups_ready():
+    """أول تحميل ينتظره المستدعي؛ بعده التحديث (تغييرات من عمليات أخرى) في الخلفية."""
+    if not registry.loaded:
+        await asyncio.shield(_refresh_groups())
+
+async def add_group_db(chat_id: int, thread_id: Optional[int] = None, settings: Optional[dict] = None):
+    fields = {"chat_id": chat_id, "thread_id": thread_id}
+    fields.update({k: v for k, v in (settings or {}).items() if k in GROUP_SETTINGS})
+    await groups_col.update_one({"chat_id": chat_id}, {"$set": fields}, upsert=True)
+    registry.update(chat_id, fields)
+    await _bump_cache_version()
+
+async def update_group_settings_db(chat_id: int, settings: dict) -> bool:
+    fields = {k: v for k, v in settings.items() if k in GROUP_SETTINGS}
+    res = await groups_col.update_one({"chat_id": chat_id}, {"$set": fields})
+    if res.matched_count:
+        registry.update(chat_id, fields)
+    await _bump_cache_version()
+    return res.matched_count > 0
+
+async def get_group_db(chat_id: int, fresh: bool = False) -> Optional[dict]:
+    """
+    قروب واحد من registry. إن لم يكن فيه (أو fresh) يُقرأ من القاعدة ويُضاف: تغيير من عملية أخرى
+    (/bind أو /setloc في الواجهة) قد لا يكون وصل بعد عبر change stream أو polling.
+    """
+    await groups_ready()
+    info = registry.info(chat_id)
+    if info is None or fresh:
+        doc = await groups_col.find_one({"chat_id": chat_id}, _group_projection())
+        if doc is None:
+            return None
+        registry.put(doc)
+        info = registry.info(chat_id)
+    return info
+
+async def get_group_thread_db(chat_id: int) -> Optional[int]:
+    await groups_ready()
+    g = registry.get(chat_id)
+    if g is None:
+        return (await get_group_db(chat_id) or {}).get("thread_id")
+    return g.thread_id
+
+async def get_group_targets_db() -> List[Tuple[int, Optional[int]]]:
+    """(chat_id, thread_id) لكل القروبات المربوطة."""
+    await groups_ready()
+    return registry.targets()
+
+async def remove_group_db(chat_id: int):
+    await groups_col.delete_one({"chat_id": chat_id})
+    await jobs_col.delete_one({"_id": f"group:{chat_id}"})
+    registry.remove(chat_id)
+    await _bump_cache_version()
 
-def remove_group_db(chat_id: int):
-    groups_col.delete_one({"chat_id": chat_id})
+async def remove_groups_db(chat_ids: List[int]):
+    """حذف عدة قروبات دفعة واحدة (مع jobs وحالة وسجل أخطاء كل قروب)."""
+    if not chat_ids:
+        return
+    await groups_col.delete_many({"chat_id": {"$in": chat_ids}})
+    await jobs_col.delete_many({"_id": {"$in": [f"group:{c}" for c in chat_ids]}})
+    await state_col.delete_many({"chat_id": {"$in": chat_ids}})
+    await chat_health_col.delete_many({"chat_id": {"$in": chat_ids}})
+    for chat_id in chat_ids:
+        registry.remove(chat_id)
+    await _bump_cache_version()
 
-# State: closed flag + last_action timestamp (unix)
-def update_state_db(chat_id: int, closed: bool):
-    state_col.update_one({"chat_id": chat_id}, {"$set": {"chat_id": chat_id, "closed": bool(closed), "last_action": int(time.time())}}, upsert=True)
+# Snapshot: نسخة محلية من كاش الأدمن والقروبات تملؤه فورًا عند التشغيل البارد،
+# قبل أول round-trip للقاعدة؛ load_caches_db يستبدلها بما في القاعدة ثم يحدّث الملف.
+def load_snapshot() -> bool:
+    if not SNAPSHOT_FILE or not os.path.exists(SNAPSHOT_FILE):
+        return False
+    try:
+        with open(SNAPSHOT_FILE, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+        admins_cache.set(set(raw["admins"]))
+        registry.reset(raw["groups"].values())
+        logger.info("snapshot: %d admins, %d groups from %s", len(raw["admins"]), len(raw["groups"]), SNAPSHOT_FILE)
+        return True
+    except Exception:
+        logger.exception("snapshot: failed to read %s", SNAPSHOT_FILE)
+        return False
 
-def get_state_db(chat_id: int):
-    doc = state_col.find_one({"chat_id": chat_id})
+
+def _write_snapshot(raw: dict):
+    """كتابة ذرية (tmp ثم replace)."""
+    try:
+        folder = os.path.dirname(SNAPSHOT_FILE)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        tmp = SNAPSHOT_FILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(raw, f)
+        os.replace(tmp, SNAPSHOT_FILE)
+    except Exception:
+        logger.exception("snapshot: failed to write %s", SNAPSHOT_FILE)
+
+
+async def save_snapshot():
+    admins = admins_cache.get()
+    if not SNAPSHOT_FILE or admins is None or not registry.loaded:
+        return
+    # نسخة في الـ event loop (السجل يتغير)، والكتابة نفسها في thread
+    raw = {"admins": list(admins), "groups": {str(g.chat_id): g.info() for g in registry.groups()}}
+    await asyncio.to_thread(_write_snapshot, raw)
+
+
+async def load_caches_db():
+    """تحميل الأدمن والقروبات من القاعدة (استعلامان متوازيان) ثم تحديث الـ snapshot."""
+    admins, _ = await asyncio.gather(get_admins(), _refresh_groups())
+    admins_cache.set(set(admins))
+    await save_snapshot()
+
+
+# State: closed flag (المطبّق) + last_action timestamp (unix)؛ الكتابة فقط عبر begin/finish_transition_db
+async def get_state_db(chat_id: int):
+    doc = await state_col.find_one({"chat_id": chat_id})
     if not doc:
         return {"closed": False, "last_action": 0}
-    return {"closed": bool(doc.get("closed", False)), "last_action": int(doc.get("last_action", 0))}
+    return _state_from_doc(doc)
+
+
+def _state_from_doc(doc) -> dict:
+    return {
+        "closed": bool(doc.get("closed", False)),
+        "last_action": int(doc.get("last_action", 0)),
+        "desired": doc.get("desired"),
+        "version": int(doc.get("version", 0)),
+        "op_at": float(doc.get("op_at", 0)),
+    }
+
+
+# State machine: desired (آخر نية) / closed (الحالة المطبّقة فعلًا) / version (عدد الانتقالات المطبّقة)
+# op_at: موعد النية الأحدث — نية أقدم منه (job متأخر أو مكرر) تُرفض.
+async def begin_transition_db(chat_id: int, closed: bool, at: float) -> Optional[dict]:
+    """
+    تسجيل النية (desired=closed) إن لم تكن هناك نية أحدث من at.
+    يُرجع الحالة بعد التسجيل، أو None إن كانت النية قديمة (خارج الترتيب).
+    """
+    await state_index_ready()
+    try:
+        doc = await state_col.find_one_and_update(
+            {"chat_id": chat_id, "op_at": {"$not": {"$gt": at}}},
+            {"$set": {"desired": bool(closed), "op_at": at}, "$setOnInsert": {"closed": False, "version": 0}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # الوثيقة موجودة لكن op_at فيها أحدث من at
+        return None
+    return _state_from_doc(doc)
+
+async def finish_transition_db(chat_id: int, closed: bool):
+    """تسجيل أن الانتقال طُبّق فعلًا على Telegram."""
+    await state_col.update_one(
+        {"chat_id": chat_id},
+        {"$set": {"closed": bool(closed), "last_action": int(time.time())}, "$inc": {"version": 1}},
+    )
+
+
+async def get_states_db(chat_ids: Optional[Iterable[int]] = None) -> Dict[int, dict]:
+    """
+    حالة عدة قروبات (أو كلها إن كان chat_ids=None) باستعلام find واحد.
+    القروبات التي لا حالة لها تأخذ القيمة الافتراضية.
+    """
+    query = {}
+    if chat_ids is not None:
+        chat_ids = list(chat_ids)
+        query = {"chat_id": {"$in": chat_ids}}
+    out = {doc["chat_id"]: _state_from_doc(doc) async for doc in state_col.find(query)}
+    for chat_id in chat_ids or []:
+        out.setdefault(chat_id, {"closed": False, "last_action": 0})
+    return out
+
+
+
+# Chat health: أخطاء Telegram المتتالية لكل شات (انظر health.py)
+async def get_chat_health_db() -> Dict[int, dict]:
+    return {doc["chat_id"]: doc async for doc in chat_health_col.find({}, {"_id": 0})}
+
+async def save_chat_health_db(chat_id: int, entry: dict):
+    await chat_health_col.update_one({"chat_id": chat_id}, {"$set": dict(entry, chat_id=chat_id)}, upsert=True)
+
+async def clear_chat_health_db(chat_id: int):
+    await chat_health_col.delete_one({"chat_id": chat_id})
+
+
+# Broadcast jobs: سجل لكل مهمة إرسال جماعي + وثيقة لكل هدف (pending/ok/failed/skipped/noop/forwarded)
+# للاستئناف بعد إعادة التشغيل
+async def create_broadcast_db(job: dict, targets: List[Tuple[int, Optional[int]]]) -> dict:
+    job = dict(job)
+    job.update({
+        "_id": secrets.token_hex(4),
+        "state": "running",
+        "total": len(targets),
+        "cursor": 0,
+        "sent": 0,
+        "failed": 0,
+        "skipped": 0,
+        "noop": 0,
+        "forwarded": 0,
+        "created_at": int(time.time()),
+        "updated_at": int(time.time()),
+    })
+    await broadcasts_col.insert_one(job)
+    if targets:
+        await broadcast_targets_col.insert_many(
+            [{"job_id": job["_id"], "chat_id": c, "thread_id": t, "status": "pending"} for c, t in targets],
+            ordered=False,
+        )
+    return job
+
+
+async def get_broadcast_db(job_id: str) -> Optional[dict]:
+    return await broadcasts_col.find_one({"_id": job_id})
+
+
+async def get_running_broadcasts_db() -> List[dict]:
+    return [doc async for doc in broadcasts_col.find({"state": "running"})]
+
+
+async def get_broadcast_targets_db(job_id: str, status: str = "pending") -> List[Tuple[int, Optional[int]]]:
+    cursor = broadcast_targets_col.find({"job_id": job_id, "status": status}, {"chat_id": 1, "thread_id": 1})
+    return [(doc["chat_id"], doc.get("thread_id")) async for doc in cursor]
+
+
+async def get_broadcast_errors_db(job_id: str, limit: int = 8) -> List[str]:
+    cursor = broadcast_targets_col.find({"job_id": job_id, "status": "failed"}, {"chat_id": 1, "error": 1}).limit(limit)
+    return [f"{doc['chat_id']}: {doc.get('error')}" async for doc in cursor]
+
+
+async def checkpoint_broadcast_db(job_id: str, results: List[Tuple[int, str, Optional[str]]]):
+    """حفظ دفعة نتائج [(chat_id, status, error)] (bulk_write واحد) وتقديم المؤشر cursor."""
+    if not results:
+        return
+    ops = [
+        UpdateOne({"job_id": job_id, "chat_id": chat_id}, {"$set": {"status": status, "error": err}})
+        for chat_id, status, err in results
+    ]
+    await broadcast_targets_col.bulk_write(ops, ordered=False)
+    counts = {}
+    for _, status, _ in results:
+        key = "sent" if status == "ok" else status
+        counts[key] = counts.get(key, 0) + 1
+    await broadcasts_col.update_one(
+        {"_id": job_id},
+        {"$inc": dict(counts, cursor=len(results)), "$set": {"updated_at": int(time.time())}},
+    )
+
+
+async def finish_broadcast_db(job_id: str):
+    await broadcasts_col.update_one({"_id": job_id}, {"$set": {"state": "done", "updated_at": int(time.time())}})
+
+
+async def retry_failed_broadcast_db(job_id: str) -> Optional[dict]:
+    """إرجاع الأهداف الفاشلة فقط إلى pending وإعادة المهمة إلى running."""
+    res = await broadcast_targets_col.update_many({"job_id": job_id, "status": "failed"}, {"$set": {"status": "pending", "error": None}})
+    if not res.modified_count:
+        return None
+    return await broadcasts_col.find_one_and_update(
+        {"_id": job_id},
+        {"$inc": {"failed": -res.modified_count, "cursor": -res.modified_count},
+         "$set": {"state": "running", "updated_at": int(time.time())}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+# Jobs: الانتقال القادم لكل قروب (close_job/open_job) مع موعده، لاستعادته بعد إعادة التشغيل
+async def save_jobs_db(records: List[dict]):
+    """records: [{"_id": name, "callback": ..., "at": unix, "data": {...}}] — bulk_write واحد."""
+    if not records:
+        return
+    ops = [UpdateOne({"_id": r["_id"]}, {"$set": r}, upsert=True) for r in records]
+    await jobs_col.bulk_write(ops, ordered=False)
+
+
+async def get_jobs_db() -> List[dict]:
+    return [doc async for doc in jobs_col.find({})]
+
+
+# Sharding: عقود إيجار (leases) على الـ shards + نبض العمّال + أوامر مُحالة من الواجهة (front)
+async def heartbeat_worker_db(worker_id: str, lease_seconds: float) -> int:
+    """تسجيل نبض هذا العامل؛ يُرجع عدد العمّال الأحياء (نبض خلال lease_seconds)."""
+    now = time.time()
+    await workers_col.update_one({"_id": worker_id}, {"$set": {"seen_at": now}}, upsert=True)
+    return await workers_col.count_documents({"seen_at": {"$gt": now - lease_seconds}})
+
+
+async def claim_lease_db(shard: int, worker_id: str, lease_seconds: float) -> Optional[float]:
+    """أخذ/تجديد lease لـ shard إن كانت لنا أو منتهية؛ يُرجع وقت الانتهاء أو None."""
+    now = time.time()
+    expires_at = now + lease_seconds
+    try:
+        doc = await leases_col.find_one_and_update(
+            {"_id": shard, "$or": [{"owner": worker_id}, {"expires_at": {"$lt": now}}]},
+            {"$set": {"owner": worker_id, "expires_at": expires_at}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # الوثيقة موجودة ومملوكة لعامل آخر حي
+        return None
+    return expires_at if doc and doc.get("owner") == worker_id else None
+
+
+async def release_lease_db(shard: int, worker_id: str):
+    await leases_col.update_one({"_id": shard, "owner": worker_id}, {"$set": {"expires_at": 0}})
+
+
+async def push_command_db(shard: int, command: dict):
+    await commands_col.insert_one(dict(command, shard=shard, created_at=time.time()))
+
+
+async def pop_commands_db(shards: Iterable[int], limit: int = 100) -> List[dict]:
+    """سحب الأوامر الموجهة لـ shards معيّنة (كل أمر يُسلَّم لعامل واحد)."""
+    out = []
+    shards = list(shards)
+    while len(out) < limit:
+        doc = await commands_col.find_one_and_delete({"shard": {"$in": shards}}, sort=[("created_at", 1)])
+        if doc is None:
+            break
+        out.append(doc)
+    return out
+
+
+# Events: سجل append-only لنتائج الإغلاق/الفتح/الإرسال (events.py)
+async def insert_events_db(events: List[dict]):
+    """دفعة أحداث بـ insert_many واحد (بدون ترتيب: حدث مكرر لا يوقف الباقي)."""
+    if not events:
+        return
+    if client is None:
+        # ts (تاريخ لفهرس TTL في MongoDB) لا يلزم هنا: التنظيف بـ actual، وsqlite يخزن JSON
+        events = [{k: v for k, v in e.items() if k != "ts"} for e in events]
+    await events_col.insert_many(events, ordered=False)
+
+
+async def prune_events_db(before: float) -> int:
+    """حذف الأحداث الأقدم من before (sqlite/memory فقط؛ في MongoDB فهرس TTL يقوم بذلك)."""
+    if client is not None:
+        return 0
+    return (await events_col.delete_many({"actual": {"$lt": before}})).deleted_count
+
+
+async def get_event_stats_db(since: float) -> Tuple[List[dict], List[dict]]:
+    """
+    إحصاءات الأحداث منذ since (unix) عبر aggregation في القاعدة:
+    - لكل (kind, result): العدد، نسبة on_time، التأخر p50/p95 (latency: [p50, p95]) والأقصى.
+    - أكثر الأخطاء لكل kind: [{"_id": {"kind", "error"}, "n"}].
+    """
+    match = {"$match": {"actual": {"$gt": since}}}
+    group = {
+        "_id": {"kind": "$kind", "result": "$result"},
+        "n": {"$sum": 1},
+        "on_time": {"$avg": "$on_time"},
+        "latency": {"$percentile": {"input": "$latency", "p": [0.5, 0.95], "method": "approximate"}},
+        "max": {"$max": "$latency"},
+    }
+    try:
+        rows = [doc async for doc in await events_col.aggregate([match, {"$group": group}])]
+    except OperationFailure:
+        # MongoDB أقدم من 7.0 (بدون $percentile): القيم نفسها ثم الحساب هنا
+        group["latency"] = {"$push": "$latency"}
+        rows = [doc async for doc in await events_col.aggregate([match, {"$group": group}])]
+        for row in rows:
+            values = sorted(v for v in row["latency"] if v is not None)
+            row["latency"] = [values[min(len(values) - 1, int(p * len(values)))] if values else None for p in (0.5, 0.95)]
+    errors = [doc async for doc in await events_col.aggregate([
+        {"$match": {"actual": {"$gt": since}, "result": "failed"}},
+        {"$group": {"_id": {"kind": "$kind", "error": "$error"}, "n": {"$sum": 1}}},
+        {"$sort": {"n": -1}},
+        {"$limit": 20},
+    ])]
+    return rows, errors
+
+
+# Metrics: كل دوال *_db العامة تُقاس (المدة لكل دالة + عدد الأخطاء)
+def _instrument(name, fn):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        except Exception:
+            metrics.DB_ERRORS.inc(op=name)
+            raise
+        finally:
+            metrics.DB_SECONDS.observe(time.perf_counter() - start, op=name)
+    return wrapper
+
+for _name, _fn in list(globals().items()):
+    if _name.endswith("_db") and asyncio.iscoroutinefunction(_fn):
+        globals()[_name] = _instrument(_name, _fn)
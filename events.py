@@ -0,0 +1,157 @@
+# events.py
+"""
+سجل أحداث append-only لما فعله البوت فعلًا (مجموعة events في القاعدة):
+كل إغلاق/فتح (transitions.apply: مجدول، يدوي، /close_all، استعادة بعد التشغيل) وكل إرسال لقروب في /announce.
+
+- record() يضيف الحدث إلى buffer في الذاكرة فقط: المسار الساخن لا ينتظر القاعدة.
+  مهمة في الخلفية تكتبه بـ insert_many كل EVENTS_FLUSH_SECONDS أو فور بلوغ EVENTS_BATCH حدثًا.
+  إن تعذرت الكتابة يبقى في الـ buffer حتى EVENTS_MAX_BUFFER، ثم يُسقط الأقدم (prayerbot_events_dropped_total).
+- الحدث: kind (close/open/broadcast)، chat_id، prayer، scheduled (الموعد المخطط، unix)، actual،
+  latency = actual - scheduled، on_time (1 إن latency <= EVENTS_ON_TIME_SECONDS)، result، error (صنف الخطأ)، worker،
+  ts (= actual كتاريخ UTC لفهرس TTL في MongoDB؛ يُلتقط عند التسجيل لا عند الكتابة المتأخرة).
+- الاحتفاظ EVENTS_TTL_DAYS يومًا: فهرس TTL في MongoDB؛ sqlite/memory تُنظَّف من هنا مرة كل ساعة.
+- stats_text() لأمر /stats: aggregation pipelines في القاعدة (database.get_event_stats_db).
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import database as db
+import metrics
+from config import (
+    EVENTS_BATCH, EVENTS_FLUSH_SECONDS, EVENTS_MAX_BUFFER, EVENTS_ON_TIME_SECONDS, EVENTS_TTL_DAYS, WORKER_ID,
+)
+
+logger = logging.getLogger(__name__)
+
+CLOSE, OPEN, BROADCAST = "close", "open", "broadcast"
+SENT, FAILED = "sent", "failed"  # نتائج الإرسال؛ الإغلاق/الفتح بنتائج transitions (applied/noop/...)
+PRUNE_SECONDS = 3600
+
+_buffer: List[dict] = []
+_task: Optional[asyncio.Task] = None
+_wake: Optional[asyncio.Event] = None
+_pruned_at = 0.0
+
+
+def record(kind: str, chat_id: int, result: str, scheduled: Optional[float] = None, prayer: Optional[str] = None,
+           error: Optional[str] = None):
+    """تسجيل نتيجة (بدون انتظار). scheduled: الموعد المخطط (unix)، None للتدخل اليدوي وإعادة المحاولة."""
+    now = time.time()
+    latency = max(0.0, now - scheduled) if scheduled is not None else None
+    _buffer.append({
+        "kind": kind,
+        "chat_id": chat_id,
+        "prayer": prayer,
+        "scheduled": scheduled,
+        "actual": now,
+        "latency": latency,
+        "on_time": int(latency <= EVENTS_ON_TIME_SECONDS) if latency is not None else None,
+        "result": result,
+        "error": error,
+        "worker": WORKER_ID,
+        "ts": datetime.fromtimestamp(now, timezone.utc),
+    })
+    if len(_buffer) > EVENTS_MAX_BUFFER:
+        dropped = len(_buffer) - EVENTS_MAX_BUFFER
+        del _buffer[:dropped]
+        metrics.EVENTS_DROPPED.inc(dropped)
+    _start()
+    if len(_buffer) >= EVENTS_BATCH:
+        _wake.set()
+
+
+def _start():
+    global _task, _wake
+    if _task is None or _task.done():
+        _wake = asyncio.Event()
+        _task = asyncio.create_task(_flush_loop(), name="events")
+
+
+async def _flush_loop():
+    while True:
+        try:
+            await asyncio.wait_for(_wake.wait(), EVENTS_FLUSH_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _wake.clear()
+        await flush()
+        await _prune()
+
+
+async def flush():
+    """كتابة الـ buffer على دفعات من EVENTS_BATCH؛ عند الفشل يبقى الباقي للمحاولة التالية."""
+    while _buffer:
+        batch = _buffer[:EVENTS_BATCH]
+        del _buffer[:len(batch)]
+        try:
+            await db.insert_events_db(batch)
+        except Exception:
+            logger.warning("events: failed to write %d events, keeping them for the next flush", len(batch), exc_info=True)
+            _buffer[:0] = batch
+            return
+
+
+async def _prune():
+    global _pruned_at
+    if time.time() - _pruned_at < PRUNE_SECONDS:
+        return
+    _pruned_at = time.time()
+    try:
+        await db.prune_events_db(_pruned_at - EVENTS_TTL_DAYS * 86400)
+    except Exception:
+        logger.warning("events: prune failed", exc_info=True)
+
+
+async def close():
+    """إيقاف مهمة الكتابة وكتابة ما بقي (عند الإيقاف)."""
+    global _task
+    if _task is not None:
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
+        _task = None
+    await flush()
+
+
+@metrics.collector
+def _collect():
+    metrics.EVENTS_BUFFERED.set(len(_buffer))
+
+
+# ---------------- /stats ----------------
+KIND_NAMES = {CLOSE: "الإغلاق", OPEN: "الفتح", BROADCAST: "الإعلانات"}
+RESULT_NAMES = {
+    "applied": "طُبّق", SENT: "أُرسل", "noop": "بدون تغيير", "stale": "قديم", "skipped": "متوقف", FAILED: "فشل",
+}
+# النتائج التي يُحسب لها التأخر ونسبة "في الوقت"
+DONE = ("applied", SENT)
+
+
+def _seconds(v: Optional[float]) -> str:
+    return "-" if v is None else f"{v:.1f}s" if v < 120 else f"{v / 60:.0f}m"
+
+
+async def stats_text(hours: float = 24) -> str:
+    rows, errors = await db.get_event_stats_db(time.time() - hours * 3600)
+    if not rows:
+        return f"📊 لا توجد أحداث في آخر {hours:g} ساعة."
+    by_kind: Dict[str, List[dict]] = {}
+    for row in rows:
+        by_kind.setdefault(row["_id"]["kind"], []).append(row)
+    lines = [f"📊 آخر {hours:g} ساعة"]
+    for kind in sorted(by_kind, key=lambda k: list(KIND_NAMES).index(k) if k in KIND_NAMES else len(KIND_NAMES)):
+        kind_rows = sorted(by_kind[kind], key=lambda r: -r["n"])
+        results = "، ".join(f"{RESULT_NAMES.get(r['_id']['result'], r['_id']['result'])} {r['n']}" for r in kind_rows)
+        lines.append(f"\n{KIND_NAMES.get(kind, kind)}: {sum(r['n'] for r in kind_rows)} ({results})")
+        done = next((r for r in kind_rows if r["_id"]["result"] in DONE), None)
+        if done is not None and done["latency"][0] is not None:
+            p50, p95 = done["latency"]
+            on_time = "" if kind == BROADCAST or done["on_time"] is None else \
+                f"في الوقت (≤{EVENTS_ON_TIME_SECONDS:g}s) {done['on_time'] * 100:.1f}%، "
+            lines.append(f"  {on_time}التأخر p50 {_seconds(p50)} / p95 {_seconds(p95)} / الأقصى {_seconds(done['max'])}")
+        top = [e for e in errors if e["_id"]["kind"] == kind][:3]
+        if top:
+            lines.append("  الأخطاء: " + "، ".join(f"{e['_id'].get('error') or '?'} ×{e['n']}" for e in top))
+    return "\n".join(lines)
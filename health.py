@@ -0,0 +1,137 @@
+# health.py
+"""
+صحة الشاتات: تصنيف أخطاء Telegram لكل شات + backoff أسّي + circuit breaker.
+
+- خطأ دائم (البوت مطرود، لا صلاحيات، الشات/الموضوع محذوف): بعد DEAD_CHAT_THRESHOLD مرات
+  متتالية يُفتح الـ breaker ولا يُرسل للشات شيء حتى تجربة جديدة بعد DEAD_CHAT_PROBE_HOURS.
+- خطأ مؤقت (شبكة، timeout، 429 بعد استنفاد المحاولات): لا يوقف الشات، فقط يطيل مهلة إعادة المحاولة.
+- "not modified" (الموضوع مغلق/مفتوح أصلًا) ليس خطأ.
+- أي نجاح يمسح سجل الشات.
+
+السجل محفوظ في Mongo (chat_health) ويُعاد تحميله كل CACHE_TTL حتى تراه كل العمليات.
+"""
+import logging
+import time
+from typing import Dict, List
+
+from telegram.error import BadRequest, ChatMigrated, Forbidden, TelegramError
+
+import database as db
+from config import CACHE_TTL, DEAD_CHAT_PROBE_HOURS, DEAD_CHAT_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+PERMANENT, TRANSIENT, NOT_MODIFIED = "permanent", "transient", "not_modified"
+
+BACKOFF_BASE = 60  # ثوانٍ
+BACKOFF_MAX = 3600
+
+# رسائل BadRequest التي تعني أن الشات لن ينجح بدون تدخل يدوي
+_PERMANENT_MESSAGES = (
+    "chat not found",
+    "not enough rights",
+    "chat_admin_required",
+    "have no rights",
+    "message thread not found",
+    "topic_deleted",
+    "topic_id_invalid",
+    "group chat was upgraded",
+    "chat_write_forbidden",
+    "need administrator rights",
+)
+
+_entries: Dict[int, dict] = {}
+_loaded_at = 0.0
+
+
+def classify(e: Exception) -> str:
+    if isinstance(e, (Forbidden, ChatMigrated)):
+        return PERMANENT
+    if isinstance(e, BadRequest):
+        msg = str(e).lower()
+        if "not_modified" in msg or "not modified" in msg:
+            return NOT_MODIFIED
+        if any(m in msg for m in _PERMANENT_MESSAGES):
+            return PERMANENT
+    return TRANSIENT
+
+
+async def refresh(force: bool = False):
+    """إعادة تحميل السجل من Mongo إن مضى CACHE_TTL (أو force)."""
+    global _entries, _loaded_at
+    if not force and time.time() - _loaded_at < CACHE_TTL:
+        return
+    try:
+        _entries = await db.get_chat_health_db()
+        _loaded_at = time.time()
+    except Exception:
+        logger.warning("health: failed to load chat health", exc_info=True)
+
+
+def _backoff(failures: int) -> float:
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** max(0, failures - 1))
+
+
+def allowed(chat_id: int) -> bool:
+    """False إذا كان الشات في مهلة بعد أخطاء دائمة (أو الـ breaker مفتوح ولم يحن وقت التجربة)."""
+    e = _entries.get(chat_id)
+    return e is None or not e.get("permanent") or time.time() >= e.get("next_try", 0)
+
+
+def tripped(chat_id: int) -> bool:
+    e = _entries.get(chat_id)
+    return bool(e and e.get("tripped"))
+
+
+def retry_delay(chat_id: int, default: float = BACKOFF_BASE) -> float:
+    """مهلة إعادة المحاولة بعد فشل: تتضاعف مع كل فشل متتالٍ."""
+    e = _entries.get(chat_id)
+    if not e:
+        return default
+    return max(default, e.get("next_try", 0) - time.time())
+
+
+async def record_failure(chat_id: int, e: Exception) -> str:
+    """تسجيل فشل نداء Telegram لهذا الشات؛ يُرجع التصنيف (الأخطاء غير Telegram لا تُسجَّل)."""
+    kind = classify(e)
+    if kind == NOT_MODIFIED or not isinstance(e, TelegramError):
+        return kind
+    now = time.time()
+    entry = dict(_entries.get(chat_id) or {"permanent": 0, "transient": 0, "since": now})
+    entry[kind] = entry.get(kind, 0) + 1
+    entry.update(error=str(e)[:200], kind=kind, updated_at=now)
+    entry["tripped"] = entry["permanent"] >= DEAD_CHAT_THRESHOLD
+    if entry["tripped"]:
+        entry["next_try"] = now + DEAD_CHAT_PROBE_HOURS * 3600
+        if not (_entries.get(chat_id) or {}).get("tripped"):
+            logger.warning("health: circuit open for %s after %d permanent failures: %s", chat_id, entry["permanent"], e)
+    else:
+        entry["next_try"] = now + _backoff(entry["permanent"] + entry["transient"])
+    _entries[chat_id] = entry
+    try:
+        await db.save_chat_health_db(chat_id, entry)
+    except Exception:
+        logger.warning("health: failed to save %s", chat_id, exc_info=True)
+    return kind
+
+
+async def record_success(chat_id: int):
+    if _entries.pop(chat_id, None) is None:
+        return
+    logger.info("health: %s recovered", chat_id)
+    try:
+        await db.clear_chat_health_db(chat_id)
+    except Exception:
+        logger.warning("health: failed to clear %s", chat_id, exc_info=True)
+
+
+def failing() -> List[dict]:
+    """الشاتات التي لها أخطاء مسجلة، المتوقفة أولًا ثم الأكثر فشلًا."""
+    out = [dict(e, chat_id=c) for c, e in _entries.items()]
+    out.sort(key=lambda e: (not e.get("tripped"), -e.get("permanent", 0), -e.get("transient", 0)))
+    return out
+
+
+def forget(chat_ids):
+    for chat_id in chat_ids:
+        _entries.pop(chat_id, None)
@@ -1,25 +1,40 @@
 # main.py
+from time import perf_counter
+_import_started = perf_counter()  # زمن الاستيراد هو أول مرحلة في سجل التشغيل
+
 import logging
 from datetime import datetime, date, time, timedelta
 from zoneinfo import ZoneInfo
 import asyncio
+import signal
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatPermissions
-from telegram.ext import Application, CommandHandler, ContextTypes
-
-import requests
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import Application, CallbackContext, CommandHandler, ContextTypes
 
 # إعدادات محلية - عدّل القيم في config.py (أو استبدل بمتغيرات البيئة)
-from config import BOT_TOKEN, OWNER_ID, TIMEZONE, LAT, LON, METHOD, RENDER_EXTERNAL_URL, PORT
+from config import BOT_TOKEN, OWNER_ID, TIMEZONE, LAT, LON, METHOD, RENDER_EXTERNAL_URL, PORT, WORKER_MODE, SLOW_TICK_SECONDS
 import database as db
-from utils import close_topic_or_lock, reopen_topic_or_unlock
+from prayer_times import PRAYERS, get_prayer_times, close_client as close_times_client, prune as prune_times_cache
+from prayer_calc import METHODS
+import scheduler
+import broadcast
+import sharding
+import outbound
+import transport
+import transitions
+import health
+import metrics
+import webserver
+import updates
+import burst
+import registry
+import events
 
 # Logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
 
-# الصلوات وأسماؤها العربية
-PRAYERS = ["Fajr", "Dhuhr", "Asr", "Maghrib", "Isha"]
+# أسماء الصلوات بالعربية (قائمة PRAYERS في prayer_times.py)
 AR_PRAYER = {
     "Fajr": "الفجر 🌄",
     "Dhuhr": "الظهر ☀️",
@@ -29,146 +44,487 @@ AR_PRAYER = {
 }
 DURATIONS = {"Fajr": 15, "Dhuhr": 15, "Asr": 15, "Maghrib": 15, "Isha": 15}
 
+# أسماء jobs في job_queue
+GROUP_JOB = "group:{}"  # سجل الانتقال القادم لقروب واحد في Mongo (jobs)
+DUE_JOB = "due"  # المؤقت على أقرب انتقال في registry
+PLAN_JOB = "plan"  # تخطيط القروبات التي ليس لها انتقال مجدول
+RETRY_SECONDS = 60
+
 DUA_NIGHT = "بِاسْمِكَ رَبِّي وَضَعْتُ جَنْبِي، وَبِكَ أَرْفَعُهُ، فَإِنْ أَمْسَكْتَ نَفْسِي فَارْحَمْهَا، وَإِنْ أَرْسَلْتَهَا فَاحْفَظْهَا، بِمَا تَحْفَظُ بِهِ عِبَادَكَ الصَّالِحِينَ"
 DUA_MORNING = "اللَّهُمَّ إنِّي أصبَحتُ أنِّي أُشهِدُك، وأُشهِدُ حَمَلةَ عَرشِكَ، ومَلائِكَتَك، وجميعَ خَلقِكَ: بأنَّك أنتَ اللهُ لا إلهَ إلَّا أنتَ، وَحْدَك لا شريكَ لكَ، وأنَّ مُحمَّدًا عبدُكَ ورسولُكَ"
 
-application = Application.builder().token(BOT_TOKEN).build()
+# يُبنى في build_application() بعد فتح المنفذ: إنشاء عملاء HTTP الخاصة بـ Bot API يأخذ جزءًا من الثانية
+application: Application = None
 tz = ZoneInfo(TIMEZONE)
 
 
-def fetch_prayer_times(d: date):
+def group_settings(info: dict = None) -> dict:
+    """إعدادات القروب (الموقع، الطريقة، المنطقة الزمنية، مدد الإغلاق) مع القيم الافتراضية من config."""
+    info = info or {}
+    return {
+        "lat": info.get("lat", LAT),
+        "lon": info.get("lon", LON),
+        "method": info.get("method", METHOD),
+        "timezone": info.get("timezone") or TIMEZONE,
+        "durations": {**DURATIONS, **(info.get("durations") or {})},
+    }
+
+
+async def fetch_prayer_times(d: date, settings: dict = None):
+    """
+    أوقات الصلاة مع tz-aware datetimes (من الكاش، أو جلب الشهر كاملًا من Aladhan عند الحاجة).
+    الإحداثيات تُقرَّب لمفتاح السلة حتى تشترك القروبات المتجاورة في نفس الجدول.
+    """
+    settings = settings or group_settings()
+    lat, lon, method, timezone = scheduler.bucket_key(settings["lat"], settings["lon"], settings["method"], settings["timezone"])
+    return await get_prayer_times(d, lat, lon, method, timezone)
+
+
+def close_text(w: scheduler.Window) -> str:
+    if w.kind == "night":
+        return f"🌙 دعاء النوم: {DUA_NIGHT}"
+    return f"🔒 سيتم غلق الموضوع/الشات 🕌 لصلاة {AR_PRAYER.get(w.prayer, w.prayer)}"
+
+
+def open_text(w: scheduler.Window) -> str:
+    if w.kind == "night":
+        return f"☀️ دعاء الصباح: {DUA_MORNING}"
+    return "✅ تم فتح الموضوع / الدردشة"
+
+
+# (سلة الموقع، المدد، اليوم المحلي) -> نوافذ مدموجة؛ تُحسب مرة لكل سلة وليس لكل قروب
+_blocks_memo = {}
+
+
+async def load_blocks(now: datetime, settings: dict = None):
+    """نوافذ الإغلاق لأمس واليوم وغدًا مدموجة (لتغطية نافذة تعبر منتصف الليل) حسب إعدادات القروب."""
+    settings = settings or group_settings()
+    gtz = ZoneInfo(settings["timezone"])
+    today = now.astimezone(gtz).date()
+    bucket = scheduler.bucket_key(settings["lat"], settings["lon"], settings["method"], settings["timezone"])
+    key = (bucket, tuple(sorted(settings["durations"].items())), today)
+    blocks = _blocks_memo.get(key)
+    if blocks is None:
+        windows = []
+        for offset in (-1, 0, 1):
+            d = today + timedelta(days=offset)
+            windows += scheduler.day_windows(d, await fetch_prayer_times(d, settings), settings["durations"], gtz)
+        blocks = scheduler.merge_windows(windows)
+        if len(_blocks_memo) > 10000:
+            _blocks_memo.clear()
+        _blocks_memo[key] = blocks
+    return blocks
+
+
+async def load_group_blocks(chat_id: int, now: datetime):
+    return await load_blocks(now, group_settings(await db.get_group_db(chat_id)))
+
+
+async def schedule_group(job_queue, chat_id: int, thread_id, blocks, now: datetime, saves: list = None):
+    """
+    تسجيل الانتقال القادم لهذا القروب في registry (يحل محل السابق).
+    يُحفظ أيضًا في Mongo (jobs) ليُستعاد بعد إعادة التشغيل؛ saves: قائمة تُجمع فيها
+    السجلات لـ save_jobs_db بدل الكتابة الفورية. LookupError إن لم يكن القروب في registry.
+    """
+    tr = scheduler.next_transition(now, blocks)
+    if tr is None:
+        return None
+    at = tr.at.timestamp()
+    text = close_text(tr.window) if tr.action == "close" else open_text(tr.window)
+    prayer = tr.window.prayer or tr.window.kind
+    record = register_transition(job_queue, chat_id, thread_id, tr.action, at, text, at, prayer)
+    if record is None:
+        # القروب ليس في registry: بدون خطأ هنا يبقى بلا فتح ولا إغلاق قادم حتى تخطيط اليوم التالي
+        raise LookupError(f"group {chat_id} is not in the registry, {tr.action} at {tr.at} not scheduled")
+    if tr.action == "close":
+        burst.plan(job_queue, chat_id, at)
+    if saves is None:
+        await db.save_jobs_db([record])
+    else:
+        saves.append(record)
+    return tr
+
+
+def register_transition(job_queue, chat_id: int, thread_id, action: str, due: float, text: str, at,
+                        prayer: str = None) -> dict:
+    """
+    الانتقال القادم للقروب (action عند due، unix) في registry وضبط المؤقت عليه إن كان الأقرب.
+    at: موعد الانتقال نفسه، أو None لإعادة محاولة. prayer: النافذة (لسجل الأحداث).
+    يُرجع سجل الحفظ في Mongo، أو None إن لم يعد القروب مربوطًا.
+    """
+    if not registry.schedule(chat_id, due, action, text, at, prayer):
+        return None
+    arm_timer(job_queue, due)
+    data = {"chat_id": chat_id, "thread_id": thread_id, "at": at, "text": text, "prayer": prayer}
+    return {"_id": GROUP_JOB.format(chat_id), "callback": f"{action}_job", "at": due, "data": data}
+
+
+# مؤقت واحد في job_queue على أقرب انتقال في registry: (job، موعده unix)
+_timer = None
+
+
+def arm_timer(job_queue, due: float = None):
+    """ضبط المؤقت على due (أو أقرب موعد في registry) إن كان أبكر من المضبوط حاليًا."""
+    global _timer
+    if due is None:
+        due = registry.next_due()
+    if due is None or (_timer is not None and _timer[1] <= due):
+        return
+    if _timer is not None:
+        _timer[0].schedule_removal()
+    # misfire_grace_time=None: مؤقت تأخر (event loop مشغول بدفعة كبيرة) يُنفَّذ متأخرًا ولا يُسقط
+    job = job_queue.run_once(due_job, when=max(0.0, due - datetime.now(tz).timestamp()), name=DUE_JOB,
+                             job_kwargs={"misfire_grace_time": None})
+    _timer = (job, due)
+
+
+async def due_job(ctx: ContextTypes.DEFAULT_TYPE):
     """
-    جلب أوقات الصلاة من Aladhan API مع tz-aware datetimes.
+    عند المؤقت: الانتقالات التي حان موعدها فقط (registry.pop_due) بالتوازي، بعد ضبط المؤقت على الموعد التالي.
+    كل انتقال يجدول الذي يليه (close_job / open_job).
+    انتقال رفع استثناءً (خطأ قاعدة مثلًا) يُعاد بعد health.retry_delay.
     """
-    url = (
-        f"https://api.aladhan.com/v1/timings/{d.isoformat()}"
-        f"?latitude={LAT}&longitude={LON}&method={METHOD}&timezonestring={TIMEZONE}"
+    global _timer
+    if _timer is not None and _timer[0] == ctx.job:
+        _timer = None
+    due = registry.pop_due(datetime.now(tz).timestamp() + 0.001)
+    arm_timer(ctx.job_queue)
+    results = await asyncio.gather(
+        *(TRANSITION_JOBS[action](ctx, g.chat_id, text, at, prayer) for g, action, at, text, prayer in due),
+        return_exceptions=True,
     )
-    r = requests.get(url, timeout=20)
-    r.raise_for_status()
-    data = r.json()["data"]["timings"]
-    out = {}
-    for name in PRAYERS:
-        hh, mm = data[name].split(":")[:2]
-        out[name] = datetime.combine(d, time(int(hh), int(mm)), tzinfo=tz)
-    return out
-
-
-# job: يتم استدعاؤه عند وقت الفتح المجدول
-async def open_job(ctx: ContextTypes.DEFAULT_TYPE):
-    chat_id = ctx.job.data.get("chat_id")
-    if not chat_id:
+    failed = [(item, r) for item, r in zip(due, results) if isinstance(r, Exception)]
+    saves = []
+    for (g, action, at, text, prayer), e in failed:
+        logger.error("transition for %s failed", g.chat_id, exc_info=e)
+        if registry.pending(g.chat_id):
+            continue  # الانتقال جدول ما بعده قبل الخطأ
+        # المدخل أُخذ من registry: بدون إعادة محاولة (مثل _after_transition عند الفشل) يبقى القروب
+        # بلا انتقال حتى تخطيط اليوم التالي، فانقطاع قصير للقاعدة عند المغرب يترك الشات مغلقًا طوال الليل
+        due_at = datetime.now(tz).timestamp() + health.retry_delay(g.chat_id, RETRY_SECONDS)
+        record = register_transition(ctx.job_queue, g.chat_id, g.thread_id, action, due_at, text, None, prayer)
+        if record is not None:
+            saves.append(record)
+    if saves:
+        try:
+            await db.save_jobs_db(saves)
+        except Exception:
+            logger.warning("failed to save %d retries", len(saves), exc_info=True)
+    if failed:
+        raise RuntimeError(f"{len(failed)}/{len(due)} transitions failed")
+
+
+async def _after_transition(ctx: ContextTypes.DEFAULT_TYPE, chat_id: int, thread_id, action: str, text: str, at, ok: bool,
+                            prayer: str = None):
+    """بعد تنفيذ انتقال: جدولة الانتقال التالي، أو إعادة المحاولة عند الفشل (مهلة تتضاعف، انظر health)."""
+    now = datetime.now(tz)
+    if at is not None:
+        # لا نخطط من لحظة أبكر من موعد الانتقال نفسه (تفادي تكرار نفس الانتقال)
+        now = max(now, datetime.fromtimestamp(at, tz))
+    try:
+        blocks = await load_group_blocks(chat_id, now)
+    except Exception:
+        logger.exception("خطأ عند جلب أوقات الصلاة")
+        ctx.job_queue.run_once(scheduler_job, when=RETRY_SECONDS, name=PLAN_JOB)
         return
-    groups = db.get_groups_db()
-    thread_id = groups.get(str(chat_id), {}).get("thread_id")
-    ok = await reopen_topic_or_unlock(chat_id, thread_id, ctx, "✅ تم فتح الموضوع / الدردشة")
-    if ok:
-        db.update_state_db(chat_id, False)
+    if not ok:
+        delay = health.retry_delay(chat_id, RETRY_SECONDS)
+        active = scheduler.active_block(now + timedelta(seconds=delay), blocks)
+        if (action == "close") == (active is not None):
+            due = datetime.now(tz).timestamp() + delay
+            record = register_transition(ctx.job_queue, chat_id, thread_id, action, due, text, None, prayer)
+            if record is not None:
+                await db.save_jobs_db([record])
+            return
+    await schedule_group(ctx.job_queue, chat_id, thread_id, blocks, now)
+
+
+def observe_lag(at, action: str):
+    """كم تأخر تنفيذ الانتقال عن موعده المخطط (وقت الصلاة / نهاية النافذة)؛ at=None: إعادة محاولة."""
+    if at is None:
+        return
+    lag = max(0.0, datetime.now(tz).timestamp() - at)
+    metrics.TICK_LAG.set(lag)
+    metrics.TRANSITION_LAG.observe(lag, action=action)
+
+
+async def close_job(ctx: ContextTypes.DEFAULT_TYPE, chat_id: int, text: str, at=None, prayer: str = None):
+    """الإغلاق المجدول لقروب واحد (at: موعده unix، أو None لإعادة محاولة)."""
+    if not sharding.owns(chat_id):
+        return
+    observe_lag(at, "close")
+    thread_id = await db.get_group_thread_db(chat_id)
+    # مكرر أو متأخر أو الشات مغلق أصلًا -> لا نداءات Telegram؛
+    # رسالة التنبيه أُرسلت مسبقًا ضمن دفعتها (burst.py) -> الإغلاق نفسه فقط
+    res = await transitions.apply(ctx, chat_id, thread_id, True, text, at, notice=burst.take_notice(chat_id, at),
+                                  prayer=prayer)
+    burst.landed(chat_id, at, res == transitions.APPLIED)
+    if res == transitions.SKIPPED and health.tripped(chat_id):
+        return  # شات ميت: يُعاد تخطيطه يوميًا بعد موعد التجربة
+    await _after_transition(ctx, chat_id, thread_id, "close", text, at, res != transitions.FAILED, prayer)
+
+
+# يتم استدعاؤه عند وقت الفتح المجدول
+async def open_job(ctx: ContextTypes.DEFAULT_TYPE, chat_id: int, text: str, at=None, prayer: str = None):
+    if not sharding.owns(chat_id):
+        return
+    observe_lag(at, "open")
+    thread_id = await db.get_group_thread_db(chat_id)
+    text = text or "✅ تم فتح الموضوع / الدردشة"
+    res = await transitions.apply(ctx, chat_id, thread_id, False, text, at, prayer=prayer)
+    if res == transitions.SKIPPED and health.tripped(chat_id):
+        return
+    await _after_transition(ctx, chat_id, thread_id, "open", text, at, res != transitions.FAILED, prayer)
+
+
+TRANSITION_JOBS = {"close": close_job, "open": open_job}
+
+
+async def plan_group(ctx: ContextTypes.DEFAULT_TYPE, chat_id: int, thread_id, blocks=None, now: datetime = None,
+                     state: dict = None, saves: list = None):
+    """
+    مطابقة حالة القروب مع النافذة الحالية (إغلاق/فتح فوري إن لزم) ثم جدولة انتقاله القادم.
+    تُستدعى عند التشغيل، عند تغيّر اليوم، وعند ربط/تعديل القروب.
+    state: حالة محمّلة مسبقًا (get_states_db) لتفادي استعلام لكل قروب لا يحتاج انتقالًا،
+    saves: قائمة تُجمع فيها سجلات الـ jobs لـ save_jobs_db.
+    """
+    now = now or datetime.now(tz)
+    if blocks is None:
+        blocks = await load_group_blocks(chat_id, now)
+    if state is None:
+        state = await db.get_state_db(chat_id)
+    active = scheduler.active_block(now, blocks)
+    closed = state.get("closed", False)
+    if active and not closed:
+        await transitions.apply(ctx, chat_id, thread_id, True, close_text(active.opener), now.timestamp())
+    elif not active and closed:
+        await transitions.apply(ctx, chat_id, thread_id, False, "✅ سيتم فتح الموضوع — انتهت نافذة الإغلاق أو الصلاة", now.timestamp())
+    return await schedule_group(ctx.job_queue, chat_id, thread_id, blocks, now, saves)
 
 
 async def scheduler_job(ctx: ContextTypes.DEFAULT_TYPE):
     """
-    تُنفَّذ كل دقيقة عبر job_queue.
-    تحقّق من:
-      - أوقات الصلاة -> إغلاق وجدولة الفتح بعد نهاية الصلاة
-      - إغلاق عند منتصف الليل مع دعاء النوم -> فتح عند 05:00 أو نهاية الصلاة (الأكبر)
-      - فتح صباحي عند 05:00 مع دعاء الصباح
-      - فتح إذا انتهت كل النوافذ والشات مغلق
+    تخطيط القروبات التي ليس لها انتقال مجدول: عند التشغيل وعند بداية كل يوم (وليس كل دقيقة).
+    كل قروب له انتقال قادم واحد في registry (إغلاق عند بداية النافذة / فتح عند نهايتها)،
+    وكل انتقال يجدول الذي يليه، فالقروبات المجدولة لا تُلمس هنا:
+      - أوقات الصلاة -> إغلاق عند البداية وفتح عند نهاية المدة
+      - إغلاق عند منتصف الليل مع دعاء النوم -> فتح عند 05:00 أو نهاية الصلاة (الأكبر) مع دعاء الصباح
+    وتنظيف كاش أوقات الصلاة من الأيام الماضية.
     """
-    now = datetime.now(tz)
-    today = now.date()
+    prune_times_cache()
+    await plan_all_groups(ctx)
+
 
-    # جلب القروبات/الموضوعات من قاعدة البيانات
+async def plan_all_groups(ctx: ContextTypes.DEFAULT_TYPE, shards: set = None):
+    """
+    تخطيط القروبات التي ليس لها انتقال مجدول (جديدة، مستعادة بدون job، أو انقطعت سلسلتها بخطأ).
+    shards: قروبات هذه الـ shards فقط (عند أخذ leases جديدة). في كل الأحوال
+    لا نخطط إلا القروبات التي تملكها هذه العملية.
+    مدة كل مرحلة تُسجَّل في metrics، وتُكتب في السجل إذا تجاوز الـ tick مدة SLOW_TICK_SECONDS.
+    """
+    phases = metrics.Phases()
     try:
-        groups = db.get_groups_db()
-    except Exception as e:
-        logger.exception("فشل جلب القروبات من DB:")
-        groups = {}
+        await _plan_all_groups(ctx, phases, shards)
+    finally:
+        total = phases.total()
+        for name, seconds in phases.seconds.items():
+            metrics.TICK_SECONDS.observe(seconds, phase=name)
+        metrics.TICK_SECONDS.observe(total, phase="total")
+        if SLOW_TICK_SECONDS and total > SLOW_TICK_SECONDS:
+            logger.warning("slow planning tick: %.2fs (%s)", total, phases.summary())
+
 
-    # جلب أوقات الصلاة
+async def _plan_all_groups(ctx: ContextTypes.DEFAULT_TYPE, phases: metrics.Phases, shards: set):
+    now = datetime.now(tz)
+    with phases.phase("health"):
+        await health.refresh()
     try:
-        prayer_times = fetch_prayer_times(today)
+        with phases.phase("groups"):
+            await db.groups_ready()
+            todo = [
+                g for g in registry.unscheduled()
+                if sharding.owns(g.chat_id) and (shards is None or sharding.shard_of(g.chat_id) in shards)
+                # شات ميت (breaker مفتوح): لا انتقال حتى موعد التجربة التالي
+                and not (health.tripped(g.chat_id) and not health.allowed(g.chat_id))
+            ]
     except Exception:
-        logger.exception("خطأ عند جلب أوقات الصلاة")
-        prayer_times = {}
+        logger.exception("فشل جلب القروبات من DB:")
+        ctx.job_queue.run_once(scheduler_job, when=RETRY_SECONDS, name=PLAN_JOB)
+        return
+    if not todo:
+        metrics.TICK_GROUPS.set(0)
+        return
 
-    for chat_key, info in list(groups.items()):
+    # حالة القروبات باستعلام واحد (كلها إن كانت أغلبها)؛ فقط المخالفة للنافذة الحالية تمر بـ transitions
+    try:
+        with phases.phase("states"):
+            ids = None if 2 * len(todo) > registry.count() else [g.chat_id for g in todo]
+            states = await db.get_states_db(ids)
+    except Exception:
+        logger.exception("فشل جلب الحالة من DB:")
+        ctx.job_queue.run_once(scheduler_job, when=RETRY_SECONDS, name=PLAN_JOB)
+        return
+    saves = []
+    failed_times = False
+    planned = 0
+    # الجدول يُحسب مرة لكل إعدادات مختلفة (سلة الموقع + المدد) وليس لكل قروب
+    blocks_of = {}
+
+    for g in todo:
+        chat_id = g.chat_id
+        key = id(g.profile)
+        if key not in blocks_of:
+            try:
+                with phases.phase("timetable"):
+                    blocks_of[key] = await load_blocks(now, group_settings(g.profile))
+            except Exception:
+                logger.exception("خطأ عند جلب أوقات الصلاة للقروب %s", chat_id)
+                blocks_of[key] = None
+                failed_times = True
+        if blocks_of[key] is None:
+            continue
         try:
-            chat_id = int(info.get("chat_id"))
+            state = states.get(chat_id, {"closed": False, "last_action": 0})
+            with phases.phase("plan"):
+                await plan_group(ctx, chat_id, g.thread_id, blocks_of[key], now, state=state, saves=saves)
+            planned += 1
         except Exception:
-            continue
+            logger.exception("scheduler_job: failed to plan %s", chat_id)
+    metrics.TICK_GROUPS.set(planned)
 
-        thread_id = info.get("thread_id")
-        st = db.get_state_db(chat_id)
-        closed = st.get("closed", False)
-        last_action = st.get("last_action", 0)
+    try:
+        with phases.phase("save"):
+            await db.save_jobs_db(saves)
+    except Exception:
+        logger.exception("فشل حفظ الـ jobs في DB:")
+    if failed_times:
+        ctx.job_queue.run_once(scheduler_job, when=RETRY_SECONDS, name=PLAN_JOB)
 
-        # تجنّب التدخل لو تم تغيير الحالة يدويًا منذ أقل من 10 ثواني
-        if int(__import__("time").time()) - last_action < 10:
-            continue
 
-        in_prayer = False
-
-        # 1) إغلاق أثناء الصلاة وجدولة فتح ذكي يأخذ بعين الاعتبار فتح الصباح 05:00
-        for pname, start in prayer_times.items():
-            end_time = start + timedelta(minutes=DURATIONS.get(pname, 20))
-            if start <= now < end_time:
-                in_prayer = True
-                if not closed:
-                    text = f"🔒 سيتم غلق الموضوع/الشات 🕌 لصلاة {AR_PRAYER.get(pname, pname)}"
-                    ok = await close_topic_or_lock(chat_id, thread_id, ctx, text)
-                    if ok:
-                        db.update_state_db(chat_id, True)
-
-                        # حساب وقت الفتح: لا نفتح قبل 05:00 إذا كانت نافذة ليلية مداخلة
-                        # حدّد وقت الفتح الليلي المقابل ليوم بداية الصلاة
-                        night_open_time = datetime.combine(start.date(), time(5, 0), tzinfo=tz)
-
-                        # open_time هو الأكبر بين نهاية الصلاة ووقت الفتح الليلي (لذات اليوم)
-                        open_time = max(end_time, night_open_time)
-
-                        # لو open_time في الماضي، أضف يوم (احتياطي)
-                        if open_time <= now:
-                            open_time = open_time + timedelta(days=1)
-
-                        delay = (open_time - now).total_seconds()
-                        # جدولة فتح عبر job_queue
-                        ctx.job_queue.run_once(open_job, when=delay, data={"chat_id": chat_id})
-                break
-
-        # 2) إغلاق ليلي عند 00:00 مع دعاء النوم -> نغلق ونجدول فتح عند 05:00 بنفس طريقة open_time
-        # نتحقق بدقة لحظة 00:00 (دقيقة واحدة تنفيذية) — هذا الكود سيرتبط بالتحقق كل دقيقة
-        if now.hour == 0 and now.minute == 0:
-            if not closed:
-                text = f"🌙 دعاء النوم: {DUA_NIGHT}"
-                ok = await close_topic_or_lock(chat_id, thread_id, ctx, text)
-                if ok:
-                    db.update_state_db(chat_id, True)
-                    # جدولة الفتح عند 05:00 نفس اليوم (أو اليوم التالي إن مضى)
-                    open_time = datetime.combine(today, time(5, 0), tzinfo=tz)
-                    if open_time <= now:
-                        open_time = open_time + timedelta(days=1)
-                    delay = (open_time - now).total_seconds()
-                    ctx.job_queue.run_once(open_job, when=delay, data={"chat_id": chat_id})
-
-        # 3) فتح صباحي عند 05:00 مع دعاء الصباح
-        if now.hour == 5 and now.minute == 0:
-            # لا نفتح إن كنا داخل صلاة (in_prayer) — لأن الصلاة قد تكون بعد 05:00
-            if closed and not in_prayer:
-                text = f"☀️ دعاء الصباح: {DUA_MORNING}"
-                ok = await reopen_topic_or_unlock(chat_id, thread_id, ctx, text)
-                if ok:
-                    db.update_state_db(chat_id, False)
-
-        # 4) لو ما كنا في صلاة ولا نافذة ليلية و الشات مغلق -> افتح
-        if not in_prayer and not (0 <= now.hour < 5):
-            if closed:
-                ok = await reopen_topic_or_unlock(chat_id, thread_id, ctx, "✅ سيتم فتح الموضوع — انتهت نافذة الإغلاق أو الصلاة")
-                if ok:
-                    db.update_state_db(chat_id, False)
+def job_at(data: dict):
+    """موعد الانتقال المسجل في سجل Mongo (unix)، أو None لإعادة محاولة/تدخل يدوي (= لحظة التنفيذ)."""
+    at = data.get("at")
+    if isinstance(at, str):
+        return datetime.fromisoformat(at).timestamp()  # سجلات قديمة بصيغة ISO
+    return at
+
+
+async def rehydrate_jobs(ctx: ContextTypes.DEFAULT_TYPE, shards: set = None):
+    """
+    استعادة الانتقالات المحفوظة في Mongo (jobs) بعد إعادة التشغيل.
+    القادمة تُسجَّل في registry كما هي؛ التي فات موعدها أثناء توقف البوت تُنفَّذ دفعة واحدة
+    (فقط إن كانت ما زالت مناسبة للنافذة الحالية) ثم يُجدول الانتقال التالي لكل قروب.
+    """
+    actions_of = {"close_job": "close", "open_job": "open"}
+    now = datetime.now(tz)
+    await health.refresh()
+    await db.groups_ready()
+    overdue = []
+    for doc in await db.get_jobs_db():
+        action = actions_of.get(doc.get("callback"))
+        data = doc["data"]
+        chat_id = data["chat_id"]
+        if action is None or not sharding.owns(chat_id):
+            continue
+        if health.tripped(chat_id) and not health.allowed(chat_id):
+            continue
+        if shards is not None and sharding.shard_of(chat_id) not in shards:
+            continue
+        if doc["at"] > now.timestamp():
+            at = job_at(data)
+            record = register_transition(ctx.job_queue, chat_id, data.get("thread_id"), action, doc["at"], data.get("text"), at,
+                                         data.get("prayer"))
+            if record is not None and action == "close" and at is not None:
+                burst.plan(ctx.job_queue, chat_id, at)
+        elif registry.get(chat_id) is not None:
+            overdue.append(doc)
+    if not overdue:
+        return
 
-    # أنهِ الوظيفة؛ job_queue سيعيد تشغيلها حسب التكرار
-    return
+    targets, actions, blocks_of = [], {}, {}
+    for doc in overdue:
+        chat_id = doc["data"]["chat_id"]
+        blocks_of[chat_id] = blocks = await load_group_blocks(chat_id, now)
+        active = scheduler.active_block(now, blocks)
+        action = "close" if doc["callback"] == "close_job" else "open"
+        # إغلاق فات موعده ونافذته انتهت -> لا شيء؛ فتح فات موعده ونحن داخل نافذة جديدة -> لا شيء
+        if (action == "close") == (active is not None):
+            targets.append((chat_id, await db.get_group_thread_db(chat_id)))
+            text = doc["data"].get("text") or (close_text(active.opener) if active else "✅ تم فتح الموضوع / الدردشة")
+            actions[chat_id] = (action, text, doc["at"], doc["data"].get("prayer"))
+
+    async def run_overdue(chat_id, thread_id, call):
+        action, text, at, prayer = actions[chat_id]
+        res = await transitions.apply(ctx, chat_id, thread_id, action == "close", text, at, prayer=prayer)
+        if res == transitions.FAILED:
+            raise RuntimeError(f"overdue {action} failed")
+        return res
+
+    res = await broadcast.fan_out(targets, run_overdue)
+    logger.info("rehydrate_jobs: %d overdue jobs, %d applied, %d failed, %d unchanged, %d skipped",
+                len(overdue), res.sent, res.failed, res.noop, res.skipped)
+
+    saves = []
+    for doc in overdue:
+        chat_id = doc["data"]["chat_id"]
+        await schedule_group(ctx.job_queue, chat_id, await db.get_group_thread_db(chat_id), blocks_of[chat_id], now, saves)
+    await db.save_jobs_db(saves)
+
+
+async def startup_job(ctx: ContextTypes.DEFAULT_TYPE):
+    """عند التشغيل: استعادة الانتقالات المحفوظة ثم تخطيط القروبات التي ليس لها انتقال."""
+    try:
+        await rehydrate_jobs(ctx)
+    except Exception:
+        logger.exception("rehydrate_jobs failed")
+    await plan_all_groups(ctx)
+
+
+async def on_shards_changed(gained: set, lost: set):
+    """(وضع worker) عند انتقال leases: إلغاء انتقالات الـ shards المفقودة، واستعادة/تخطيط الجديدة."""
+    ctx = CallbackContext(application)
+    if lost:
+        for g in registry.groups():
+            if sharding.shard_of(g.chat_id) in lost:
+                registry.cancel(g.chat_id)
+    if gained:
+        try:
+            await rehydrate_jobs(ctx, gained)
+        except Exception:
+            logger.exception("rehydrate_jobs failed")
+        await plan_all_groups(ctx, shards=gained)
+
+
+async def on_forwarded_command(command: dict):
+    """(وضع worker) أوامر أحالتها الواجهة لقروب ضمن shards هذا العامل."""
+    if command.get("kind") == "plan":
+        # الواجهة كتبت القروب للتو: نقرؤه من القاعدة (registry هنا يتحدث بعد change stream / polling)
+        group = await db.get_group_db(command["chat_id"], fresh=True)
+        if group is None:
+            raise LookupError(f"forwarded plan for unbound group {command['chat_id']}")
+        await plan_group(CallbackContext(application), command["chat_id"], group.get("thread_id"))
+    elif command.get("kind") == "transition":
+        chat_id, closed = command["chat_id"], command["closed"]
+        res = await transitions.apply(CallbackContext(application), chat_id, command.get("thread_id"), closed,
+                                      command["text"], priority=command["priority"], force=command["force"])
+        if command.get("reply_to"):
+            message_id, message_thread_id = command["reply_to"]
+            await application.bot.send_message(chat_id, test_reply(closed, res), reply_to_message_id=message_id,
+                                               message_thread_id=message_thread_id)
+
+
+async def apply_owned(ctx, chat_id: int, thread_id, closed: bool, text: str, priority: int, force: bool = False,
+                      reply_to: tuple = None) -> str:
+    """
+    إغلاق/فتح يدوي (/testclose، /close_all...) في العملية المالكة للقروب. في وضع front يُحال إلى العامل
+    المالك ويُرجع broadcast.FORWARDED: أقفال transitions لكل عملية، فالتنفيذ في الواجهة يتسابق مع
+    انتقالات العامل المجدولة لنفس الشات. reply_to: (message_id، message_thread_id) ليرد العامل بالنتيجة.
+    """
+    command = {"kind": "transition", "thread_id": thread_id, "closed": closed, "text": text, "priority": priority,
+               "force": force, "reply_to": reply_to}
+    if await sharding.forward(chat_id, command):
+        return broadcast.FORWARDED
+    return await transitions.apply(ctx, chat_id, thread_id, closed, text, priority=priority, force=force)
 
 
 # ===================== أوامر البوت =====================
@@ -176,7 +532,10 @@ async def start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         "👋 السلام عليكم\n\n"
         "الأوامر:\n"
-        "/bind - ربط القروب (أدمن مصرح)\n"
+        "/bind [LAT LON [METHOD [TIMEZONE]]] - ربط القروب (أدمن مصرح)\n"
+        "/setloc LAT LON [METHOD] [TIMEZONE] - موقع وطريقة حساب خاصة بالقروب (أدمن)\n"
+        "/setdur <PRAYER|all> <MINUTES> - مدة الإغلاق بعد الصلاة (أدمن)\n"
+        "/settings - عرض إعدادات القروب (أدمن)\n"
         "/testclose - إغلاق تجريبي (أدمن)\n"
         "/testopen - فتح تجريبي (أدمن)\n"
         "/times - عرض أوقات الصلاة (مقيد للأدمن)\n"
@@ -186,16 +545,61 @@ async def start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/announce - إرسال إعلان لجميع القروبات (في DM للمالك، يدعم الرد للوسائط)\n"
         "/close_all - إغلاق مركزي لكل القروبات (DM للمالك)\n"
         "/open_all - فتح مركزي لكل القروبات (DM للمالك)\n"
+        "/job_status <JOB_ID> - تقدّم مهمة إرسال جماعي (للمالك)\n"
+        "/job_retry <JOB_ID> - إعادة الإرسال للقروبات الفاشلة فقط (للمالك)\n"
+        "/queue_stats - عمق طابور الإرسال وزمن الانتظار (للمالك)\n"
+        "/stats [ساعات] - إحصاءات الإغلاق/الفتح والإعلانات من سجل الأحداث (للمالك)\n"
+        "/dead_chats - القروبات الفاشلة (بوت مطرود، بلا صلاحيات...) (للمالك)\n"
+        "/prune_dead - حذف القروبات المتوقفة دفعة واحدة (للمالك)\n"
     )
 
 
+def parse_location_args(args) -> dict:
+    """lat lon [method [timezone]] -> إعدادات القروب؛ ValueError عند قيمة غير صالحة."""
+    if len(args) < 2 or len(args) > 4:
+        raise ValueError("عدد المعاملات غير صحيح")
+    lat, lon = float(args[0]), float(args[1])
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError("إحداثيات خارج النطاق")
+    settings = {"lat": lat, "lon": lon}
+    if len(args) >= 3:
+        method = int(args[2])
+        if method not in METHODS:
+            raise ValueError(f"طريقة حساب غير معروفة: {method}")
+        settings["method"] = method
+    if len(args) == 4:
+        try:
+            ZoneInfo(args[3])
+        except Exception:
+            raise ValueError(f"منطقة زمنية غير معروفة: {args[3]}")
+        settings["timezone"] = args[3]
+    return settings
+
+
+async def replan_group(context, chat_id: int, thread_id=None):
+    """إعادة تخطيط قروب بعد تغيير ربطه أو إعداداته."""
+    try:
+        # في وضع front يُحال التخطيط إلى العامل المالك لـ shard هذا القروب
+        if not await sharding.forward(chat_id, {"kind": "plan", "thread_id": thread_id}):
+            await plan_group(context, chat_id, thread_id)
+    except Exception:
+        logger.exception("failed to plan %s", chat_id)
+
+
 async def bind(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    if not (user_id == OWNER_ID or db.is_admin_db(user_id)):
+    if not (user_id == OWNER_ID or await db.is_admin_db(user_id)):
         return await update.message.reply_text("⚠️ ليس لديك صلاحية استخدام هذا الأمر.")
+    settings = None
+    if context.args:
+        try:
+            settings = parse_location_args(context.args)
+        except ValueError as e:
+            return await update.message.reply_text(f"⚠️ {e}\nاستعمل /bind [LAT LON [METHOD [TIMEZONE]]]")
     chat_id = update.effective_chat.id
     thread_id = getattr(update.effective_message, "message_thread_id", None)
-    db.add_group_db(chat_id, thread_id)
+    await db.add_group_db(chat_id, thread_id, settings)
+    await replan_group(context, chat_id, thread_id)
     try:
         await context.bot.send_message(chat_id=OWNER_ID, text=f"✅ تم ربط القروب {chat_id} thread_id={thread_id}")
     except Exception:
@@ -206,46 +610,110 @@ async def bind(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("✅ تم ربط القروب بدون topic. سيعمل fallback على صلاحيات الشات.")
 
 
+async def setloc_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/setloc LAT LON [METHOD] [TIMEZONE] — موقع وطريقة حساب خاصة بهذا القروب."""
+    user_id = update.effective_user.id
+    if not (user_id == OWNER_ID or await db.is_admin_db(user_id)):
+        return await update.message.reply_text("⚠️ هذا الأمر للأدمن المصرح فقط.")
+    try:
+        settings = parse_location_args(context.args)
+    except ValueError as e:
+        return await update.message.reply_text(f"⚠️ {e}\nاستعمل /setloc LAT LON [METHOD] [TIMEZONE]")
+    chat_id = update.effective_chat.id
+    if not await db.update_group_settings_db(chat_id, settings):
+        return await update.message.reply_text("⚠️ القروب غير مربوط. استعمل /bind أولًا.")
+    await replan_group(context, chat_id, await db.get_group_thread_db(chat_id))
+    await update.message.reply_text("✅ تم حفظ الموقع وإعادة جدولة الإغلاق.")
+
+
+async def setdur_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/setdur <Fajr|Dhuhr|Asr|Maghrib|Isha|all> <MINUTES> — مدة الإغلاق بعد الصلاة."""
+    user_id = update.effective_user.id
+    if not (user_id == OWNER_ID or await db.is_admin_db(user_id)):
+        return await update.message.reply_text("⚠️ هذا الأمر للأدمن المصرح فقط.")
+    usage = "⚠️ استعمل /setdur <Fajr|Dhuhr|Asr|Maghrib|Isha|all> <MINUTES>"
+    if len(context.args) != 2:
+        return await update.message.reply_text(usage)
+    name = context.args[0].capitalize()
+    try:
+        minutes = int(context.args[1])
+    except ValueError:
+        return await update.message.reply_text(usage)
+    if not (0 < minutes <= 180) or (name != "All" and name not in PRAYERS):
+        return await update.message.reply_text(usage)
+    chat_id = update.effective_chat.id
+    durations = dict((await db.get_group_db(chat_id) or {}).get("durations") or {})
+    for pname in (PRAYERS if name == "All" else [name]):
+        durations[pname] = minutes
+    if not await db.update_group_settings_db(chat_id, {"durations": durations}):
+        return await update.message.reply_text("⚠️ القروب غير مربوط. استعمل /bind أولًا.")
+    await replan_group(context, chat_id, await db.get_group_thread_db(chat_id))
+    await update.message.reply_text("✅ تم حفظ مدة الإغلاق وإعادة جدولة الإغلاق.")
+
+
+async def settings_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    if not (user_id == OWNER_ID or await db.is_admin_db(user_id)):
+        return await update.message.reply_text("⚠️ هذا الأمر للأدمن المصرح فقط.")
+    info = await db.get_group_db(update.effective_chat.id)
+    if info is None:
+        return await update.message.reply_text("⚠️ القروب غير مربوط. استعمل /bind أولًا.")
+    s = group_settings(info)
+    durations = "، ".join(f"{AR_PRAYER.get(p, p)} {m}د" for p, m in s["durations"].items())
+    await update.message.reply_text(
+        f"⚙️ إعدادات القروب:\n"
+        f"الموقع: {s['lat']}, {s['lon']}\n"
+        f"طريقة الحساب: {s['method']}\n"
+        f"المنطقة الزمنية: {s['timezone']}\n"
+        f"مدة الإغلاق: {durations}"
+    )
+
+
 async def testclose(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    if not (user_id == OWNER_ID or db.is_admin_db(user_id)):
+    if not (user_id == OWNER_ID or await db.is_admin_db(user_id)):
         return await update.message.reply_text("⚠️ هذا الأمر للأدمن المصرح فقط.")
     chat_id = update.effective_chat.id
-    groups = db.get_groups_db()
-    thread_id = groups.get(str(chat_id), {}).get("thread_id")
-    db.update_state_db(chat_id, True)  # تعليم تدخل يدوي
+    thread_id = await db.get_group_thread_db(chat_id)
     text = "🔒 سيتم غلق الموضوع/الشات (تجريبي)"
-    ok = await close_topic_or_lock(chat_id, thread_id, context, text)
-    if ok:
-        await update.message.reply_text("✅ تم تنفيذ إغلاق تجريبي.")
-    else:
-        await update.message.reply_text("❌ فشل تنفيذ إغلاق تجريبي. تأكد أن البوت مشرف وله الصلاحيات.")
+    # الحالة تُكتب بعد نجاح التنفيذ فقط (عبر آلة الحالة)، فلا يبقى closed قديم بعد فشل
+    res = await apply_owned(context, chat_id, thread_id, True, text, outbound.ADMIN, force=True,
+                            reply_to=(update.message.message_id, update.message.message_thread_id))
+    if res != broadcast.FORWARDED:
+        await update.message.reply_text(test_reply(True, res))
 
 
 async def testopen(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    if not (user_id == OWNER_ID or db.is_admin_db(user_id)):
+    if not (user_id == OWNER_ID or await db.is_admin_db(user_id)):
         return await update.message.reply_text("⚠️ هذا الأمر للأدمن المصرح فقط.")
     chat_id = update.effective_chat.id
-    groups = db.get_groups_db()
-    thread_id = groups.get(str(chat_id), {}).get("thread_id")
-    db.update_state_db(chat_id, False)
-    ok = await reopen_topic_or_unlock(chat_id, thread_id, context, "✅ سيتم فتح الموضوع/الشات (تجريبي)")
-    if ok:
-        await update.message.reply_text("✅ تم تنفيذ فتح تجريبي.")
-    else:
-        await update.message.reply_text("❌ فشل تنفيذ فتح تجريبي. تأكد أن البوت مشرف وله الصلاحيات.")
+    thread_id = await db.get_group_thread_db(chat_id)
+    res = await apply_owned(context, chat_id, thread_id, False, "✅ سيتم فتح الموضوع/الشات (تجريبي)", outbound.ADMIN,
+                            force=True, reply_to=(update.message.message_id, update.message.message_thread_id))
+    if res != broadcast.FORWARDED:
+        await update.message.reply_text(test_reply(False, res))
+
+
+def test_reply(closed: bool, res: str) -> str:
+    """رد /testclose و /testopen حسب نتيجة transitions.apply (هنا أو عند العامل المالك)."""
+    if res == transitions.NOOP:
+        return "ℹ️ الموضوع/الشات مغلق أصلًا." if closed else "ℹ️ الموضوع/الشات مفتوح أصلًا."
+    if res == transitions.FAILED:
+        return ("❌ فشل تنفيذ إغلاق تجريبي. تأكد أن البوت مشرف وله الصلاحيات." if closed
+                else "❌ فشل تنفيذ فتح تجريبي. تأكد أن البوت مشرف وله الصلاحيات.")
+    return "✅ تم تنفيذ إغلاق تجريبي." if closed else "✅ تم تنفيذ فتح تجريبي."
 
 
 async def list_groups_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != OWNER_ID:
         return
-    groups = db.get_groups_db()
-    if not groups:
+    targets = await db.get_group_targets_db()
+    if not targets:
         return await update.message.reply_text("⚠️ لا توجد قروبات مضافة.")
     keyboard = [
-        [InlineKeyboardButton(f"قروب: {g} - thread:{groups[g].get('thread_id')}", callback_data=f"group_{g}")]
-        for g in groups.keys()
+        [InlineKeyboardButton(f"قروب: {chat_id} - thread:{thread_id}", callback_data=f"group_{chat_id}")]
+        for chat_id, thread_id in targets
     ]
     await context.bot.send_message(chat_id=OWNER_ID, text="📋 القروبات/الموضوعات المرتبطة:", reply_markup=InlineKeyboardMarkup(keyboard))
 
@@ -256,7 +724,7 @@ async def add_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if len(context.args) != 1:
         return await update.message.reply_text("⚠️ استعمل /add_admin <USER_ID>")
     new_admin = int(context.args[0])
-    db.add_admin_db(new_admin)
+    await db.add_admin_db(new_admin)
     await update.message.reply_text(f"✅ تم إضافة {new_admin} كأدمن.")
 
 
@@ -266,17 +734,19 @@ async def remove_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if len(context.args) != 1:
         return await update.message.reply_text("⚠️ استعمل /remove_admin <USER_ID>")
     rem_admin = int(context.args[0])
-    db.remove_admin_db(rem_admin)
+    await db.remove_admin_db(rem_admin)
     await update.message.reply_text(f"✅ تم إزالة {rem_admin} من الأدمنية.")
 
 
 async def times_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    if not (user_id == OWNER_ID or db.is_admin_db(user_id)):
+    if not (user_id == OWNER_ID or await db.is_admin_db(user_id)):
         return await update.message.reply_text("⚠️ هذا الأمر للأدمن المصرح فقط.")
-    today = datetime.now(tz).date()
+    # أوقات موقع هذا القروب إن كان مربوطًا، وإلا الموقع الافتراضي
+    settings = group_settings(await db.get_group_db(update.effective_chat.id))
+    today = datetime.now(ZoneInfo(settings["timezone"])).date()
     try:
-        times = fetch_prayer_times(today)
+        times = await fetch_prayer_times(today, settings)
     except Exception as e:
         logger.exception("خطأ عند جلب أوقات الصلاة:")
         return await update.message.reply_text(f"خطأ عند جلب أوقات الصلاة: {e}")
@@ -287,9 +757,11 @@ async def times_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 # ------------ نسخ رسالة (نص + وسائط) إلى مجموعة/موضوع واحد ------------
-async def copy_to_group(context, from_chat_id, from_message_id, dest_chat_id, dest_thread_id=None):
+async def copy_to_group(context, from_chat_id, from_message_id, dest_chat_id, dest_thread_id=None, call=None):
     """
     Copy a message (supports media) to dest_chat_id (optionally into topic dest_thread_id).
+    `context` is anything with a `.bot` (CallbackContext or the Application when resuming a job).
+    The API call goes through the outbound queue at bulk priority (or `call` when given by fan_out).
     Returns (True, None) or (False, error_str)
     """
     try:
@@ -300,12 +772,136 @@ async def copy_to_group(context, from_chat_id, from_message_id, dest_chat_id, de
         }
         if dest_thread_id is not None:
             kwargs["message_thread_id"] = dest_thread_id
-        await context.bot.copy_message(**kwargs)
+        await (call or outbound.bulk_call)(dest_chat_id, context.bot.copy_message, **kwargs)
         return True, None
     except Exception as e:
+        await health.record_failure(dest_chat_id, e)
         return False, str(e)
 
 
+BROADCAST_TITLES = {"text": "📣", "copy": "📣", "close_all": "🔒", "open_all": "✅"}
+
+
+def broadcast_action(app, job: dict):
+    """الدالة التي تُنفَّذ لكل قروب حسب نوع المهمة (تُبنى من سجل المهمة، فتصلح للاستئناف)."""
+    bot = app.bot
+    kind = job["kind"]
+
+    if kind == "copy":
+        async def action(chat_id, thread_id, call):
+            ok, err = await copy_to_group(app, job["from_chat_id"], job["from_message_id"], chat_id, thread_id, call)
+            if not ok:
+                raise RuntimeError(err)
+    elif kind == "text":
+        async def action(chat_id, thread_id, call):
+            if thread_id:
+                await call(chat_id, bot.send_message, chat_id=chat_id, text=job["text"], message_thread_id=thread_id)
+            else:
+                await call(chat_id, bot.send_message, chat_id=chat_id, text=job["text"])
+    elif kind in ("close_all", "open_all"):
+        closed = kind == "close_all"
+
+        async def action(chat_id, thread_id, call):
+            # عبر آلة الحالة بأولوية BULK (في العامل المالك للقروب): شات في الحالة المطلوبة أصلًا لا يُرسل له شيء
+            if closed:
+                text = "🔒 سيتم إغلاق الموضوع (إدارة مركزية)." if thread_id else "🔒 سيتم إغلاق الشات (إدارة مركزية)."
+            else:
+                text = "✅ سيتم فتح الموضوع (إدارة مركزية)." if thread_id else "✅ سيتم فتح الشات (إدارة مركزية)."
+            res = await apply_owned(app, chat_id, thread_id, closed, text, outbound.BULK)
+            if res == transitions.FAILED:
+                raise RuntimeError("close failed" if closed else "open failed")
+            return res
+    else:
+        raise ValueError(f"unknown broadcast kind: {kind}")
+    return action
+
+
+async def broadcast_summary(job: dict) -> str:
+    kind, sent, failed = job["kind"], job["sent"], job["failed"]
+    unchanged = broadcast.other_text(job)
+    if kind == "close_all":
+        summary = f"🔒 انتهى: تم إغلاق {sent}، فشل: {failed}{unchanged}."
+    elif kind == "open_all":
+        summary = f"✅ انتهى: تم فتح {sent}، فشل: {failed}{unchanged}."
+    else:
+        summary = f"📣 تم إرسال الإعلان إلى {sent} قروب(قروبات). فشل: {failed}."
+    summary += f"\nمهمة: {job['_id']}"
+    if failed and failed <= 8:
+        summary += "\n\nErrors:\n" + "\n".join(await db.get_broadcast_errors_db(job["_id"]))
+    elif failed:
+        summary += f"\n\nErrors: {failed} (use logs for details, /job_retry {job['_id']} لإعادة الفاشلة)."
+    return summary
+
+
+async def run_broadcast_job(app, job: dict, status_message=None):
+    """
+    تشغيل (أو استئناف) مهمة إرسال جماعي على الأهداف التي ما زالت pending فقط.
+    كل دفعة نتائج تُحفظ في Mongo (checkpoint)، فإعادة التشغيل لا تكرر الإرسال لمن تم.
+    """
+    job_id = job["_id"]
+    if status_message is None and job.get("status_chat_id"):
+        status_message = broadcast.StatusMessage(app.bot, job["status_chat_id"], job["status_message_id"])
+
+    async def checkpoint(results):
+        await db.checkpoint_broadcast_db(job_id, results)
+
+    targets = await db.get_broadcast_targets_db(job_id)
+    await broadcast.fan_out(
+        targets, broadcast_action(app, job), status_message, BROADCAST_TITLES.get(job["kind"], "📣"),
+        checkpoint=checkpoint, done_before={k: job.get(k, 0) for k in broadcast.COUNTERS},
+        # /close_all و /open_all تُسجَّل كإغلاق/فتح في transitions.apply؛ الإعلانات هنا
+        event=events.BROADCAST if job["kind"] in ("text", "copy") else None, event_at=job["created_at"],
+    )
+    await db.finish_broadcast_db(job_id)
+    job = await db.get_broadcast_db(job_id)
+    summary = await broadcast_summary(job)
+    if status_message is not None:
+        try:
+            await status_message.edit_text(summary)
+        except Exception:
+            logger.exception("broadcast %s: failed to edit status message", job_id)
+    return job
+
+
+async def start_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE, kind: str, **fields):
+    targets = await db.get_group_targets_db()
+    if not targets:
+        if kind in ("text", "copy"):
+            return await update.message.reply_text("⚠️ لا توجد قروبات مرتبطة لإرسال الإعلان.")
+        return await update.message.reply_text("⚠️ لا توجد قروبات مرتبطة.")
+    await health.refresh()
+    # القروبات الميتة (breaker مفتوح) لا تُرسل لها مهام جماعية
+    dead = [t for t in targets if not health.allowed(t[0])]
+    if dead:
+        targets = [t for t in targets if health.allowed(t[0])]
+    note = f" (تم تخطي {len(dead)} قروب متوقف، انظر /dead_chats)" if dead else ""
+    status = await update.message.reply_text(f"{BROADCAST_TITLES[kind]} جارٍ التنفيذ على {len(targets)} قروب...{note}")
+    fields.update({"kind": kind, "status_chat_id": status.chat_id, "status_message_id": status.message_id})
+    job = await db.create_broadcast_db(fields, targets)
+    run_in_background(context.application, job, status)
+
+
+def run_in_background(app, job: dict, status):
+    """
+    تشغيل المهمة في الخلفية: الـ handler يرجع فورًا فتبقى أوامر المالك التالية سريعة،
+    والتقدم والملخص يصلان في رسالة status؛ إن توقفت المهمة بخطأ يُكتب ذلك فيها.
+    """
+    async def report(e: Exception):
+        await status.edit_text(f"❌ توقفت المهمة {job['_id']}: {e}\nللمتابعة: /job_status {job['_id']}")
+
+    updates.background(run_broadcast_job(app, job, status), f"broadcast:{job['_id']}", on_error=report)
+
+
+async def resume_broadcasts_job(ctx: ContextTypes.DEFAULT_TYPE):
+    """عند التشغيل: استئناف مهام الإرسال التي انقطعت (redeploy / crash) من نقطة الحفظ."""
+    for job in await db.get_running_broadcasts_db():
+        logger.info("resuming broadcast %s (%s): %s/%s done", job["_id"], job["kind"], job.get("cursor"), job.get("total"))
+        try:
+            await run_broadcast_job(ctx.application, job)
+        except Exception:
+            logger.exception("failed to resume broadcast %s", job["_id"])
+
+
 # ------------------ إعلان عام يدعم الوسائط (DM للمالك) ------------------
 async def announce_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
@@ -320,69 +916,13 @@ async def announce_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # reply -> copy that message (media supported)
     if update.message.reply_to_message:
         source_msg = update.message.reply_to_message
-        from_chat_id = source_msg.chat_id
-        from_message_id = source_msg.message_id
-
-        groups = db.get_groups_db()
-        if not groups:
-            return await update.message.reply_text("⚠️ لا توجد قروبات مرتبطة لإرسال الإعلان.")
-
-        sent = 0
-        failed = 0
-        errors = []
-        for g_str, info in list(groups.items()):
-            try:
-                dest_chat_id = int(g_str)
-            except Exception:
-                failed += 1
-                errors.append(f"bad chat id: {g_str}")
-                continue
-            dest_thread_id = info.get("thread_id")
-
-            ok, err = await copy_to_group(context, from_chat_id, from_message_id, dest_chat_id, dest_thread_id)
-            if ok:
-                sent += 1
-            else:
-                failed += 1
-                errors.append(f"{dest_chat_id}: {err}")
-            await asyncio.sleep(0.07)
-
-        summary = f"📣 تم إرسال الإعلان إلى {sent} قروب(قروبات). فشل: {failed}."
-        if errors and len(errors) <= 8:
-            summary += "\n\nErrors:\n" + "\n".join(errors)
-        elif errors:
-            summary += f"\n\nErrors: {len(errors)} (use logs for details)."
-        return await update.message.reply_text(summary)
+        return await start_broadcast(update, context, "copy", from_chat_id=source_msg.chat_id, from_message_id=source_msg.message_id)
 
     # otherwise: text announcement
     text = " ".join(context.args).strip()
     if not text:
         return await update.message.reply_text("⚠️ الرجاء إرسال نص الإعلان أو الرد على رسالة (وسائط أو نص) ثم استخدام /announce")
-
-    groups = db.get_groups_db()
-    if not groups:
-        return await update.message.reply_text("⚠️ لا توجد قروبات مرتبطة لإرسال الإعلان.")
-
-    sent = 0
-    failed = 0
-    for g_str, info in list(groups.items()):
-        try:
-            chat_id = int(g_str)
-        except Exception:
-            failed += 1
-            continue
-        thread_id = info.get("thread_id")
-        try:
-            if thread_id:
-                await context.bot.send_message(chat_id=chat_id, text=text, message_thread_id=thread_id)
-            else:
-                await context.bot.send_message(chat_id=chat_id, text=text)
-            sent += 1
-        except Exception as e:
-            logger.warning(f"announce_all(text): failed to send to {chat_id} (thread {thread_id}): {e}")
-            failed += 1
-        await asyncio.sleep(0.06)
-    return await update.message.reply_text(f"📣 تم إرسال الإعلان إلى {sent} قروب(قروبات). فشل: {failed}.")
+    return await start_broadcast(update, context, "text", text=text)
 
 
 # ------------------ إغلاق / فتح مركزي لجميع القروبات (DM للمالك) ------------------
@@ -391,35 +931,7 @@ async def close_all_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return await update.message.reply_text("هذا الأمر يعمل فقط في رسائل خاصة (DM).")
     if update.effective_user.id != OWNER_ID:
         return await update.message.reply_text("⚠️ فقط صاحب البوت يمكنه استعمال هذا الأمر.")
-
-    groups = db.get_groups_db()
-    if not groups:
-        return await update.message.reply_text("⚠️ لا توجد قروبات مرتبطة.")
-
-    closed = 0
-    failed = 0
-    for g_str, info in list(groups.items()):
-        try:
-            chat_id = int(g_str)
-        except Exception:
-            failed += 1
-            continue
-        thread_id = info.get("thread_id")
-        try:
-            if thread_id:
-                await context.bot.send_message(chat_id=chat_id, text="🔒 سيتم إغلاق الموضوع (إدارة مركزية).", message_thread_id=thread_id)
-                await context.bot.close_forum_topic(chat_id=chat_id, message_thread_id=thread_id)
-                db.update_state_db(chat_id, True)
-            else:
-                await context.bot.send_message(chat_id=chat_id, text="🔒 سيتم إغلاق الشات (إدارة مركزية).")
-                await context.bot.set_chat_permissions(chat_id=chat_id, permissions=ChatPermissions(can_send_messages=False))
-                db.update_state_db(chat_id, True)
-            closed += 1
-        except Exception as e:
-            logger.warning(f"close_all_cmd: failed for {chat_id}/{thread_id}: {e}")
-            failed += 1
-        await asyncio.sleep(0.06)
-    return await update.message.reply_text(f"🔒 انتهى: تم إغلاق {closed}، فشل: {failed}.")
+    return await start_broadcast(update, context, "close_all")
 
 
 async def open_all_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -427,44 +939,139 @@ async def open_all_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return await update.message.reply_text("هذا الأمر يعمل فقط في رسائل خاصة (DM).")
     if update.effective_user.id != OWNER_ID:
         return await update.message.reply_text("⚠️ فقط صاحب البوت يمكنه استعمال هذا الأمر.")
+    return await start_broadcast(update, context, "open_all")
 
-    groups = db.get_groups_db()
-    if not groups:
-        return await update.message.reply_text("⚠️ لا توجد قروبات مرتبطة.")
 
-    opened = 0
-    failed = 0
-    for g_str, info in list(groups.items()):
-        try:
-            chat_id = int(g_str)
-        except Exception:
-            failed += 1
-            continue
-        thread_id = info.get("thread_id")
-        try:
-            if thread_id:
-                await context.bot.send_message(chat_id=chat_id, text="✅ سيتم فتح الموضوع (إدارة مركزية).", message_thread_id=thread_id)
-                await context.bot.reopen_forum_topic(chat_id=chat_id, message_thread_id=thread_id)
-                db.update_state_db(chat_id, False)
-            else:
-                await context.bot.send_message(chat_id=chat_id, text="✅ سيتم فتح الشات (إدارة مركزية).")
-                await context.bot.set_chat_permissions(chat_id=chat_id, permissions=ChatPermissions(
-                    can_send_messages=True, can_send_media_messages=True, can_send_polls=True,
-                    can_send_other_messages=True, can_add_web_page_previews=True
-                ))
-                db.update_state_db(chat_id, False)
-            opened += 1
-        except Exception as e:
-            logger.warning(f"open_all_cmd: failed for {chat_id}/{thread_id}: {e}")
-            failed += 1
-        await asyncio.sleep(0.06)
-    return await update.message.reply_text(f"✅ انتهى: تم فتح {opened}، فشل: {failed}.")
+# ------------------ متابعة مهام الإرسال الجماعي (DM للمالك) ------------------
+async def job_status_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != OWNER_ID:
+        return
+    if len(context.args) != 1:
+        return await update.message.reply_text("⚠️ استعمل /job_status <JOB_ID>")
+    job = await db.get_broadcast_db(context.args[0])
+    if not job:
+        return await update.message.reply_text("⚠️ لا توجد مهمة بهذا المعرف.")
+    started = datetime.fromtimestamp(job["created_at"], tz).strftime("%d-%m-%Y %H:%M")
+    await update.message.reply_text(
+        f"📋 مهمة {job['_id']} ({job['kind']}) — {job['state']}\n"
+        f"بدأت: {started}\n"
+        f"التقدّم: {job['cursor']}/{job['total']} (نجاح {job['sent']}، فشل {job['failed']}"
+        f"{broadcast.other_text(job)})"
+    )
+
+
+async def job_retry_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != OWNER_ID:
+        return
+    if len(context.args) != 1:
+        return await update.message.reply_text("⚠️ استعمل /job_retry <JOB_ID>")
+    job = await db.get_broadcast_db(context.args[0])
+    if not job:
+        return await update.message.reply_text("⚠️ لا توجد مهمة بهذا المعرف.")
+    if job["state"] == "running":
+        return await update.message.reply_text("⚠️ المهمة ما زالت قيد التنفيذ.")
+    job = await db.retry_failed_broadcast_db(job["_id"])
+    if not job:
+        return await update.message.reply_text("✅ لا توجد أهداف فاشلة لإعادة المحاولة.")
+    status = await update.message.reply_text(f"🔁 إعادة المحاولة للأهداف الفاشلة في المهمة {job['_id']}...")
+    run_in_background(context.application, job, status)
+
+
+async def queue_stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """عمق طابور الإرسال وزمن الانتظار لكل أولوية (للمالك)."""
+    if update.effective_user.id != OWNER_ID:
+        return
+    stats = outbound.queue.stats()
+    lines = ["📊 طابور الإرسال:"]
+    for name in outbound.PRIORITY_NAMES.values():
+        st = stats[name]
+        lines.append(f"{name}: في الانتظار {st['depth']}، أُرسل {st['sent']}، متوسط الانتظار {st['avg_wait']:.2f}s، الأقصى {st['max_wait']:.2f}s")
+    lines.append(f"أُسقط (عمليات قديمة): {stats['dropped']}")
+    if burst.report_text():
+        lines.append(burst.report_text())
+    await update.message.reply_text("\n".join(lines))
+
+
+async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/stats [ساعات]: ملخص سجل الأحداث (النتائج، نسبة الإغلاق في الوقت، التأخر، أكثر الأخطاء)."""
+    if update.effective_user.id != OWNER_ID:
+        return
+    try:
+        hours = float(context.args[0]) if context.args else 24.0
+    except ValueError:
+        return await update.message.reply_text("الاستخدام: /stats [عدد الساعات]")
+    await update.message.reply_text(await events.stats_text(hours))
+
+
+# ------------------ الشاتات الميتة (للمالك) ------------------
+DIGEST_LIMIT = 20
+
+
+def dead_chats_text() -> str:
+    entries = health.failing()
+    if not entries:
+        return "🩺 لا توجد قروبات بأخطاء مسجلة."
+    tripped = sum(1 for e in entries if e.get("tripped"))
+    lines = [f"🩺 قروبات بأخطاء: {len(entries)} (متوقفة: {tripped})"]
+    for e in entries[:DIGEST_LIMIT]:
+        mark = "⛔" if e.get("tripped") else "⚠️"
+        lines.append(f"{mark} {e['chat_id']}: {e.get('error', '')} (دائم {e.get('permanent', 0)}، مؤقت {e.get('transient', 0)})")
+    if len(entries) > DIGEST_LIMIT:
+        lines.append(f"... و {len(entries) - DIGEST_LIMIT} أخرى")
+    if tripped:
+        lines.append("\n/prune_dead لحذف القروبات المتوقفة دفعة واحدة.")
+    return "\n".join(lines)
+
+
+async def dead_chats_digest_job(ctx: ContextTypes.DEFAULT_TYPE):
+    """ملخص يومي للمالك بالقروبات الفاشلة (فقط إن وُجدت)."""
+    await health.refresh(force=True)
+    if not health.failing():
+        return
+    try:
+        await ctx.bot.send_message(chat_id=OWNER_ID, text=dead_chats_text())
+    except Exception:
+        logger.exception("failed to send dead chats digest")
+
+
+async def dead_chats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != OWNER_ID:
+        return
+    await health.refresh(force=True)
+    await update.message.reply_text(dead_chats_text())
+
+
+async def prune_dead_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """حذف كل القروبات المتوقفة (breaker مفتوح) مع jobs وحالتها."""
+    if update.effective_user.id != OWNER_ID:
+        return
+    await health.refresh(force=True)
+    chat_ids = [e["chat_id"] for e in health.failing() if e.get("tripped")]
+    if not chat_ids:
+        return await update.message.reply_text("✅ لا توجد قروبات متوقفة.")
+    await db.remove_groups_db(chat_ids)
+    health.forget(chat_ids)
+    await update.message.reply_text(f"🗑 تم حذف {len(chat_ids)} قروب متوقف.")
 
 
 # ------------------- تسجيل handlers وتشغيل job_queue -------------------
-def main():
+def build_application() -> Application:
+    """بناء الـ Application مع handlers و jobs حسب WORKER_MODE (وضع worker: job_queue فقط)."""
+    global application
+    # كل نداءات Bot API تمر عبر الطابور المركزي بالأولويات (outbound.py) ثم pool الاتصالات
+    # المناسب لأولويتها (transport.py)؛ التحديثات تُعالج بالتوازي مع الحفاظ على الترتيب داخل كل شات (updates.py)
+    application = (
+        Application.builder().token(BOT_TOKEN).request(transport.bot_request())
+        .rate_limiter(outbound.queue).concurrent_updates(updates.processor).build()
+    )
+    if WORKER_MODE == "worker":
+        return application
+
     application.add_handler(CommandHandler("start", start_cmd))
     application.add_handler(CommandHandler("bind", bind))
+    application.add_handler(CommandHandler("setloc", setloc_cmd))
+    application.add_handler(CommandHandler("setdur", setdur_cmd))
+    application.add_handler(CommandHandler("settings", settings_cmd))
     application.add_handler(CommandHandler("testclose", testclose))
     application.add_handler(CommandHandler("testopen", testopen))
     application.add_handler(CommandHandler("list_groups", list_groups_cmd))
@@ -474,9 +1081,120 @@ def main():
     application.add_handler(CommandHandler("announce", announce_all))
     application.add_handler(CommandHandler("close_all", close_all_cmd))
     application.add_handler(CommandHandler("open_all", open_all_cmd))
+    application.add_handler(CommandHandler("job_status", job_status_cmd))
+    application.add_handler(CommandHandler("job_retry", job_retry_cmd))
+    application.add_handler(CommandHandler("queue_stats", queue_stats_cmd))
+    application.add_handler(CommandHandler("stats", stats_cmd))
+    application.add_handler(CommandHandler("dead_chats", dead_chats_cmd))
+    application.add_handler(CommandHandler("prune_dead", prune_dead_cmd))
+
+    if WORKER_MODE == "single":
+        # job_queue: تخطيط عند التشغيل ثم عند بداية كل يوم؛ الانتقالات نفسها jobs من نوع run_once
+        # (في وضع front الجدولة عند العمّال)
+        application.job_queue.run_once(startup_job, when=5, name=PLAN_JOB)
+        application.job_queue.run_daily(scheduler_job, time=time(0, 1, tzinfo=tz), name=PLAN_JOB)
+    # استئناف مهام الإرسال الجماعي التي انقطعت
+    application.job_queue.run_once(resume_broadcasts_job, when=10)
+    # ملخص يومي للمالك بالقروبات الميتة
+    application.job_queue.run_daily(dead_chats_digest_job, time=time(9, 0, tzinfo=tz))
+    return application
+
+
+async def _logged(name: str, coro):
+    try:
+        await coro
+    except Exception:
+        logger.exception("warm_up: %s failed", name)
+
+
+async def warm_up():
+    """
+    بالتوازي مع initialize و start (لا تؤخر الرد على أول أمر):
+    فهارس DB + الأدمن والقروبات (تستبدل الـ snapshot) + سجل صحة الشاتات، ثم جدول اليوم لكل سلة.
+    """
+    phases = metrics.Phases()
+    with phases.phase("db"):
+        await asyncio.gather(
+            _logged("ensure_indexes", db.ensure_indexes()),
+            _logged("load_caches", db.load_caches_db()),
+            _logged("health", health.refresh(force=True)),
+        )
+    db.start_cache_invalidation()
+    with phases.phase("times"):
+        now = datetime.now(tz)
+        profiles = registry.profiles() if WORKER_MODE == "single" else []
+        for info in [None, *profiles]:
+            # مرة لكل إعدادات مختلفة؛ load_blocks يحفظ النتيجة لكل سلة
+            await _logged("times", load_blocks(now, group_settings(info)))
+    for k, v in phases.seconds.items():
+        metrics.STARTUP_SECONDS.set(v, phase=f"warm_{k}")
+    logger.info("warm_up: done in %.2fs (%s)", phases.total(), phases.summary())
+
+
+async def post_shutdown(app: Application):
+    # إغلاق عميل HTTP الخاص بأوقات الصلاة وعميل Mongo عند الإيقاف (مع حفظ الـ snapshot للتشغيل القادم)
+    await close_times_client()
+    await db.save_snapshot()
+    await events.close()
+    await db.close()
+
+
+async def run_app(webhook_url: str = None):
+    """
+    تشغيل التطبيق مع خادم HTTP على PORT: /metrics و /healthz دائمًا، و webhook إن وُجد webhook_url.
+    (بدل run_webhook الذي لا يسمح بمسارات إضافية على نفس المنفذ)
+    وضع worker: بدون webhook ولا handlers؛ فقط job_queue + leases على shards القروبات.
+
+    الترتيب لتقصير التشغيل البارد: فتح المنفذ أولًا، ثم بناء الـ Application وملء الكاش من
+    الـ snapshot، ثم initialize (get_me) بينما تعمل warm_up (DB) في الخلفية؛ set_webhook لا يؤخر
+    البدء (Telegram يحتفظ بالـ webhook بين التشغيلات). كل مرحلة تُسجَّل في اللوج وفي /metrics.
+    """
+    boot = metrics.Phases()
+    boot.seconds["import"] = boot.start - _import_started
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    with boot.phase("bind"):
+        server = webserver.start(PORT, f"/webhook/{BOT_TOKEN}" if webhook_url else None)
+    with boot.phase("build"):
+        app = build_application()
+        db.load_snapshot()
+        webserver.attach(app)
+    warm = asyncio.create_task(warm_up())
+    background = [warm]
+    try:
+        with boot.phase("initialize"):
+            await app.initialize()
+        try:
+            with boot.phase("start"):
+                await app.start()
+            for k, v in boot.seconds.items():
+                metrics.STARTUP_SECONDS.set(v, phase=k)
+            logger.info("startup: ready in %.2fs (%s)", perf_counter() - _import_started, boot.summary())
+            if webhook_url:
+                background.append(asyncio.create_task(_logged("set_webhook", app.bot.set_webhook(webhook_url))))
+            if WORKER_MODE == "worker":
+                app.job_queue.run_daily(scheduler_job, time=time(0, 1, tzinfo=tz), name=PLAN_JOB)
+                sharding.start(on_shards_changed, on_forwarded_command)
+            await stop.wait()
+        finally:
+            await sharding.stop()
+            if app.running:
+                await app.stop()
+            await app.shutdown()
+    finally:
+        server.stop()
+        for task in background:
+            task.cancel()
+        await post_shutdown(app)
 
-    # job_queue: شغّل scheduler_job كل 60 ثانية
-    application.job_queue.run_repeating(scheduler_job, interval=60, first=5)
+
+def main():
+    if WORKER_MODE == "worker":
+        logger.info("Starting scheduler worker")
+        asyncio.run(run_app())
+        return
 
     # webhook
     if not RENDER_EXTERNAL_URL:
@@ -484,12 +1202,7 @@ def main():
         raise SystemExit(1)
     webhook_url = f"{RENDER_EXTERNAL_URL}/webhook/{BOT_TOKEN}"
     logger.info("Setting webhook to: %s", webhook_url)
-    application.run_webhook(
-        listen="0.0.0.0",
-        port=PORT,
-        url_path=f"webhook/{BOT_TOKEN}",
-        webhook_url=webhook_url,
-    )
+    asyncio.run(run_app(webhook_url))
 
 
 if __name__ == "__main__":
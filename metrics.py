@@ -0,0 +1,183 @@
+# metrics.py
+"""
+مقاييس بصيغة Prometheus (text exposition 0.0.4) بدون مكتبات إضافية.
+
+Counter / Gauge / Histogram مع labels، وrender() يُرجع النص الذي يخدمه /metrics (webserver.py).
+كل المقاييس معرّفة هنا حتى تكون في مكان واحد.
+"""
+import logging
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+_registry: List["_Metric"] = []
+_collectors: List[Callable[[], None]] = []
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LAG_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _fmt_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{n}="{str(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> Tuple:
+        return tuple(labels.get(n, "") for n in self.labels)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, value: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + value
+
+    def render(self):
+        out = super().render()
+        for key, v in sorted(self._values.items()):
+            out.append(f"{self.name}{_fmt_labels(self.labels, key)} {v}")
+        return out
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def render(self):
+        out = super().render()
+        for key, v in sorted(self._values.items()):
+            out.append(f"{self.name}{_fmt_labels(self.labels, key)} {v}")
+        return out
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [counts لكل bucket..., sum, count]
+        self._values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        row = self._values.get(key)
+        if row is None:
+            row = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+        for i, b in enumerate(self.buckets):
+            if value <= b:
+                row[i] += 1
+        row[-2] += value
+        row[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        out = super().render()
+        for key, row in sorted(self._values.items()):
+            for b, c in zip(self.buckets, row):
+                le = _fmt_labels(self.labels, key, 'le="%s"' % b)
+                out.append(f"{self.name}_bucket{le} {c}")
+            le = _fmt_labels(self.labels, key, 'le="+Inf"')
+            out.append(f"{self.name}_bucket{le} {row[-1]}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labels, key)} {row[-2]}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labels, key)} {row[-1]}")
+        return out
+
+
+def collector(fn: Callable[[], None]):
+    """دالة تُستدعى قبل كل render (لتحديث gauges من حالة حية مثل عمق الطابور)."""
+    _collectors.append(fn)
+    return fn
+
+
+def render() -> str:
+    for fn in _collectors:
+        try:
+            fn()
+        except Exception:
+            logger.exception("metrics: collector failed")
+    lines = []
+    for m in _registry:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+
+class Phases:
+    """تقسيم عملية (مثل tick الجدولة) إلى مراحل بأزمنة تراكمية."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.seconds: Dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - t
+
+    def total(self) -> float:
+        return time.perf_counter() - self.start
+
+    def summary(self) -> str:
+        return ", ".join(f"{k}={v:.3f}s" for k, v in self.seconds.items())
+
+
+# ---------------- المقاييس ----------------
+TICK_SECONDS = Histogram("prayerbot_scheduler_tick_seconds", "Duration of a planning tick by phase", ("phase",))
+TICK_GROUPS = Gauge("prayerbot_scheduler_tick_groups", "Groups planned in the last tick")
+GROUPS = Gauge("prayerbot_groups", "Groups in the registry, and those with a scheduled next transition", ("state",))
+TICK_LAG = Gauge("prayerbot_tick_lag_seconds", "How late the last transition job fired after its planned time")
+TRANSITION_LAG = Histogram("prayerbot_transition_lag_seconds", "Delay between planned transition time and execution", ("action",), LAG_BUCKETS)
+CLOSE_LANDED = Histogram("prayerbot_close_landed_seconds", "How late scheduled closures were applied on Telegram after their target time", (), LAG_BUCKETS)
+BURST_RATE = Gauge("prayerbot_burst_rate", "Send rate measured over the last closure burst (calls/s)")
+TRANSITIONS = Counter("prayerbot_transitions_total", "Close/open transitions by result", ("action", "result"))
+TRANSITION_SECONDS = Histogram("prayerbot_transition_seconds", "Duration of close/open helpers (all Bot API calls)", ("action",))
+PRAYER_TIMES_SECONDS = Histogram("prayerbot_prayer_times_seconds", "Time to get a day's prayer times", ("source",))
+ALADHAN_REQUESTS = Counter("prayerbot_aladhan_requests_total", "Aladhan calendar requests", ("outcome",))
+ALADHAN_SECONDS = Histogram("prayerbot_aladhan_request_seconds", "Aladhan calendar request duration")
+DB_SECONDS = Histogram("prayerbot_db_seconds", "MongoDB call duration by function", ("op",))
+DB_ERRORS = Counter("prayerbot_db_errors_total", "MongoDB calls that raised", ("op",))
+BOT_API_REQUESTS = Counter("prayerbot_bot_api_requests_total", "Bot API requests by endpoint and outcome", ("endpoint", "outcome"))
+BOT_API_SECONDS = Histogram("prayerbot_bot_api_seconds", "Bot API request duration (without queue wait)", ("endpoint",))
+QUEUE_WAIT = Histogram("prayerbot_outbound_wait_seconds", "Time spent waiting in the outbound queue", ("priority",))
+QUEUE_DEPTH = Gauge("prayerbot_outbound_depth", "Requests waiting in the outbound queue", ("priority",))
+UPDATES = Gauge("prayerbot_updates", "Incoming updates being processed, waiting for their chat, or running in background", ("state",))
+STARTUP_SECONDS = Gauge("prayerbot_startup_seconds", "Duration of the last startup by phase", ("phase",))
+EVENTS_BUFFERED = Gauge("prayerbot_events_buffered", "Transition/broadcast events waiting to be written to the event log")
+EVENTS_DROPPED = Counter("prayerbot_events_dropped_total", "Events dropped because the buffer was full (event log unwritable)")
@@ -0,0 +1,264 @@
+# outbound.py
+"""
+طابور مركزي لكل نداءات Bot API الصادرة (يُركَّب كـ rate_limiter للـ Application).
+
+- أولويات: CRITICAL (إغلاق/فتح مجدول) ثم ADMIN (ردود الأوامر، الافتراضي) ثم BULK (إرسال جماعي).
+  التوكن العام يُمنح دائمًا لأعلى أولوية تنتظر، فإعلان كبير لا يؤخّر إغلاق المغرب؛
+  وداخل نفس الأولوية للأقرب موعدًا (deadline: unix، الافتراضي وقت دخول الطابور).
+- bucket لكل شات + احترام RetryAfter (429) كما في محرك الإرسال الجماعي: RetryAfter لنداء على شات يوقف
+  bucket ذلك الشات فقط (إغلاق/فتح الشاتات الأخرى لا ينتظره)، وبدون شات يوقف التوكن العام.
+- عمليات الإغلاق/الفتح لنفس الشات تحمل "جيلًا": إذا بدأت عملية أحدث لنفس الشات
+  تُسقَط نداءات العملية الأقدم التي لم تُرسل بعد (Superseded) بدل تنفيذها متأخرة.
+- stats(): عمق الطابور وزمن الانتظار لكل أولوية.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+import metrics
+import transport
+from config import BROADCAST_MAX_RETRIES, BROADCAST_RATE, PER_CHAT_BURST, PER_CHAT_RATE
+
+logger = logging.getLogger(__name__)
+
+CRITICAL, ADMIN, BULK = 0, 1, 2
+PRIORITY_NAMES = {CRITICAL: "critical", ADMIN: "admin", BULK: "bulk"}
+
+
+class Superseded(Exception):
+    """نداء أُسقط لأن عملية إغلاق/فتح أحدث بدأت لنفس الشات."""
+
+
+def retry_after_seconds(e: RetryAfter) -> float:
+    ra = e.retry_after
+    return ra.total_seconds() if hasattr(ra, "total_seconds") else float(ra)
+
+
+class TokenBucket:
+    """rate توكن في الثانية بسعة capacity؛ acquire ينتظر حتى يتوفر توكن."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def refund(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def idle(self) -> bool:
+        now = time.monotonic()
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.paused_until
+
+
+class PriorityBucket:
+    """TokenBucket يوزّع التوكنات على المنتظرين حسب الأولوية ثم الموعد (ثم الأقدم)."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.bucket = TokenBucket(rate, capacity)
+        self._waiters = []  # heap: (priority, deadline, seq, future)
+        self._seq = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+
+    async def acquire(self, priority: int, deadline: float):
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, deadline, next(self._seq), fut))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._dispatch())
+        await fut
+
+    async def _dispatch(self):
+        while self._waiters:
+            await self.bucket.acquire()
+            while self._waiters:
+                fut = heapq.heappop(self._waiters)[-1]
+                if not fut.done():
+                    fut.set_result(None)
+                    break
+            else:
+                # كل المنتظرين أُلغوا
+                self.bucket.refund()
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class OutboundQueue(BaseRateLimiter):
+    """
+    rate_limit_args (اختياري): {"priority": CRITICAL|ADMIN|BULK, "deadline": unix, "key": ..., "gen": int}.
+    بدون rate_limit_args يُعامل النداء كرد أدمن (ADMIN).
+    """
+
+    def __init__(self, rate: float = BROADCAST_RATE, per_chat_rate: float = PER_CHAT_RATE,
+                 per_chat_burst: float = PER_CHAT_BURST, max_retries: int = BROADCAST_MAX_RETRIES):
+        self.global_bucket = PriorityBucket(rate, rate)
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.max_retries = max_retries
+        self._chats: Dict[Any, TokenBucket] = {}
+        self._generations: Dict[Any, int] = {}
+        self._depth = {p: 0 for p in PRIORITY_NAMES}
+        self._waits = {p: {"count": 0, "total": 0.0, "max": 0.0} for p in PRIORITY_NAMES}
+        self.dropped = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        self.global_bucket.stop()
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                # تنظيف الـ buckets الممتلئة (شاتات بلا نشاط حديث)
+                self._chats = {k: v for k, v in self._chats.items() if not v.idle()}
+            bucket = self._chats[chat_id] = TokenBucket(self.per_chat_rate, self.per_chat_burst)
+        return bucket
+
+    # ---------- عمليات الإغلاق/الفتح ----------
+    def transition_args(self, chat_id, priority: int = CRITICAL, deadline: float = None) -> dict:
+        """
+        بداية عملية إغلاق/فتح جديدة لشات: أي نداءات لعملية سابقة لنفس الشات لم تُرسل بعد تُسقَط.
+        يُمرَّر الناتج كـ rate_limit_args لكل نداءات هذه العملية؛ deadline: موعدها المخطط (unix).
+        """
+        key = ("perm", chat_id)
+        gen = self._generations[key] = self._generations.get(key, 0) + 1
+        if len(self._generations) > 100000:
+            self._generations = {key: gen}
+        out = {"priority": priority, "key": key, "gen": gen}
+        if deadline is not None:
+            out["deadline"] = deadline
+        return out
+
+    def _stale(self, args: dict) -> bool:
+        key = args.get("key")
+        return key is not None and self._generations.get(key) != args.get("gen")
+
+    # ---------- BaseRateLimiter ----------
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        rl = rate_limit_args or {}
+        priority = rl.get("priority", ADMIN)
+        deadline = rl.get("deadline") or time.time()
+        chat_id = data.get("chat_id")
+        attempt = 0
+        while True:
+            if self._stale(rl):
+                self.dropped += 1
+                metrics.BOT_API_REQUESTS.inc(endpoint=endpoint, outcome="superseded")
+                raise Superseded(f"{endpoint} for {chat_id} superseded by a newer transition")
+            enqueued = time.monotonic()
+            self._depth[priority] += 1
+            try:
+                if chat_id is not None:
+                    await self._chat_bucket(chat_id).acquire()
+                await self.global_bucket.acquire(priority, deadline)
+            finally:
+                self._depth[priority] -= 1
+            self._record_wait(priority, time.monotonic() - enqueued)
+            # عملية أحدث لنفس الشات بدأت أثناء الانتظار -> لا نرسل نداءً قديمًا
+            if self._stale(rl):
+                self.global_bucket.bucket.refund()
+                self.dropped += 1
+                metrics.BOT_API_REQUESTS.inc(endpoint=endpoint, outcome="superseded")
+                raise Superseded(f"{endpoint} for {chat_id} superseded by a newer transition")
+            start = time.monotonic()
+            # الإرسال الجماعي على pool اتصالات منفصل (transport.py)
+            token = transport.lane.set(transport.BULK if priority == BULK else transport.CRITICAL)
+            try:
+                result = await callback(*args, **kwargs)
+                metrics.BOT_API_REQUESTS.inc(endpoint=endpoint, outcome="ok")
+                return result
+            except RetryAfter as e:
+                metrics.BOT_API_REQUESTS.inc(endpoint=endpoint, outcome="retry_after")
+                error = e
+            except Exception as e:
+                metrics.BOT_API_REQUESTS.inc(endpoint=endpoint, outcome=type(e).__name__)
+                raise
+            finally:
+                transport.lane.reset(token)
+                metrics.BOT_API_SECONDS.observe(time.monotonic() - start, endpoint=endpoint)
+            attempt += 1
+            delay = retry_after_seconds(error)
+            # الإغلاق/الفتح المجدول لا يستسلم بسرعة أمام flood control
+            if attempt > (self.max_retries if priority != CRITICAL else self.max_retries * 3):
+                raise error
+            logger.warning("flood control on %s for %s: retry %d after %.1fs", endpoint, chat_id, attempt, delay)
+            # acquire في الدورة التالية ينتظر انتهاء الإيقاف
+            if chat_id is not None:
+                self._chat_bucket(chat_id).pause(delay)
+            else:
+                self.global_bucket.bucket.pause(delay)
+
+    def _record_wait(self, priority: int, waited: float):
+        w = self._waits[priority]
+        w["count"] += 1
+        w["total"] += waited
+        w["max"] = max(w["max"], waited)
+        metrics.QUEUE_WAIT.observe(waited, priority=PRIORITY_NAMES[priority])
+
+    def stats(self) -> dict:
+        """عمق الطابور الحالي وزمن الانتظار (متوسط/أقصى بالثواني) لكل أولوية."""
+        out = {}
+        for p, name in PRIORITY_NAMES.items():
+            w = self._waits[p]
+            out[name] = {
+                "depth": self._depth[p],
+                "sent": w["count"],
+                "avg_wait": w["total"] / w["count"] if w["count"] else 0.0,
+                "max_wait": w["max"],
+            }
+        out["dropped"] = self.dropped
+        return out
+
+
+# الطابور المشترك لكل البوت (يُمرَّر إلى Application.builder().rate_limiter)
+queue = OutboundQueue()
+
+
+@metrics.collector
+def _collect_depth():
+    for p, name in PRIORITY_NAMES.items():
+        metrics.QUEUE_DEPTH.set(queue._depth[p], priority=name)
+
+
+def caller(priority: int):
+    """call(chat_id, fn, *args, **kwargs) لـ fan_out: نداء Bot API بأولوية محددة عبر الطابور."""
+    async def call(chat_id, fn, /, *args, **kwargs):
+        kwargs.setdefault("rate_limit_args", {"priority": priority})
+        return await fn(*args, **kwargs)
+    return call
+
+
+bulk_call = caller(BULK)
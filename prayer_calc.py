@@ -0,0 +1,237 @@
+# prayer_calc.py
+"""
+محرك حساب أوقات الصلاة محليًا (بدون HTTP) باستعمال NumPy.
+
+نفس خوارزمية PrayTimes التي يعتمد عليها Aladhan، لكن محسوبة دفعة واحدة
+على مصفوفة أيام × مصفوفة إحداثيات، فيمكن ملء سنة كاملة لعدة مواقع بنداء واحد.
+أرقام الطرق هي نفسها أرقام Aladhan (config.METHOD).
+"""
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Sequence, Union
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from config import LAT, LON, METHOD, TIMEZONE
+
+PRAYERS = ["Fajr", "Dhuhr", "Asr", "Maghrib", "Isha"]
+
+# fajr/isha: زاوية بالدرجات، أو "N min" (دقائق بعد المغرب للعشاء)
+# maghrib: زاوية، أو "N min" بعد الغروب (الافتراضي 0 min)
+# offsets: تعديلات Aladhan الثابتة بالدقائق لكل وقت
+METHODS = {
+    0: {"name": "Shia Ithna-Ashari", "fajr": 16, "isha": 14, "maghrib": 4},
+    1: {"name": "University of Islamic Sciences, Karachi", "fajr": 18, "isha": 18},
+    2: {"name": "Islamic Society of North America", "fajr": 15, "isha": 15},
+    3: {"name": "Muslim World League", "fajr": 18, "isha": 17},
+    4: {"name": "Umm Al-Qura University, Makkah", "fajr": 18.5, "isha": "90 min"},
+    5: {"name": "Egyptian General Authority of Survey", "fajr": 19.5, "isha": 17.5},
+    7: {"name": "Institute of Geophysics, University of Tehran", "fajr": 17.7, "isha": 14, "maghrib": 4.5},
+    8: {"name": "Gulf Region", "fajr": 19.5, "isha": "90 min"},
+    9: {"name": "Kuwait", "fajr": 18, "isha": 17.5},
+    10: {"name": "Qatar", "fajr": 18, "isha": "90 min"},
+    11: {"name": "Majlis Ugama Islam Singapura", "fajr": 20, "isha": 18},
+    12: {"name": "Union Organization Islamic de France", "fajr": 12, "isha": 12},
+    13: {"name": "Diyanet İşleri Başkanlığı, Turkey", "fajr": 18, "isha": 17,
+         "offsets": {"Dhuhr": 5, "Asr": 4, "Maghrib": 7}},
+    14: {"name": "Spiritual Administration of Muslims of Russia", "fajr": 16, "isha": 15},
+    16: {"name": "Dubai", "fajr": 18.2, "isha": 18.2,
+         "offsets": {"Dhuhr": 3, "Asr": 3, "Maghrib": 3}},
+    17: {"name": "Jabatan Kemajuan Islam Malaysia (JAKIM)", "fajr": 20, "isha": 18},
+    18: {"name": "Tunisia", "fajr": 18, "isha": 18},
+    19: {"name": "Algeria", "fajr": 18, "isha": 17},
+    20: {"name": "Kementerian Agama Republik Indonesia", "fajr": 20, "isha": 18},
+    21: {"name": "Morocco", "fajr": 19, "isha": 17,
+         "offsets": {"Dhuhr": 5, "Maghrib": 5}},
+    22: {"name": "Comunidade Islamica de Lisboa", "fajr": 18, "isha": "77 min", "maghrib": "3 min"},
+    23: {"name": "Ministry of Awqaf, Jordan", "fajr": 18, "isha": 18, "maghrib": "5 min"},
+}
+
+RISE_SET_ANGLE = 0.833
+
+
+# ---------- دوال رياضية بالدرجات ----------
+def _dsin(d):
+    return np.sin(np.radians(d))
+
+
+def _dcos(d):
+    return np.cos(np.radians(d))
+
+
+def _dtan(d):
+    return np.tan(np.radians(d))
+
+
+def _darcsin(x):
+    return np.degrees(np.arcsin(x))
+
+
+def _darccos(x):
+    return np.degrees(np.arccos(x))
+
+
+def _darctan2(y, x):
+    return np.degrees(np.arctan2(y, x))
+
+
+def _darccot(x):
+    return np.degrees(np.arctan(1.0 / x))
+
+
+def _fix(a, b):
+    return a - b * np.floor(a / b)
+
+
+def _is_minutes(v) -> bool:
+    return isinstance(v, str) and v.endswith("min")
+
+
+def _value(v) -> float:
+    return float(v.split()[0]) if isinstance(v, str) else float(v)
+
+
+def _julian(days: Sequence[date]) -> np.ndarray:
+    y = np.array([d.year for d in days], dtype=float)
+    m = np.array([d.month for d in days], dtype=float)
+    dd = np.array([d.day for d in days], dtype=float)
+    jan_feb = m <= 2
+    y = np.where(jan_feb, y - 1, y)
+    m = np.where(jan_feb, m + 12, m)
+    a = np.floor(y / 100)
+    b = 2 - a + np.floor(a / 4)
+    return np.floor(365.25 * (y + 4716)) + np.floor(30.6001 * (m + 1)) + dd + b - 1524.5
+
+
+def _sun_position(jd):
+    """(declination, equation of time) لمصفوفة أيام جوليانية."""
+    d = jd - 2451545.0
+    g = _fix(357.529 + 0.98560028 * d, 360)
+    q = _fix(280.459 + 0.98564736 * d, 360)
+    l = _fix(q + 1.915 * _dsin(g) + 0.020 * _dsin(2 * g), 360)
+    e = 23.439 - 0.00000036 * d
+    ra = _darctan2(_dcos(e) * _dsin(l), _dcos(l)) / 15.0
+    eqt = q / 15.0 - _fix(ra, 24)
+    decl = _darcsin(_dsin(e) * _dsin(l))
+    return decl, eqt
+
+
+def _mid_day(jd, t):
+    _, eqt = _sun_position(jd + t)
+    return _fix(12 - eqt, 24)
+
+
+def _sun_angle_time(jd, lat, angle, t, ccw=False):
+    decl, _ = _sun_position(jd + t)
+    noon = _mid_day(jd, t)
+    with np.errstate(invalid="ignore"):
+        tt = _darccos((-_dsin(angle) - _dsin(decl) * _dsin(lat)) / (_dcos(decl) * _dcos(lat))) / 15.0
+    return noon - tt if ccw else noon + tt
+
+
+def _asr_time(jd, lat, factor, t):
+    decl, _ = _sun_position(jd + t)
+    angle = -_darccot(factor + _dtan(np.abs(lat - decl)))
+    return _sun_angle_time(jd, lat, angle, t)
+
+
+def _utc_offsets(days: Sequence[date], timezones: Sequence[str]) -> np.ndarray:
+    """فرق التوقيت بالساعات لكل (موقع، يوم) مع احتساب التوقيت الصيفي."""
+    out = np.empty((len(timezones), len(days)))
+    cache = {}
+    for i, name in enumerate(timezones):
+        if name not in cache:
+            zone = ZoneInfo(name)
+            cache[name] = [
+                datetime.combine(d, time(12), tzinfo=zone).utcoffset().total_seconds() / 3600.0 for d in days
+            ]
+        out[i] = cache[name]
+    return out
+
+
+def compute_minutes(
+    days: Sequence[date],
+    lats: Union[float, Sequence[float]] = LAT,
+    lons: Union[float, Sequence[float]] = LON,
+    timezones: Union[str, Sequence[str]] = TIMEZONE,
+    method: int = METHOD,
+    asr_factor: int = 1,
+) -> np.ndarray:
+    """
+    أوقات الصلوات الخمس كدقائق منذ منتصف الليل المحلي.
+    تُرجع مصفوفة int32 بالشكل (عدد المواقع، عدد الأيام، 5) بترتيب PRAYERS.
+    """
+    if method not in METHODS:
+        raise ValueError(f"unsupported calculation method: {method}")
+    params = METHODS[method]
+    days = list(days)
+    lats = np.atleast_1d(np.asarray(lats, dtype=float))[:, None]
+    lons = np.atleast_1d(np.asarray(lons, dtype=float))[:, None]
+    if isinstance(timezones, str):
+        timezones = [timezones] * lats.shape[0]
+    offsets = _utc_offsets(days, timezones)
+
+    jd = _julian(days)[None, :] - lons / (15.0 * 24.0)
+
+    # تكرار واحد انطلاقًا من الأوقات التقريبية الافتراضية (كجزء من اليوم)
+    fajr = _sun_angle_time(jd, lats, _value(params["fajr"]), 5 / 24.0, ccw=True)
+    sunrise = _sun_angle_time(jd, lats, RISE_SET_ANGLE, 6 / 24.0, ccw=True)
+    dhuhr = _mid_day(jd, 12 / 24.0)
+    asr = _asr_time(jd, lats, asr_factor, 13 / 24.0)
+    sunset = _sun_angle_time(jd, lats, RISE_SET_ANGLE, 18 / 24.0)
+    maghrib_param = params.get("maghrib", "0 min")
+    if _is_minutes(maghrib_param):
+        maghrib = sunset
+    else:
+        maghrib = _sun_angle_time(jd, lats, _value(maghrib_param), 18 / 24.0)
+    isha_param = params["isha"]
+    isha = sunset if _is_minutes(isha_param) else _sun_angle_time(jd, lats, _value(isha_param), 18 / 24.0)
+
+    # تحويل إلى التوقيت المحلي
+    shift = offsets - lons / 15.0
+    fajr, sunrise, dhuhr, asr, sunset, maghrib, isha = (
+        x + shift for x in (fajr, sunrise, dhuhr, asr, sunset, maghrib, isha)
+    )
+
+    # تعديل خطوط العرض العالية (angle-based، الافتراضي في Aladhan)
+    night = _fix(sunrise - sunset, 24)
+    portion = _value(params["fajr"]) / 60.0 * night
+    bad = np.isnan(fajr) | (_fix(sunrise - fajr, 24) > portion)
+    fajr = np.where(bad, sunrise - portion, fajr)
+    if not _is_minutes(isha_param):
+        portion = _value(isha_param) / 60.0 * night
+        bad = np.isnan(isha) | (_fix(isha - sunset, 24) > portion)
+        isha = np.where(bad, sunset + portion, isha)
+    if not _is_minutes(maghrib_param):
+        portion = _value(maghrib_param) / 60.0 * night
+        bad = np.isnan(maghrib) | (_fix(maghrib - sunset, 24) > portion)
+        maghrib = np.where(bad, sunset + portion, maghrib)
+
+    if _is_minutes(maghrib_param):
+        maghrib = maghrib + _value(maghrib_param) / 60.0
+    if _is_minutes(isha_param):
+        isha = maghrib + _value(isha_param) / 60.0
+
+    result = np.stack([fajr, dhuhr, asr, maghrib, isha], axis=-1) * 60.0
+    for i, name in enumerate(PRAYERS):
+        result[..., i] += params.get("offsets", {}).get(name, 0)
+    # تقريب لأقرب دقيقة (مثل Aladhan)
+    return np.floor(result + 0.5).astype(np.int32)
+
+
+def compute_year(year: int, lats, lons, timezones=TIMEZONE, method: int = METHOD) -> np.ndarray:
+    """سنة كاملة لعدة مواقع دفعة واحدة: الشكل (مواقع، أيام السنة، 5)."""
+    first = date(year, 1, 1)
+    n = (date(year + 1, 1, 1) - first).days
+    return compute_minutes([first + timedelta(days=i) for i in range(n)], lats, lons, timezones, method)
+
+
+def minutes_to_times(d: date, minutes: Sequence[int], timezone: str = TIMEZONE) -> Dict[str, datetime]:
+    """تحويل صف دقائق (5 قيم) إلى قاموس tz-aware datetimes كما يُرجعه fetch_prayer_times."""
+    midnight = datetime.combine(d, time(0), tzinfo=ZoneInfo(timezone))
+    return {name: midnight + timedelta(minutes=int(m)) for name, m in zip(PRAYERS, minutes)}
+
+
+def compute_prayer_times(d: date, lat: float = LAT, lon: float = LON, method: int = METHOD, timezone: str = TIMEZONE):
+    """بديل محلي لـ fetch_prayer_times ليوم واحد وموقع واحد."""
+    return minutes_to_times(d, compute_minutes([d], lat, lon, timezone, method)[0, 0], timezone)
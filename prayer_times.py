@@ -0,0 +1,221 @@
+# prayer_times.py
+"""
+مزوّد أوقات الصلاة.
+
+- يجلب شهرًا كاملًا من Aladhan (calendar endpoint) بطلب HTTP واحد غير متزامن.
+- يحتفظ بكاش في الذاكرة مفتاحه (date, lat, lon, method, timezone).
+- يحفظ الكاش في ملف محلي حتى لا نعيد الجلب بعد إعادة التشغيل: الكتابة في thread، مرة لكل دفعة جلبات
+  متقاربة (SAVE_DELAY) وليس بعد كل شهر؛ prune() (tick الجدولة اليومي) يحذف ما قبل أمس.
+- إذا تعذّر الوصول إلى Aladhan (أو PRAYER_SOURCE=local) نحسب الأوقات محليًا عبر prayer_calc؛ بعد فشل
+  لا نحاول Aladhan مرة أخرى قبل FAILURE_BACKOFF ثانية (وإلا انتظر كل يوم غير مخزّن مهلة الطلب كاملة).
+- قبل كل ذلك: الجدول السنوي المحسوب مسبقًا (timetable.py) إن كانت السلة فيه.
+"""
+import asyncio
+import json
+import logging
+import os
+import time as _time
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+import httpx
+
+from config import ALADHAN_CONCURRENCY, LAT, LON, METHOD, TIMEZONE, TIMES_CACHE_FILE, PRAYER_SOURCE
+from prayer_calc import PRAYERS, METHODS, compute_prayer_times, minutes_to_times
+import metrics
+import timetable
+import transport
+
+logger = logging.getLogger(__name__)
+
+CALENDAR_URL = "https://api.aladhan.com/v1/calendar/{year}/{month}"
+
+# (date_iso, lat, lon, method, timezone) -> {"Fajr": "05:12", ...}
+_cache: Dict[Tuple, Dict[str, str]] = {}
+_month_locks: Dict[Tuple, asyncio.Lock] = {}
+_client: Optional[httpx.AsyncClient] = None
+_loaded = False
+# كتابة الملف مؤجلة: الجلبات خلال SAVE_DELAY ثانية (بناء الجدول، عدة سلال عند التشغيل) تُكتب مرة واحدة
+SAVE_DELAY = 2.0
+_save_task: Optional[asyncio.Task] = None
+_save_now: Optional[asyncio.Event] = None
+# بعد فشل جلب: الحساب المحلي مباشرة حتى هذه اللحظة (monotonic)، ثم محاولة جديدة
+FAILURE_BACKOFF = 300.0
+_down_until = 0.0
+
+
+def _key(d: date, lat: float, lon: float, method: int, timezone: str) -> Tuple:
+    return (d.isoformat(), round(float(lat), 4), round(float(lon), 4), int(method), timezone)
+
+
+def _load_cache_file():
+    """تحميل الكاش من القرص مرة واحدة (عند أول استعمال)."""
+    global _loaded
+    if _loaded:
+        return
+    _loaded = True
+    if not TIMES_CACHE_FILE or not os.path.exists(TIMES_CACHE_FILE):
+        return
+    try:
+        with open(TIMES_CACHE_FILE, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+        for k, timings in raw.items():
+            d, lat, lon, method, timezone = k.split("|")
+            _cache[(d, float(lat), float(lon), int(method), timezone)] = timings
+        logger.info("prayer_times: loaded %d cached days from %s", len(raw), TIMES_CACHE_FILE)
+    except Exception:
+        logger.exception("prayer_times: failed to read cache file %s", TIMES_CACHE_FILE)
+
+
+def _write_cache_file(raw: dict):
+    """كتابة الكاش على القرص بشكل ذري (tmp ثم replace)؛ تعمل في thread."""
+    try:
+        folder = os.path.dirname(TIMES_CACHE_FILE)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        tmp = TIMES_CACHE_FILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(raw, f)
+        os.replace(tmp, TIMES_CACHE_FILE)
+    except Exception:
+        logger.exception("prayer_times: failed to write cache file %s", TIMES_CACHE_FILE)
+
+
+def _schedule_save():
+    global _save_task, _save_now
+    if not TIMES_CACHE_FILE or (_save_task is not None and not _save_task.done()):
+        return
+    _save_now = asyncio.Event()
+    _save_task = asyncio.create_task(_save_later(_save_now))
+
+
+async def _save_later(now: asyncio.Event):
+    try:
+        await asyncio.wait_for(now.wait(), SAVE_DELAY)
+    except asyncio.TimeoutError:
+        pass
+    # نسخة في الـ event loop (الكاش يتغير)، والكتابة نفسها في thread
+    raw = {"|".join(str(p) for p in k): v for k, v in _cache.items()}
+    await asyncio.to_thread(_write_cache_file, raw)
+
+
+def prune(today: Optional[date] = None):
+    """
+    حذف الأيام الأقدم من أمس من الكاش وأقفال الأشهر المنتهية (tick الجدولة اليومي).
+    اليوم بتوقيت UTC: أمس UTC لا يسبق أمس أي منطقة زمنية بأكثر من يوم، فلا يُحذف يوم ما زال مطلوبًا.
+    """
+    yesterday = (today or date(*_time.gmtime()[:3])) - timedelta(days=1)
+    cutoff = yesterday.isoformat()
+    old = [k for k in _cache if k[0] < cutoff]
+    for k in old:
+        del _cache[k]
+    month = (yesterday.year, yesterday.month)
+    for k in [k for k, lock in _month_locks.items() if k[:2] < month and not lock.locked()]:
+        del _month_locks[k]
+    if old:
+        logger.info("prayer_times: pruned %d cached days before %s", len(old), cutoff)
+        _schedule_save()
+
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        # طلبات Aladhan قليلة (شهر لكل طلب)، لكن بناء الجدول السنوي يرسل عدة طلبات متزامنة
+        _client = transport.http_client(pool_size=ALADHAN_CONCURRENCY, read_timeout=20)
+    return _client
+
+
+async def close_client():
+    """إغلاق عميل HTTP وكتابة الكاش المؤجلة (يُستدعى عند إيقاف البوت)."""
+    global _client
+    if _save_task is not None and not _save_task.done():
+        _save_now.set()
+        await _save_task
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def _fetch_month(year: int, month: int, lat: float, lon: float, method: int, timezone: str):
+    """جلب شهر كامل من calendar endpoint وتعبئة الكاش به."""
+    params = {"latitude": lat, "longitude": lon, "method": method, "timezonestring": timezone}
+    start = _time.perf_counter()
+    try:
+        r = await _get_client().get(CALENDAR_URL.format(year=year, month=month), params=params)
+        r.raise_for_status()
+    except Exception:
+        metrics.ALADHAN_REQUESTS.inc(outcome="error")
+        raise
+    finally:
+        metrics.ALADHAN_SECONDS.observe(_time.perf_counter() - start)
+    metrics.ALADHAN_REQUESTS.inc(outcome="ok")
+    for day in r.json()["data"]:
+        dd, mm, yyyy = day["date"]["gregorian"]["date"].split("-")
+        d = date(int(yyyy), int(mm), int(dd))
+        # Aladhan يُرجع القيم بصيغة "05:12 (CET)"
+        timings = {name: day["timings"][name].split(" ")[0] for name in PRAYERS}
+        _cache[_key(d, lat, lon, method, timezone)] = timings
+    _schedule_save()
+
+
+async def get_prayer_times(d: date, lat: float = LAT, lon: float = LON, method: int = METHOD, timezone: str = TIMEZONE,
+                           use_timetable: bool = True):
+    """
+    أوقات الصلاة ليوم d كـ tz-aware datetimes.
+    لا يوجد أي طلب شبكة إذا كان اليوم موجودًا في الجدول السنوي أو في الكاش.
+    use_timetable=False لبناء الجدول نفسه من المصدر.
+    """
+    global _down_until
+    start = _time.perf_counter()
+    if use_timetable:
+        minutes = timetable.lookup(d, lat, lon, method, timezone)
+        if minutes is not None:
+            out = minutes_to_times(d, minutes, timezone)
+            metrics.PRAYER_TIMES_SECONDS.observe(_time.perf_counter() - start, source="timetable")
+            return out
+    if PRAYER_SOURCE == "local":
+        with metrics.PRAYER_TIMES_SECONDS.time(source="local"):
+            return compute_prayer_times(d, lat, lon, method, timezone)
+    _load_cache_file()
+    key = _key(d, lat, lon, method, timezone)
+    timings = _cache.get(key)
+    source = "cache"
+    if timings is None and method in METHODS and _time.monotonic() < _down_until:
+        return _local(d, lat, lon, method, timezone, start)
+    if timings is None:
+        source = "aladhan"
+        month_key = (d.year, d.month) + key[1:]
+        lock = _month_locks.setdefault(month_key, asyncio.Lock())
+        async with lock:
+            # ربما جلبه طلب آخر أثناء انتظارنا للقفل
+            timings = _cache.get(key)
+            if timings is None:
+                if method in METHODS and _time.monotonic() < _down_until:
+                    # فشل طلب آخر أثناء انتظارنا للقفل
+                    return _local(d, lat, lon, method, timezone, start)
+                try:
+                    await _fetch_month(d.year, d.month, lat, lon, method, timezone)
+                    timings = _cache[key]
+                except Exception:
+                    if method not in METHODS:
+                        raise
+                    _down_until = _time.monotonic() + FAILURE_BACKOFF
+                    logger.warning("prayer_times: Aladhan unavailable, using local calculation for %ss",
+                                   FAILURE_BACKOFF, exc_info=True)
+                    return _local(d, lat, lon, method, timezone, start)
+
+    tz = ZoneInfo(timezone)
+    out = {}
+    for name in PRAYERS:
+        hh, mm = timings[name].split(":")[:2]
+        out[name] = datetime.combine(d, time(int(hh), int(mm)), tzinfo=tz)
+    metrics.PRAYER_TIMES_SECONDS.observe(_time.perf_counter() - start, source=source)
+    return out
+
+
+def _local(d: date, lat: float, lon: float, method: int, timezone: str, start: float):
+    """الحساب المحلي بدل Aladhan (لا يُكتب في الكاش: يُعاد الجلب من Aladhan بعد FAILURE_BACKOFF)."""
+    out = compute_prayer_times(d, lat, lon, method, timezone)
+    metrics.PRAYER_TIMES_SECONDS.observe(_time.perf_counter() - start, source="local")
+    return out
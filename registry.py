@@ -0,0 +1,227 @@
+# registry.py
+"""
+سجل القروبات المقيم في الذاكرة مع فهرس زمني لانتقالاتها القادمة.
+
+- سجل مضغوط (__slots__) لكل قروب: chat_id، thread_id، إعداداته، وانتقاله القادم (إغلاق/فتح، موعده، نصه).
+  الإعدادات الاختيارية (lat/lon/method/timezone/durations) تُخزَّن مرة لكل تركيبة مختلفة (profile)
+  يشير إليها كل قروب يستعملها، والنصوص مشتركة (sys.intern).
+- الانتقال القادم لكل قروب مدخل (due, chat_id) في heap مرتب بالموعد: main.py يضبط مؤقتًا واحدًا
+  على أقرب موعد ويأخذ عنده القروبات المستحقة فقط (pop_due) بدل job لكل قروب.
+  إعادة جدولة قروب لا تحذف من الـ heap: المدخل القديم يُهمل عند خروجه (المدخل المعتمد هو المحفوظ
+  في سجل القروب)، ويُعاد بناء الـ heap إذا تراكمت المدخلات الملغاة.
+- يُملأ من القاعدة على دفعات (database.load_groups_db) ويُحدَّث في مكانه عند /bind و /setloc والحذف
+  وتغييرات القاعدة من عمليات أخرى؛ إعادة التحميل لا تمس الانتقالات المجدولة.
+
+الحالة المطبّقة (مغلق/مفتوح) تبقى في مجموعة state (transitions.py) لأنها مشتركة بين العمليات.
+"""
+import heapq
+import sys
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import metrics
+
+# إعدادات اختيارية لكل قروب (الافتراضي من config / main.DURATIONS)
+SETTINGS = ("lat", "lon", "method", "timezone", "durations")
+
+
+class Group:
+    __slots__ = ("chat_id", "thread_id", "profile", "entry", "at", "action", "text", "prayer")
+
+    def __init__(self, chat_id: int, thread_id: Optional[int], profile: dict):
+        self.chat_id = chat_id
+        self.thread_id = thread_id
+        self.profile = profile  # مشترك بين القروبات ذات نفس الإعدادات: لا يُعدَّل في مكانه
+        self.entry: Optional[Tuple[float, int]] = None  # مدخل الانتقال القادم في _heap
+        self.at: Optional[float] = None  # موعد الانتقال (unix)؛ None لإعادة محاولة (= لحظة التنفيذ)
+        self.action: Optional[str] = None  # "close" | "open"
+        self.text: Optional[str] = None
+        self.prayer: Optional[str] = None  # النافذة (اسم الصلاة أو "night") لسجل الأحداث
+
+    def info(self) -> dict:
+        """نفس شكل وثيقة القروب: {"chat_id", "thread_id", + الإعدادات}."""
+        return {"chat_id": self.chat_id, "thread_id": self.thread_id, **self.profile}
+
+
+_groups: Dict[int, Group] = {}
+_profiles: Dict[tuple, dict] = {}
+_heap: List[Tuple[float, int]] = []
+
+loaded = False  # اكتمل تحميل من القاعدة أو من الـ snapshot
+# أثناء إعادة التحميل: القروبات التي رآها التحميل أو عُدّلت محليًا، والتي حُذفت محليًا
+_seen: Optional[Set[int]] = None
+_removed: Set[int] = set()
+
+
+def _profile(settings: dict) -> dict:
+    key = tuple(
+        (k, tuple(sorted(v.items())) if isinstance(v, dict) else v)
+        for k, v in ((k, settings.get(k)) for k in SETTINGS) if v is not None
+    )
+    profile = _profiles.get(key)
+    if profile is None:
+        profile = _profiles[key] = {k: settings[k] for k, _ in key}
+    return profile
+
+
+def put(doc: dict) -> Optional[Group]:
+    """قروب من وثيقة القاعدة (كاملة)؛ السجل الموجود يُحدَّث في مكانه فيبقى انتقاله القادم."""
+    chat_id = int(doc["chat_id"])
+    if _seen is not None:
+        if chat_id in _removed:
+            return None  # حُذف محليًا بعد أن قرأه التحميل
+        _seen.add(chat_id)
+    g = _groups.get(chat_id)
+    if g is None:
+        g = _groups[chat_id] = Group(chat_id, doc.get("thread_id"), _profile(doc))
+    else:
+        g.thread_id = doc.get("thread_id")
+        g.profile = _profile(doc)
+    return g
+
+
+def update(chat_id: int, fields: dict):
+    """تعديل محلي (/bind، /setloc، /setdur): الحقول المعطاة فقط."""
+    g = _groups.get(chat_id)
+    if g is None:
+        put(dict(fields, chat_id=chat_id))
+        return
+    if "thread_id" in fields:
+        g.thread_id = fields["thread_id"]
+    g.profile = _profile({**g.profile, **fields})
+    if _seen is not None:
+        _seen.add(chat_id)
+
+
+def remove(chat_id: int):
+    _groups.pop(chat_id, None)
+    if _seen is not None:
+        _removed.add(chat_id)
+
+
+def begin_load():
+    global _seen
+    _seen = set()
+    _removed.clear()
+
+
+def end_load():
+    """بعد تحميل كامل: حذف القروبات التي لم تعد في القاعدة."""
+    global _seen, loaded
+    if _seen is not None:
+        for chat_id in [c for c in _groups if c not in _seen]:
+            del _groups[chat_id]
+    _seen = None
+    _removed.clear()
+    loaded = True
+    _compact()
+
+
+def get(chat_id: int) -> Optional[Group]:
+    return _groups.get(chat_id)
+
+
+def info(chat_id: int) -> Optional[dict]:
+    g = _groups.get(chat_id)
+    return g.info() if g is not None else None
+
+
+def count() -> int:
+    return len(_groups)
+
+
+def groups() -> Iterator[Group]:
+    return iter(list(_groups.values()))
+
+
+def targets() -> List[Tuple[int, Optional[int]]]:
+    """(chat_id, thread_id) لكل القروبات (لـ fan_out)."""
+    return [(g.chat_id, g.thread_id) for g in _groups.values()]
+
+
+def profiles() -> List[dict]:
+    """الإعدادات المختلفة المستعملة فعلًا (الجدول يُحسب مرة لكل واحدة وليس لكل قروب)."""
+    return list({id(g.profile): g.profile for g in _groups.values()}.values())
+
+
+# ---------------- الانتقالات القادمة ----------------
+def schedule(chat_id: int, due: float, action: str, text: str, at: Optional[float], prayer: Optional[str] = None) -> bool:
+    """الانتقال القادم للقروب عند due (يحل محل السابق). False إن لم يكن القروب في السجل."""
+    g = _groups.get(chat_id)
+    if g is None:
+        return False
+    g.entry = entry = (due, chat_id)
+    g.at = due if at == due else at  # نفس الكائن: لا ذاكرة إضافية للحالة العادية
+    g.action = action
+    g.text = sys.intern(text) if text else text
+    g.prayer = sys.intern(prayer) if prayer else prayer
+    heapq.heappush(_heap, entry)
+    if len(_heap) > 2 * len(_groups) + 1024:
+        _compact()
+    return True
+
+
+def cancel(chat_id: int):
+    g = _groups.get(chat_id)
+    if g is not None:
+        g.entry = None
+
+
+def pending(chat_id: int) -> bool:
+    g = _groups.get(chat_id)
+    return g is not None and g.entry is not None
+
+
+def next_due() -> Optional[float]:
+    """موعد أقرب انتقال مجدول (بعد إهمال المدخلات الملغاة في رأس الـ heap)."""
+    while _heap:
+        entry = _heap[0]
+        g = _groups.get(entry[1])
+        if g is not None and g.entry is entry:
+            return entry[0]
+        heapq.heappop(_heap)
+    return None
+
+
+def pop_due(now: float) -> List[Tuple[Group, str, Optional[float], str, Optional[str]]]:
+    """الانتقالات التي حان موعدها: (القروب، action، at، النص، الصلاة)؛ تُزال من الجدولة."""
+    out = []
+    while _heap and _heap[0][0] <= now:
+        entry = heapq.heappop(_heap)
+        g = _groups.get(entry[1])
+        if g is not None and g.entry is entry:
+            g.entry = None
+            out.append((g, g.action, g.at, g.text, g.prayer))
+    return out
+
+
+def unscheduled() -> List[Group]:
+    """القروبات التي ليس لها انتقال مجدول (جديدة، أو انقطعت سلسلتها بخطأ)."""
+    return [g for g in _groups.values() if g.entry is None]
+
+
+def scheduled() -> int:
+    return sum(1 for g in _groups.values() if g.entry is not None)
+
+
+def _compact():
+    global _heap
+    _heap = [g.entry for g in _groups.values() if g.entry is not None]
+    heapq.heapify(_heap)
+
+
+def reset(docs: Iterable[dict] = ()):
+    """سجل جديد من وثائق (snapshot) بدون انتقالات مجدولة."""
+    global loaded, _seen
+    _groups.clear()
+    _heap.clear()
+    _seen = None
+    _removed.clear()
+    for doc in docs:
+        put(doc)
+    loaded = True
+
+
+@metrics.collector
+def _collect():
+    metrics.GROUPS.set(len(_groups), state="registered")
+    metrics.GROUPS.set(scheduled(), state="scheduled")
@@ -0,0 +1,87 @@
+# scheduler.py
+"""
+تخطيط نوافذ الإغلاق والانتقالات (إغلاق/فتح) انطلاقًا من جدول أوقات اليوم.
+
+دوال بحتة بدون Telegram أو DB: main.py يستعملها لتسجيل job واحد (run_once)
+لكل انتقال قادم بدل فحص كل القروبات كل دقيقة.
+"""
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# النافذة الليلية: إغلاق عند 00:00 وفتح عند 05:00 (أو نهاية الصلاة إن كانت أبعد)
+NIGHT_START = time(0, 0)
+NIGHT_END = time(5, 0)
+
+
+class Window(NamedTuple):
+    start: datetime
+    end: datetime
+    kind: str  # "prayer" | "night"
+    prayer: Optional[str] = None
+
+
+class Block(NamedTuple):
+    """نوافذ متداخلة مدموجة: إغلاق عند start بنص opener، وفتح عند end بنص closer."""
+    start: datetime
+    end: datetime
+    opener: Window
+    closer: Window
+
+
+class Transition(NamedTuple):
+    at: datetime
+    action: str  # "close" | "open"
+    window: Window
+
+
+def day_windows(d: date, times: Dict[str, datetime], durations: Dict[str, int], tz) -> List[Window]:
+    """نوافذ الإغلاق ليوم d: الليلية + نافذة لكل صلاة."""
+    out = [Window(
+        datetime.combine(d, NIGHT_START, tzinfo=tz),
+        datetime.combine(d, NIGHT_END, tzinfo=tz),
+        "night",
+    )]
+    for pname, start in times.items():
+        out.append(Window(start, start + timedelta(minutes=durations.get(pname, 20)), "prayer", pname))
+    return out
+
+
+def merge_windows(windows: List[Window]) -> List[Block]:
+    blocks: List[Block] = []
+    for w in sorted(windows, key=lambda w: (w.start, w.end)):
+        if blocks and w.start <= blocks[-1].end:
+            last = blocks[-1]
+            if w.end > last.end:
+                blocks[-1] = last._replace(end=w.end, closer=w)
+        else:
+            blocks.append(Block(w.start, w.end, w, w))
+    return blocks
+
+
+def active_block(now: datetime, blocks: List[Block]) -> Optional[Block]:
+    """النافذة (المدموجة) التي تحتوي اللحظة now، إن وُجدت."""
+    for b in blocks:
+        if b.start <= now < b.end:
+            return b
+    return None
+
+
+def next_transition(now: datetime, blocks: List[Block]) -> Optional[Transition]:
+    """
+    أقرب انتقال بعد now: فتح إن كنا داخل نافذة، وإلا إغلاق عند بداية النافذة القادمة.
+    النوافذ مرتبة ومنفصلة (merge_windows)، فأول نافذة لم تنتهِ بعد هي الجواب.
+    """
+    for b in blocks:
+        if now < b.end:
+            if b.start > now:
+                return Transition(b.start, "close", b.opener)
+            return Transition(b.end, "open", b.closer)
+    return None
+
+
+def bucket_key(lat: float, lon: float, method: int, timezone: str) -> Tuple[float, float, int, str]:
+    """
+    مفتاح "سلة" الموقع: القروبات ذات نفس (lat, lon مقرّبة، method, tz) تشترك في نفس جدول الأوقات.
+    التقريب لمنزلتين (~1 كم) لا يغيّر الأوقات بأكثر من ثوانٍ.
+    """
+    return (round(float(lat), 2), round(float(lon), 2), int(method), timezone)
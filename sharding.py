@@ -0,0 +1,165 @@
+# sharding.py
+"""
+توزيع القروبات على عدة عمّال (WORKER_MODE=worker) عبر leases في Mongo.
+
+- كل قروب ينتمي إلى shard = chat_id % NUM_SHARDS.
+- كل عامل يجدد leases الـ shards التي يملكها كل LEASE_SECONDS/3 ويسعى لحصة عادلة
+  (ceil(NUM_SHARDS / عدد العمّال الأحياء))؛ leases عامل ميت تنتهي فيأخذها غيره تلقائيًا.
+- عامل لا ينفّذ انتقالًا إلا لقروب shard-ه مملوك له وlease-ه سارية محليًا، فلا يُغلق شات مرتين.
+- الواجهة (WORKER_MODE=front) تستقبل الـ webhook وتحيل أوامر التخطيط (مثل /bind) والإغلاق/الفتح اليدوي
+  (/testclose، /close_all...) إلى العامل المالك، فكل انتقالات القروب تمر بنفس العملية.
+
+في الوضع single كل القروبات مملوكة لهذه العملية.
+"""
+import asyncio
+import logging
+import math
+import time
+import zlib
+from typing import Awaitable, Callable, Dict, Iterable
+
+import database as db
+from config import LEASE_SECONDS, NUM_SHARDS, WORKER_ID, WORKER_MODE
+
+logger = logging.getLogger(__name__)
+
+COMMAND_POLL_SECONDS = 2.0
+COMMAND_BATCH = 100
+
+# shard -> وقت انتهاء الـ lease (time.time())
+_owned: Dict[int, float] = {}
+_tasks = []
+
+
+def shard_of(chat_id: int) -> int:
+    return int(chat_id) % NUM_SHARDS
+
+
+def owns(chat_id: int) -> bool:
+    """هل هذه العملية مسؤولة عن جدولة هذا القروب الآن؟"""
+    if WORKER_MODE == "single":
+        return True
+    if WORKER_MODE != "worker":
+        return False
+    # هامش أمان: نتوقف قبل انتهاء الـ lease بقليل حتى لا يتداخل مع المالك الجديد
+    return _owned.get(shard_of(chat_id), 0) > time.time() + 1
+
+
+def owned_shards() -> Iterable[int]:
+    now = time.time()
+    return [s for s, exp in _owned.items() if exp > now]
+
+
+async def _rebalance(on_change: Callable[[set, set], Awaitable]):
+    live = max(1, await db.heartbeat_worker_db(WORKER_ID, LEASE_SECONDS))
+    target = math.ceil(NUM_SHARDS / live)
+    before = set(owned_shards())
+
+    # تجديد ما نملك
+    for shard in list(_owned):
+        expires = await db.claim_lease_db(shard, WORKER_ID, LEASE_SECONDS)
+        if expires is None:
+            _owned.pop(shard, None)
+        else:
+            _owned[shard] = expires
+
+    # التخلي عن الزائد عن الحصة (ليأخذه عامل جديد)
+    while len(_owned) > target:
+        shard = max(_owned)
+        _owned.pop(shard)
+        await db.release_lease_db(shard, WORKER_ID)
+
+    # أخذ shards حرة أو منتهية حتى الحصة
+    if len(_owned) < target:
+        start = zlib.crc32(WORKER_ID.encode()) % NUM_SHARDS
+        for i in range(NUM_SHARDS):
+            shard = (start + i) % NUM_SHARDS
+            if shard in _owned:
+                continue
+            expires = await db.claim_lease_db(shard, WORKER_ID, LEASE_SECONDS)
+            if expires is not None:
+                _owned[shard] = expires
+                if len(_owned) >= target:
+                    break
+
+    after = set(owned_shards())
+    gained, lost = after - before, before - after
+    if gained or lost:
+        logger.info("sharding: %s owns %d/%d shards (+%s -%s, %d workers)",
+                    WORKER_ID, len(after), NUM_SHARDS, sorted(gained), sorted(lost), live)
+        await on_change(gained, lost)
+
+
+async def _lease_loop(on_change):
+    while True:
+        try:
+            await _rebalance(on_change)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("sharding: rebalance failed")
+        await asyncio.sleep(LEASE_SECONDS / 3)
+
+
+async def _command_loop(handler: Callable[[dict], Awaitable]):
+    while True:
+        full = False
+        try:
+            shards = owned_shards()
+            if shards:
+                commands = await db.pop_commands_db(shards, COMMAND_BATCH)
+                full = len(commands) >= COMMAND_BATCH
+                await _run_commands(commands, handler)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("sharding: command poll failed")
+        if not full:  # دفعة ممتلئة (مثل /close_all): الباقي فورًا
+            await asyncio.sleep(COMMAND_POLL_SECONDS)
+
+
+async def _run_commands(commands, handler: Callable[[dict], Awaitable]):
+    """الدفعة بالتوازي بين القروبات، وبترتيب الإحالة داخل كل قروب."""
+    chains: Dict[int, list] = {}
+    for command in commands:
+        chains.setdefault(command.get("chat_id"), []).append(command)
+
+    async def run(chain):
+        for command in chain:
+            try:
+                await handler(command)
+            except Exception:
+                logger.exception("sharding: command %s failed", command.get("kind"))
+
+    await asyncio.gather(*(run(chain) for chain in chains.values()))
+
+
+def start(on_change: Callable[[set, set], Awaitable], on_command: Callable[[dict], Awaitable]):
+    """تشغيل حلقة الـ leases وحلقة الأوامر المُحالة (في وضع worker فقط)."""
+    if WORKER_MODE != "worker" or _tasks:
+        return
+    _tasks.append(asyncio.create_task(_lease_loop(on_change)))
+    _tasks.append(asyncio.create_task(_command_loop(on_command)))
+
+
+async def stop():
+    for task in _tasks:
+        task.cancel()
+    _tasks.clear()
+    for shard in list(_owned):
+        try:
+            await db.release_lease_db(shard, WORKER_ID)
+        except Exception:
+            pass
+    _owned.clear()
+
+
+async def forward(chat_id: int, command: dict) -> bool:
+    """
+    في وضع front: إحالة أمر إلى العامل المالك لـ shard القروب. يُرجع False إن كان يجب
+    تنفيذ الأمر محليًا (الوضع single).
+    """
+    if WORKER_MODE != "front":
+        return False
+    await db.push_command_db(shard_of(chat_id), dict(command, chat_id=chat_id))
+    return True
@@ -0,0 +1,508 @@
+# storage.py
+"""
+بدائل محلية لـ MongoDB بنفس جزء واجهة pymongo الذي يستعمله database.py
+(find / find_one / find_one_and_update / update_one / bulk_write / aggregate / ... مع فهارس unique و upsert).
+
+- memory: كل شيء في ذاكرة العملية (اختبارات، bench.py، تجربة بدون أي خدمة).
+- sqlite: ملف محلي بوضع WAL؛ الكتابات تُجمع في transaction واحدة تُثبَّت كل SQLITE_COMMIT_MS
+  (0 = تثبيت كل كتابة فورًا). القراءة من نفس الاتصال ترى الكتابات غير المثبتة.
+
+الوثائق تُخزَّن كـ JSON؛ الشروط على الحقول (=، $in، $gt، $lt، $not، $or) تُقيَّم في Python،
+والمساواة على الحقول تُرسل لـ SQLite أيضًا حتى تستعمل الفهارس. كل نداء يُعدّ في stats (round-trips).
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+import sqlite3
+from collections import Counter
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+def _copy(v):
+    if isinstance(v, dict):
+        return {k: _copy(x) for k, x in v.items()}
+    if isinstance(v, list):
+        return [_copy(x) for x in v]
+    return v
+
+
+def _is_ops(cond) -> bool:
+    return isinstance(cond, dict) and bool(cond) and all(k.startswith("$") for k in cond)
+
+
+def _match_ops(v, ops: dict) -> bool:
+    for op, arg in ops.items():
+        if op == "$in":
+            ok = v is not _MISSING and v in arg
+        elif op == "$gt":
+            ok = v is not _MISSING and v is not None and v > arg
+        elif op == "$lt":
+            ok = v is not _MISSING and v is not None and v < arg
+        elif op == "$not":
+            ok = not _match_ops(v, arg)
+        else:
+            raise NotImplementedError(f"query operator {op}")
+        if not ok:
+            return False
+    return True
+
+
+def _match(doc: dict, flt: dict) -> bool:
+    for k, cond in flt.items():
+        if k == "$or":
+            if not any(_match(doc, c) for c in cond):
+                return False
+            continue
+        v = doc.get(k, _MISSING)
+        if _is_ops(cond):
+            if not _match_ops(v, cond):
+                return False
+        elif (None if v is _MISSING else v) != cond:
+            return False
+    return True
+
+
+def _project(doc: dict, projection: Optional[dict]) -> dict:
+    if not projection:
+        return _copy(doc)
+    include = [k for k, v in projection.items() if v and k != "_id"]
+    if include:
+        out = {k: _copy(doc[k]) for k in include if k in doc}
+        if projection.get("_id", 1) and "_id" in doc:
+            out["_id"] = doc["_id"]
+        return out
+    return {k: _copy(v) for k, v in doc.items() if k not in projection}
+
+
+def _apply(doc: dict, update: dict, inserting: bool = False):
+    for op, fields in update.items():
+        if op == "$set":
+            doc.update(_copy(fields))
+        elif op == "$inc":
+            for k, v in fields.items():
+                doc[k] = doc.get(k, 0) + v
+        elif op == "$setOnInsert":
+            if inserting:
+                doc.update(_copy(fields))
+        else:
+            raise NotImplementedError(f"update operator {op}")
+
+
+def _upsert_doc(flt: dict, update: dict) -> dict:
+    """الوثيقة الجديدة عند upsert: حقول المساواة في الشرط + التحديث."""
+    doc = {k: _copy(v) for k, v in flt.items() if not k.startswith("$") and not _is_ops(v)}
+    _apply(doc, update, inserting=True)
+    return doc
+
+
+def _value(doc: dict, ref):
+    """"$field" -> قيمة الحقل؛ غير ذلك قيمة ثابتة (كما في تعابير aggregation)."""
+    return doc.get(ref[1:]) if isinstance(ref, str) and ref.startswith("$") else ref
+
+
+def _numbers(docs: List[dict], ref) -> List[float]:
+    # مثل MongoDB: القيم غير الرقمية (null، مفقودة، نص) تُهمل في $sum/$avg/$percentile
+    values = (_value(d, ref) for d in docs)
+    return [v for v in values if isinstance(v, (int, float)) and not isinstance(v, bool)]
+
+
+def _accumulate(docs: List[dict], op: str, arg):
+    if op == "$sum":
+        return sum(_numbers(docs, arg))
+    if op == "$avg":
+        values = _numbers(docs, arg)
+        return sum(values) / len(values) if values else None
+    if op in ("$max", "$min"):
+        values = [v for v in (_value(d, arg) for d in docs) if v is not None]
+        return (max if op == "$max" else min)(values) if values else None
+    if op == "$push":
+        return [_value(d, arg) for d in docs]
+    if op == "$percentile":
+        values = sorted(_numbers(docs, arg["input"]))
+        if not values:
+            return [None] * len(arg["p"])
+        return [values[min(len(values) - 1, max(0, math.ceil(p * len(values)) - 1))] for p in arg["p"]]
+    raise NotImplementedError(f"accumulator {op}")
+
+
+def _group(docs: List[dict], spec: dict) -> List[dict]:
+    key_spec = spec["_id"]
+    groups: Dict[tuple, list] = {}
+    for doc in docs:
+        if isinstance(key_spec, dict):
+            key = tuple((k, _value(doc, v)) for k, v in key_spec.items())
+        else:
+            key = _value(doc, key_spec)
+        groups.setdefault(key, []).append(doc)
+    out = []
+    for key, members in groups.items():
+        row = {"_id": dict(key) if isinstance(key_spec, dict) else key}
+        for field, acc in spec.items():
+            if field != "_id":
+                (op, arg), = acc.items()
+                row[field] = _accumulate(members, op, arg)
+        out.append(row)
+    return out
+
+
+def _index_fields(keys) -> tuple:
+    return (keys,) if isinstance(keys, str) else tuple(k for k, _ in keys)
+
+
+class Cursor:
+    def __init__(self, docs: List[dict]):
+        self._docs = docs
+
+    def limit(self, n: int):
+        if n:
+            self._docs = self._docs[:n]
+        return self
+
+    def batch_size(self, n: int):
+        return self
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        for doc in self._docs:
+            yield doc
+
+
+class _Collection:
+    """
+    واجهة pymongo المشتركة؛ الأصناف الفرعية تعرّف:
+    _find(flt) -> وثائق قابلة للتعديل، _insert(doc)، _save(doc, token)، _remove(doc)،
+    و _before(doc) -> ما يحتاجه _save عن الوثيقة قبل التعديل.
+    """
+
+    def __init__(self, store, name: str):
+        self.store = store
+        self.name = name
+
+    async def _round_trip(self, op: str):
+        self.store.stats[f"{self.name}.{op}"] += 1
+        if self.store.latency:
+            await asyncio.sleep(self.store.latency)
+
+    def _update(self, flt: dict, update: dict, upsert: bool, many: bool = False):
+        docs = self._find(flt)
+        if not many:
+            docs = docs[:1]
+        for doc in docs:
+            token = self._before(doc)
+            _apply(doc, update)
+            self._save(doc, token)
+        upserted = self._insert(_upsert_doc(flt, update))["_id"] if upsert and not docs else None
+        return SimpleNamespace(matched_count=len(docs), modified_count=len(docs), upserted_id=upserted)
+
+    def find(self, flt: dict = None, projection: dict = None):
+        self.store.stats[f"{self.name}.find"] += 1
+        return Cursor([_project(d, projection) for d in self._find(flt or {})])
+
+    async def find_one(self, flt: dict = None, projection: dict = None):
+        await self._round_trip("find_one")
+        docs = self._find(flt or {})
+        return _project(docs[0], projection) if docs else None
+
+    async def find_one_and_update(self, flt: dict, update: dict, upsert: bool = False, return_document=False, **kwargs):
+        await self._round_trip("find_one_and_update")
+        docs = self._find(flt)
+        if docs:
+            doc = docs[0]
+            before = None if return_document else _copy(doc)
+            token = self._before(doc)
+            _apply(doc, update)
+            self._save(doc, token)
+            return _copy(doc) if return_document else before
+        if not upsert:
+            return None
+        doc = self._insert(_upsert_doc(flt, update))
+        return _copy(doc) if return_document else None
+
+    async def find_one_and_delete(self, flt: dict, sort=None, **kwargs):
+        await self._round_trip("find_one_and_delete")
+        docs = self._find(flt)
+        for key, direction in reversed(sort or []):
+            docs.sort(key=lambda d: d.get(key), reverse=direction < 0)
+        if not docs:
+            return None
+        self._remove(docs[0])
+        return _copy(docs[0])
+
+    async def update_one(self, flt: dict, update: dict, upsert: bool = False):
+        await self._round_trip("update_one")
+        return self._update(flt, update, upsert)
+
+    async def update_many(self, flt: dict, update: dict, upsert: bool = False):
+        await self._round_trip("update_many")
+        return self._update(flt, update, upsert, many=True)
+
+    async def bulk_write(self, ops, ordered: bool = True):
+        await self._round_trip("bulk_write")
+        for op in ops:
+            # pymongo.UpdateOne لا يعرض الشرط/التحديث بواجهة عامة
+            self._update(op._filter, op._doc, op._upsert)
+
+    async def insert_one(self, doc: dict):
+        await self._round_trip("insert_one")
+        # مثل pymongo: _id يُضاف للوثيقة الممررة
+        doc.setdefault("_id", self.store.new_id())
+        return SimpleNamespace(inserted_id=self._insert(doc)["_id"])
+
+    async def insert_many(self, docs: List[dict], ordered: bool = True):
+        await self._round_trip("insert_many")
+        return SimpleNamespace(inserted_ids=[self._insert(d)["_id"] for d in docs])
+
+    async def delete_one(self, flt: dict):
+        await self._round_trip("delete_one")
+        docs = self._find(flt)[:1]
+        for doc in docs:
+            self._remove(doc)
+        return SimpleNamespace(deleted_count=len(docs))
+
+    async def delete_many(self, flt: dict):
+        await self._round_trip("delete_many")
+        docs = self._find(flt)
+        for doc in docs:
+            self._remove(doc)
+        return SimpleNamespace(deleted_count=len(docs))
+
+    async def count_documents(self, flt: dict):
+        await self._round_trip("count_documents")
+        return len(self._find(flt))
+
+    async def aggregate(self, pipeline: List[dict]):
+        """المراحل $match و $group ($sum، $avg، $max، $min، $push، $percentile) و $sort و $limit فقط."""
+        await self._round_trip("aggregate")
+        docs = None
+        for stage in pipeline:
+            (op, arg), = stage.items()
+            if op == "$match":
+                docs = self._find(arg) if docs is None else [d for d in docs if _match(d, arg)]
+                continue
+            if docs is None:
+                docs = self._find({})
+            if op == "$group":
+                docs = _group(docs, arg)
+            elif op == "$sort":
+                for key, direction in reversed(list(arg.items())):
+                    docs.sort(key=lambda d: d.get(key), reverse=direction < 0)
+            elif op == "$limit":
+                docs = docs[:arg]
+            else:
+                raise NotImplementedError(f"aggregation stage {op}")
+        return Cursor([_copy(d) for d in (self._find({}) if docs is None else docs)])
+
+
+# ===================== memory =====================
+class MemoryCollection(_Collection):
+    def __init__(self, store, name: str):
+        super().__init__(store, name)
+        self.docs: Dict = {}
+        self.unique: Dict[tuple, dict] = {}  # (fields...) -> {values: _id}
+
+    def _keys(self, doc: dict) -> Dict[tuple, tuple]:
+        return {fields: tuple(doc.get(f) for f in fields) for fields in self.unique}
+
+    def _find(self, flt: dict) -> List[dict]:
+        _id = flt.get("_id", _MISSING)
+        if _id is not _MISSING and not _is_ops(_id):
+            doc = self.docs.get(_id)
+            candidates = [doc] if doc is not None else []
+        else:
+            candidates = None
+            for fields, index in self.unique.items():
+                if all(f in flt and not _is_ops(flt[f]) for f in fields):
+                    _id = index.get(tuple(flt[f] for f in fields))
+                    candidates = [self.docs[_id]] if _id is not None else []
+                    break
+            if candidates is None:
+                candidates = list(self.docs.values())
+        return [d for d in candidates if _match(d, flt)]
+
+    def _insert(self, doc: dict) -> dict:
+        doc = _copy(doc)
+        doc.setdefault("_id", self.store.new_id())
+        if doc["_id"] in self.docs:
+            raise DuplicateKeyError(f"{self.name}: duplicate _id {doc['_id']}")
+        keys = self._keys(doc)
+        for fields, key in keys.items():
+            if key in self.unique[fields]:
+                raise DuplicateKeyError(f"{self.name}: duplicate {fields}={key}")
+        for fields, key in keys.items():
+            self.unique[fields][key] = doc["_id"]
+        self.docs[doc["_id"]] = doc
+        return doc
+
+    def _before(self, doc: dict):
+        return self._keys(doc)
+
+    def _save(self, doc: dict, old: Dict[tuple, tuple]):
+        for fields, key in self._keys(doc).items():
+            if key != old[fields]:
+                if key in self.unique[fields]:
+                    raise DuplicateKeyError(f"{self.name}: duplicate {fields}={key}")
+                self.unique[fields].pop(old[fields], None)
+                self.unique[fields][key] = doc["_id"]
+
+    def _remove(self, doc: dict):
+        for fields, key in self._keys(doc).items():
+            self.unique[fields].pop(key, None)
+        del self.docs[doc["_id"]]
+
+    async def create_index(self, keys, unique: bool = False, **kwargs):
+        await self._round_trip("create_index")
+        if unique:
+            fields = _index_fields(keys)
+            index = self.unique.setdefault(fields, {})
+            for doc in self.docs.values():
+                index[tuple(doc.get(f) for f in fields)] = doc["_id"]
+
+
+class MemoryStore:
+    def __init__(self):
+        self.stats = Counter()
+        self.latency = 0.0  # تأخير افتراضي لكل round-trip (bench.py)
+        self._collections: Dict[str, MemoryCollection] = {}
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(self, name)
+        return self._collections[name]
+
+    def new_id(self):
+        return ObjectId()
+
+    async def close(self):
+        pass
+
+
+# ===================== sqlite =====================
+def _field_sql(field: str) -> str:
+    # نفس النص في الفهرس وفي الاستعلام حتى يستعمل SQLite الفهرس
+    return f"json_extract(doc, '$.{field}')"
+
+
+def _id_key(_id) -> str:
+    return json.dumps(_id)
+
+
+class SqliteCollection(_Collection):
+    def __init__(self, store, name: str):
+        super().__init__(store, name)
+        self.conn = store.conn
+        self.table = f'"{name}"'
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table} (id TEXT PRIMARY KEY, doc TEXT NOT NULL)")
+
+    def _find(self, flt: dict) -> List[dict]:
+        where, params = [], []
+        for k, v in flt.items():
+            if k.startswith("$") or isinstance(v, (dict, list)):
+                continue
+            if k == "_id":
+                where.append("id = ?")
+                params.append(_id_key(v))
+            elif v is None:
+                where.append(f"{_field_sql(k)} IS NULL")
+            else:
+                where.append(f"{_field_sql(k)} = ?")
+                params.append(v)
+        sql = f"SELECT doc FROM {self.table}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        docs = [json.loads(row[0]) for row in self.conn.execute(sql, params)]
+        return [d for d in docs if _match(d, flt)]
+
+    def _write(self, sql: str, params: tuple):
+        self.store.begin()
+        try:
+            self.conn.execute(sql, params)
+        except sqlite3.IntegrityError as e:
+            raise DuplicateKeyError(f"{self.name}: {e}")
+
+    def _insert(self, doc: dict) -> dict:
+        doc = _copy(doc)
+        doc.setdefault("_id", self.store.new_id())
+        self._write(f"INSERT INTO {self.table} (id, doc) VALUES (?, ?)", (_id_key(doc["_id"]), json.dumps(doc)))
+        return doc
+
+    def _before(self, doc: dict):
+        return None
+
+    def _save(self, doc: dict, token=None):
+        self._write(f"UPDATE {self.table} SET doc = ? WHERE id = ?", (json.dumps(doc), _id_key(doc["_id"])))
+
+    def _remove(self, doc: dict):
+        self._write(f"DELETE FROM {self.table} WHERE id = ?", (_id_key(doc["_id"]),))
+
+    async def create_index(self, keys, unique: bool = False, **kwargs):
+        await self._round_trip("create_index")
+        fields = _index_fields(keys)
+        name = f'"{self.name}_{"_".join(fields)}"'
+        columns = ", ".join(_field_sql(f) for f in fields)
+        self.store.begin()
+        self.conn.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {self.table} ({columns})")
+
+
+class SqliteStore:
+    def __init__(self, path: str, commit_ms: int = 50):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        # الاتصال يُستعمل من event loop فقط؛ كل عبارة أقل من ملّي ثانية فلا حاجة لـ thread
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.commit_delay = commit_ms / 1000
+        self.stats = Counter()
+        self.latency = 0.0
+        self._collections: Dict[str, SqliteCollection] = {}
+        logger.info("storage: sqlite %s (commit every %sms)", path, commit_ms)
+
+    def __getitem__(self, name: str) -> SqliteCollection:
+        if name not in self._collections:
+            self._collections[name] = SqliteCollection(self, name)
+        return self._collections[name]
+
+    def new_id(self):
+        return str(ObjectId())
+
+    def begin(self):
+        """بداية transaction مجمّعة (إن لم تكن مفتوحة) تُثبَّت بعد commit_delay."""
+        if self.commit_delay <= 0 or self.conn.in_transaction:
+            return
+        self.conn.execute("BEGIN")
+        asyncio.get_running_loop().call_later(self.commit_delay, self.commit)
+
+    def commit(self):
+        if not self.conn.in_transaction:
+            return
+        try:
+            self.conn.execute("COMMIT")
+        except sqlite3.OperationalError:
+            # مثلًا database is locked من عملية أخرى: نعيد المحاولة في الدفعة التالية
+            logger.warning("storage: sqlite commit failed, retrying", exc_info=True)
+            asyncio.get_running_loop().call_later(self.commit_delay, self.commit)
+
+    async def close(self):
+        self.commit()
+        self.conn.close()
+
+
+def open_store(backend: str, sqlite_path: str = None, commit_ms: int = 50):
+    if backend == "memory":
+        return MemoryStore()
+    if backend == "sqlite":
+        return SqliteStore(sqlite_path, commit_ms)
+    raise ValueError(f"unknown STORAGE_BACKEND: {backend}")
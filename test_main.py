@@ -0,0 +1,62 @@
+# test_main.py
+"""
+جدولة الانتقالات في main.py (بدون Telegram: job_queue وهمي فوق registry والتخزين في الذاكرة).
+    python -m pytest -q test_main.py
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import main
+import registry
+
+
+class FakeJob:
+    def schedule_removal(self):
+        pass
+
+
+class FakeJobQueue:
+    def __init__(self):
+        self.runs = []
+
+    def run_once(self, callback, when, name=None, **kwargs):
+        self.runs.append((callback, when, name))
+        return FakeJob()
+
+
+@pytest.fixture
+def group(monkeypatch):
+    monkeypatch.setattr(main, "_timer", None)
+    registry.reset([{"chat_id": 1, "thread_id": 5}])
+    yield registry.get(1)
+    registry.reset()
+
+
+def test_failed_transition_is_retried(group, monkeypatch):
+    async def db_down(ctx, chat_id, text, at=None, prayer=None):
+        raise ConnectionError("db down")
+
+    monkeypatch.setitem(main.TRANSITION_JOBS, "open", db_down)
+    at = time.time() - 1
+    registry.schedule(1, at, "open", "✅", at, "Maghrib")
+    ctx = SimpleNamespace(job=None, job_queue=FakeJobQueue())
+    with pytest.raises(RuntimeError):
+        asyncio.run(main.due_job(ctx))
+    assert registry.pending(1)
+    assert (group.action, group.text, group.prayer, group.at) == ("open", "✅", "Maghrib", None)
+    assert group.entry[0] >= time.time() + main.RETRY_SECONDS - 5
+    assert ctx.job_queue.runs and ctx.job_queue.runs[-1][2] == main.DUE_JOB
+
+
+def test_successful_transition_keeps_its_own_schedule(group, monkeypatch):
+    async def ok(ctx, chat_id, text, at=None, prayer=None):
+        registry.schedule(chat_id, at + 3600, "close", "🔒", at + 3600, "Isha")
+
+    monkeypatch.setitem(main.TRANSITION_JOBS, "open", ok)
+    at = time.time() - 1
+    registry.schedule(1, at, "open", "✅", at, "Maghrib")
+    asyncio.run(main.due_job(SimpleNamespace(job=None, job_queue=FakeJobQueue())))
+    assert (group.action, group.entry[0]) == ("close", at + 3600)
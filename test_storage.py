@@ -0,0 +1,114 @@
+# test_storage.py
+"""
+التخزين المحلي (storage.py) يتصرف مثل pymongo في ما تعتمد عليه صحة database.py،
+نفس الحالات على memory و sqlite:
+- upsert بشرط $not/$gt على وثيقة موجودة -> DuplicateKeyError (نية قديمة في begin_transition_db)؛
+- أخذ lease وتجديدها ورفضها لعامل آخر ($or، $lt، upsert على _id)؛
+- $in و aggregate ($match، $group، $sort، $limit).
+    python -m pytest -q test_storage.py
+"""
+import asyncio
+
+import pytest
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+import storage
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def run(request, tmp_path):
+    """تشغيل coroutine(store) على تخزين جديد من النوع المطلوب."""
+    def _run(test):
+        async def main():
+            store = storage.open_store(request.param, str(tmp_path / "test.sqlite"), commit_ms=0)
+            try:
+                await test(store)
+            finally:
+                await store.close()
+        asyncio.run(main())
+    return _run
+
+
+async def _begin(col, chat_id, closed, at):
+    """نفس استعلام database.begin_transition_db."""
+    try:
+        return await col.find_one_and_update(
+            {"chat_id": chat_id, "op_at": {"$not": {"$gt": at}}},
+            {"$set": {"desired": closed, "op_at": at}, "$setOnInsert": {"closed": False, "version": 0}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        return None
+
+
+def test_stale_intent_raises_duplicate_key(run):
+    async def test(store):
+        col = store["state"]
+        await col.create_index("chat_id", unique=True)
+        doc = await _begin(col, 1, True, 100.0)
+        assert (doc["desired"], doc["op_at"], doc["closed"], doc["version"]) == (True, 100.0, False, 0)
+        # نية أحدث تُسجَّل على نفس الوثيقة، بدون $setOnInsert
+        await col.update_one({"chat_id": 1}, {"$set": {"closed": True}, "$inc": {"version": 1}})
+        doc = await _begin(col, 1, False, 200.0)
+        assert (doc["desired"], doc["op_at"], doc["closed"], doc["version"]) == (False, 200.0, True, 1)
+        # نية أقدم: الشرط لا يطابق والـ upsert يصطدم بالفهرس الفريد
+        assert await _begin(col, 1, True, 150.0) is None
+        assert await col.count_documents({"chat_id": 1}) == 1
+        assert (await col.find_one({"chat_id": 1}))["op_at"] == 200.0
+        # نفس الموعد (job مكرر) مقبول: $not $gt
+        assert (await _begin(col, 1, False, 200.0))["op_at"] == 200.0
+    run(test)
+
+
+async def _claim(col, shard, worker, now, lease=30.0):
+    """نفس استعلام database.claim_lease_db."""
+    try:
+        doc = await col.find_one_and_update(
+            {"_id": shard, "$or": [{"owner": worker}, {"expires_at": {"$lt": now}}]},
+            {"$set": {"owner": worker, "expires_at": now + lease}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        return None
+    return doc["expires_at"] if doc and doc.get("owner") == worker else None
+
+
+def test_lease_claim_renew_and_takeover(run):
+    async def test(store):
+        col = store["leases"]
+        assert await _claim(col, 0, "a", 1000.0) == 1030.0
+        assert await _claim(col, 0, "a", 1010.0) == 1040.0  # تجديد
+        assert await _claim(col, 0, "b", 1020.0) is None  # مملوكة لعامل حي
+        assert (await col.find_one({"_id": 0}))["owner"] == "a"
+        assert await _claim(col, 0, "b", 1041.0) == 1071.0  # انتهت
+        assert await _claim(col, 0, "a", 1042.0) is None
+        # release_lease_db ثم أخذها فورًا
+        await col.update_one({"_id": 0, "owner": "b"}, {"$set": {"expires_at": 0}})
+        assert await _claim(col, 0, "a", 1043.0) == 1073.0
+        assert await col.count_documents({}) == 1
+    run(test)
+
+
+def test_in_and_aggregate(run):
+    async def test(store):
+        col = store["events"]
+        await col.insert_many([
+            {"kind": "close", "result": "applied", "latency": 1.0, "actual": 10.0},
+            {"kind": "close", "result": "applied", "latency": 3.0, "actual": 11.0},
+            {"kind": "close", "result": "failed", "error": "Forbidden", "actual": 12.0},
+            {"kind": "open", "result": "failed", "error": "Forbidden", "actual": 13.0},
+            {"kind": "open", "result": "failed", "error": "TimedOut", "actual": 1.0},
+        ])
+        assert await col.count_documents({"kind": {"$in": ["open"]}, "actual": {"$gt": 5.0}}) == 1
+        rows = [d async for d in await col.aggregate([
+            {"$match": {"actual": {"$gt": 5.0}}},
+            {"$group": {"_id": {"kind": "$kind", "result": "$result"}, "n": {"$sum": 1}, "max": {"$max": "$latency"}}},
+            {"$sort": {"n": -1}},
+            {"$limit": 2},
+        ])]
+        assert rows[0] == {"_id": {"kind": "close", "result": "applied"}, "n": 2, "max": 3.0}
+        assert len(rows) == 2 and rows[1]["n"] == 1
+    run(test)
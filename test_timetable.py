@@ -0,0 +1,50 @@
+# test_timetable.py
+"""
+الجدول السنوي المضغوط (timetable) يطابق الحساب المحلي يومًا بيوم.
+    python -m pytest -q test_timetable.py
+"""
+import asyncio
+from datetime import date
+
+import pytest
+
+import prayer_calc
+import prayer_times
+import timetable
+
+BUCKETS = [(36.75, 3.06, 3, "Africa/Algiers"), (51.51, -0.13, 2, "Europe/London")]
+YEAR = 2027
+
+
+@pytest.fixture
+def built(tmp_path, monkeypatch):
+    monkeypatch.setattr(timetable, "TIMETABLE_DIR", str(tmp_path))
+    monkeypatch.setattr(timetable, "_tables", {})
+    monkeypatch.setattr(timetable, "_checked", {})
+    keys = [timetable._key(*b) for b in BUCKETS]
+    timetable.write(YEAR, keys, timetable.compute_local(YEAR, BUCKETS), "local")
+    return tmp_path
+
+
+@pytest.mark.parametrize("d", [date(YEAR, 1, 1), date(YEAR, 3, 28), date(YEAR, 6, 21), date(YEAR, 10, 31), date(YEAR, 12, 31)])
+def test_lookup_matches_local_calculation(built, d):
+    for lat, lon, method, tz in BUCKETS:
+        expected = prayer_calc.compute_minutes([d], lat, lon, tz, method)[0, 0]
+        assert list(timetable.lookup(d, lat, lon, method, tz)) == list(expected)
+
+
+def test_missing_bucket_or_year(built):
+    assert timetable.lookup(date(YEAR, 5, 1), 10.0, 10.0, 3, "UTC") is None
+    assert timetable.lookup(date(YEAR + 1, 5, 1), *BUCKETS[0]) is None
+
+
+def test_get_prayer_times_uses_timetable(built, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("should not compute when the timetable has the bucket")
+
+    monkeypatch.setattr(prayer_times, "compute_prayer_times", fail)
+    monkeypatch.setattr(prayer_times, "_fetch_month", fail)
+    lat, lon, method, tz = BUCKETS[1]
+    d = date(YEAR, 7, 4)
+    got = asyncio.run(prayer_times.get_prayer_times(d, lat, lon, method, tz))
+    assert got == prayer_calc.compute_prayer_times(d, lat, lon, method, tz)
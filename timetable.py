@@ -0,0 +1,198 @@
+# timetable.py
+"""
+جدول أوقات سنوي مضغوط ومحسوب مسبقًا، يُقرأ عبر memory-map.
+
+ملف واحد لكل سنة في TIMETABLE_DIR (timetable-YYYY.bin):
+    b"PTT1" | طول الترويسة (uint32) | ترويسة JSON | حشو إلى 16 بايت | int16[سلال، أيام السنة، 5]
+القيمة دقائق منذ منتصف الليل المحلي بترتيب PRAYERS. السلة = (lat, lon, method, timezone) مقرّبة
+كما في scheduler.bucket_key، فتكلفة السلة ~3.6KB للسنة، والبحث فهرس + شريحة (O(1)).
+الملف يُفتح للقراءة فقط فتتشارك كل العمليات (front/workers) نفس الصفحات في ذاكرة النظام.
+
+البناء (مرة في السنة أو بعد إضافة مواقع جديدة؛ يشمل الموقع الافتراضي وكل القروبات في DB):
+    python timetable.py [YEAR ...] [--source local|api]
+السلال غير الموجودة في الملف تُحسب/تُجلب كالمعتاد (prayer_times).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import struct
+import sys
+import time
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import ALADHAN_CONCURRENCY, LAT, LON, METHOD, TIMEZONE, TIMETABLE_DIR, PRAYER_SOURCE
+from prayer_calc import PRAYERS, compute_year
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"PTT1"
+RECHECK_SECONDS = 60
+
+# year -> (mtime, {key: row}, memmap) ؛ None إن لم يوجد ملف لهذه السنة
+_tables: Dict[int, Optional[Tuple[float, Dict[str, int], np.ndarray]]] = {}
+_checked: Dict[int, float] = {}
+
+
+def _key(lat: float, lon: float, method: int, timezone: str) -> str:
+    return f"{round(float(lat), 4)}|{round(float(lon), 4)}|{int(method)}|{timezone}"
+
+
+def path_for(year: int) -> str:
+    return os.path.join(TIMETABLE_DIR, f"timetable-{year}.bin")
+
+
+def write(year: int, keys: List[str], minutes: np.ndarray, source: str, path: str = None):
+    """كتابة ذرية (tmp ثم replace) لمصفوفة (len(keys)، أيام السنة، 5)."""
+    path = path or path_for(year)
+    header = json.dumps({"year": year, "source": source, "keys": keys, "days": minutes.shape[1]}).encode()
+    offset = len(MAGIC) + 4 + len(header)
+    pad = -offset % 16
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + struct.pack("<I", len(header) + pad) + header + b" " * pad)
+        f.write(np.ascontiguousarray(minutes, dtype="<i2").tobytes())
+    os.replace(tmp, path)
+
+
+def _open(path: str) -> Tuple[Dict[str, int], np.ndarray]:
+    with open(path, "rb") as f:
+        if f.read(4) != MAGIC:
+            raise ValueError(f"{path}: not a timetable file")
+        (size,) = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(size))
+    keys = header["keys"]
+    data = np.memmap(path, dtype="<i2", mode="r", offset=8 + size, shape=(len(keys), header["days"], 5))
+    return {k: i for i, k in enumerate(keys)}, data
+
+
+def _table(year: int):
+    """الملف المفتوح لهذه السنة؛ يُعاد فتحه إن أُعيد بناؤه (فحص mtime كل RECHECK_SECONDS)."""
+    now = time.monotonic()
+    if year in _tables and now - _checked.get(year, 0) < RECHECK_SECONDS:
+        return _tables[year]
+    _checked[year] = now
+    path = path_for(year)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        _tables[year] = None
+        return None
+    current = _tables.get(year)
+    if current is not None and current[0] == mtime:
+        return current
+    try:
+        index, data = _open(path)
+    except Exception:
+        logger.exception("timetable: failed to open %s", path)
+        _tables[year] = None
+        return None
+    logger.info("timetable: mapped %s (%d buckets)", path, len(index))
+    _tables[year] = (mtime, index, data)
+    return _tables[year]
+
+
+def lookup(d: date, lat: float, lon: float, method: int, timezone: str) -> Optional[np.ndarray]:
+    """الدقائق الخمس ليوم d (شريحة من الملف)، أو None إن لم تكن السلة/السنة محسوبة."""
+    table = _table(d.year)
+    if table is None:
+        return None
+    row = table[1].get(_key(lat, lon, method, timezone))
+    if row is None:
+        return None
+    return table[2][row, d.timetuple().tm_yday - 1]
+
+
+# ---------------- البناء ----------------
+def _year_days(year: int) -> List[date]:
+    first = date(year, 1, 1)
+    return [first + timedelta(days=i) for i in range((date(year + 1, 1, 1) - first).days)]
+
+
+def compute_local(year: int, buckets: List[Tuple[float, float, int, str]]) -> np.ndarray:
+    """حساب محلي: نداء compute_year واحد لكل طريقة حساب."""
+    out = np.empty((len(buckets), len(_year_days(year)), 5), dtype=np.int16)
+    by_method: Dict[int, List[int]] = {}
+    for i, (_, _, method, _) in enumerate(buckets):
+        by_method.setdefault(method, []).append(i)
+    for method, rows in by_method.items():
+        out[rows] = compute_year(
+            year, [buckets[i][0] for i in rows], [buckets[i][1] for i in rows], [buckets[i][3] for i in rows], method
+        )
+    return out
+
+
+async def compute_api(year: int, buckets: List[Tuple[float, float, int, str]]) -> np.ndarray:
+    """من Aladhan (شهر بطلب واحد، مع كاش prayer_times على القرص)."""
+    from prayer_times import get_prayer_times
+
+    days = _year_days(year)
+    # اليوم الأول من كل شهر يجلب الشهر كله: ALADHAN_CONCURRENCY طلبًا في نفس الوقت على اتصالات مفتوحة
+    limit = asyncio.Semaphore(ALADHAN_CONCURRENCY)
+
+    async def month(lat, lon, method, timezone, m):
+        async with limit:
+            await get_prayer_times(date(year, m, 1), lat, lon, method, timezone, use_timetable=False)
+
+    await asyncio.gather(*(month(*b, m) for b in buckets for m in range(1, 13)))
+    out = np.empty((len(buckets), len(days), 5), dtype=np.int16)
+    for i, (lat, lon, method, timezone) in enumerate(buckets):
+        for j, d in enumerate(days):
+            times = await get_prayer_times(d, lat, lon, method, timezone, use_timetable=False)
+            out[i, j] = [times[p].hour * 60 + times[p].minute for p in PRAYERS]
+    return out
+
+
+async def _group_settings() -> List[dict]:
+    """الإعدادات المختلفة بين القروبات (مرة لكل تركيبة وليس لكل قروب)."""
+    import database as db
+    import registry
+
+    try:
+        await db.load_groups_db()
+        return registry.profiles()
+    finally:
+        await db.close()
+
+
+async def build(years: List[int], source: str, include_groups: bool = True):
+    import scheduler
+    from prayer_times import close_client
+
+    groups = await _group_settings() if include_groups else []
+    buckets = sorted({scheduler.bucket_key(LAT, LON, METHOD, TIMEZONE)} | {
+        scheduler.bucket_key(g.get("lat", LAT), g.get("lon", LON), g.get("method", METHOD), g.get("timezone") or TIMEZONE)
+        for g in groups
+    })
+    keys = [_key(*b) for b in buckets]
+    try:
+        for year in years:
+            start = time.perf_counter()
+            minutes = compute_local(year, buckets) if source == "local" else await compute_api(year, buckets)
+            write(year, keys, minutes, source)
+            logger.info("timetable: %s — %d buckets from %s in %.1fs (%.1f MB)",
+                        path_for(year), len(keys), source, time.perf_counter() - start, minutes.nbytes / 1e6)
+    finally:
+        await close_client()
+
+
+def main_cli(argv=None):
+    this_year = date.today().year
+    p = argparse.ArgumentParser(description="بناء جدول الأوقات السنوي المضغوط")
+    p.add_argument("years", nargs="*", type=int, default=[this_year, this_year + 1])
+    p.add_argument("--source", choices=("local", "api"), default=PRAYER_SOURCE)
+    p.add_argument("--no-groups", action="store_true", help="الموقع الافتراضي فقط (بدون اتصال بالقاعدة)")
+    args = p.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    asyncio.run(build(args.years, args.source, not args.no_groups))
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
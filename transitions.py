@@ -0,0 +1,65 @@
+# transitions.py
+"""
+آلة حالة لكل شات: كل إغلاق/فتح يمر من هنا حتى يُنفَّذ كل انتقال حقيقي بمجموعة نداءات واحدة.
+
+- desired: آخر نية (إغلاق/فتح) مع موعدها op_at؛ closed: الحالة المطبّقة فعلًا؛ version: عدد الانتقالات.
+- نية مطابقة للحالة المطبّقة (job مكرر، فرعان يفتحان نفس النافذة، تخطيط بحالة قديمة) -> لا شيء.
+- نية أقدم من آخر نية مسجلة (job متأخر/خارج الترتيب) -> لا شيء.
+- شات متوقف في health (أخطاء دائمة متكررة) -> SKIPPED بدون أي نداء.
+- الانتقالات لنفس الشات متسلسلة داخل العملية (القروب مملوك لعملية واحدة، انظر sharding.py).
+"""
+import asyncio
+import logging
+import time
+from typing import Dict
+
+import database as db
+import events
+import health
+import outbound
+from utils import close_topic_or_lock, reopen_topic_or_unlock
+
+logger = logging.getLogger(__name__)
+
+APPLIED, NOOP, STALE, SKIPPED, FAILED = "applied", "noop", "stale", "skipped", "failed"
+
+# قفل لكل شات (عدد القروبات محدود، فلا حاجة لتنظيفه)
+_locks: Dict[int, asyncio.Lock] = {}
+
+
+async def apply(ctx, chat_id: int, thread_id, closed: bool, text: str, at: float = None,
+                priority: int = outbound.CRITICAL, force: bool = False, notice: bool = True, prayer: str = None) -> str:
+    """
+    نقل الشات إلى الحالة closed. at: موعد النية (unix)، الافتراضي الآن؛ وهو أيضًا deadline النداءات في الطابور.
+    force: تجاهل الـ circuit breaker (تجربة يدوية من الأدمن).
+    notice=False: رسالة الإغلاق أُرسلت مسبقًا (burst.py).
+    prayer: النافذة (اسم الصلاة أو "night") لسجل الأحداث.
+    يُرجع APPLIED أو NOOP (الحالة مطبّقة مسبقًا) أو STALE (توجد نية أحدث) أو SKIPPED أو FAILED.
+    كل نتيجة تُسجَّل في events (التأخر عن at إن كان موعدًا مخططًا).
+    """
+    errors = []
+    res = await _apply(ctx, chat_id, thread_id, closed, text, at, priority, force, notice, errors)
+    events.record(events.CLOSE if closed else events.OPEN, chat_id, res, at, prayer, errors[0] if errors else None)
+    return res
+
+
+async def _apply(ctx, chat_id: int, thread_id, closed: bool, text: str, at, priority: int, force: bool, notice: bool,
+                 errors: list) -> str:
+    if not force and not health.allowed(chat_id):
+        return SKIPPED
+    at = time.time() if at is None else at
+    async with _locks.setdefault(chat_id, asyncio.Lock()):
+        state = await db.begin_transition_db(chat_id, closed, at)
+        if state is None:
+            logger.info("transition %s -> %s skipped: newer intent exists", chat_id, "close" if closed else "open")
+            return STALE
+        if state["closed"] == closed:
+            return NOOP
+        if closed:
+            ok = await close_topic_or_lock(chat_id, thread_id, ctx, text, priority, notice, at, errors)
+        else:
+            ok = await reopen_topic_or_unlock(chat_id, thread_id, ctx, text, priority, at, errors)
+        if not ok:
+            return FAILED
+        await db.finish_transition_db(chat_id, closed)
+        return APPLIED
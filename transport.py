@@ -0,0 +1,109 @@
+# transport.py
+"""
+طبقة HTTP المشتركة لنداءات Bot API وطلبات Aladhan.
+
+- Bot API عبر poolين منفصلين (HTTPXRequest لكل lane): الإغلاق/الفتح المجدول وردود الأوامر في
+  "critical" (HTTP_POOL_SIZE اتصال)، والإرسال الجماعي في "bulk" (HTTP_BULK_POOL_SIZE)؛ إعلان كبير
+  لا يحجز الاتصالات التي يحتاجها إغلاق المغرب. الطابور (outbound.py) يحدد الـ lane لكل نداء
+  عبر contextvar قبل إرساله.
+- keep-alive طويل (HTTP_KEEPALIVE): الاتصالات تبقى مفتوحة بين الدفعات فلا يُعاد TLS handshake لكل دفعة.
+- HTTP/2 اختياري (HTTP2=1): كل نداءات الـ lane على اتصال واحد؛ بدون الحزمة h2 نرجع إلى HTTP/1.1.
+- مهلة قراءة لكل endpoint (ENDPOINT_READ_TIMEOUTS) عندما لا يحدد النداء مهلته.
+"""
+import asyncio
+import importlib.util
+import logging
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+import httpx
+from telegram.request import BaseRequest, HTTPXRequest
+
+from config import (
+    HTTP2, HTTP_BULK_POOL_SIZE, HTTP_CONNECT_TIMEOUT, HTTP_KEEPALIVE, HTTP_POOL_SIZE, HTTP_POOL_TIMEOUT,
+    HTTP_READ_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+CRITICAL, BULK = "critical", "bulk"
+# الـ lane للنداء الجاري (outbound.OutboundQueue يضبطه حسب أولوية النداء)
+lane: ContextVar[str] = ContextVar("transport_lane", default=CRITICAL)
+
+# مهلة القراءة (ثوانٍ) لكل endpoint؛ الباقي HTTP_READ_TIMEOUT.
+# الإغلاق/الفتح: قصيرة، فاتصال عالق يُعاد عبر retry بدل أن يفوّت الموعد (النداءات idempotent).
+ENDPOINT_READ_TIMEOUTS = {
+    "setChatPermissions": 5.0,
+    "closeForumTopic": 5.0,
+    "reopenForumTopic": 5.0,
+    "setWebhook": 30.0,
+    "deleteWebhook": 30.0,
+}
+
+
+def http_version() -> str:
+    if HTTP2 and importlib.util.find_spec("h2") is None:
+        logger.warning("HTTP2=1 but the h2 package is missing (pip install 'python-telegram-bot[http2]'); using HTTP/1.1")
+        return "1.1"
+    return "2" if HTTP2 else "1.1"
+
+
+def limits(pool_size: int, keepalive: float = HTTP_KEEPALIVE) -> httpx.Limits:
+    return httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size, keepalive_expiry=keepalive)
+
+
+def httpx_request(pool_size: int, keepalive: float = HTTP_KEEPALIVE, version: Optional[str] = None) -> HTTPXRequest:
+    """HTTPXRequest بحجم pool و keep-alive محددين (PTB يثبت keep-alive على افتراضي httpx: 5 ثوانٍ)."""
+    return HTTPXRequest(
+        connection_pool_size=pool_size,
+        read_timeout=HTTP_READ_TIMEOUT,
+        connect_timeout=HTTP_CONNECT_TIMEOUT,
+        pool_timeout=HTTP_POOL_TIMEOUT,
+        http_version=version or http_version(),
+        httpx_kwargs={"limits": limits(pool_size, keepalive)},
+    )
+
+
+class LaneRequest(BaseRequest):
+    """BaseRequest يوزع النداءات على HTTPXRequest لكل lane، مع مهلة قراءة لكل endpoint."""
+
+    def __init__(self, lanes: Dict[str, BaseRequest], timeouts: Dict[str, float] = ENDPOINT_READ_TIMEOUTS):
+        self.lanes = lanes
+        self.timeouts = timeouts
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return self.lanes[CRITICAL].read_timeout
+
+    async def initialize(self) -> None:
+        await asyncio.gather(*(r.initialize() for r in self.lanes.values()))
+
+    async def shutdown(self) -> None:
+        await asyncio.gather(*(r.shutdown() for r in self.lanes.values()))
+
+    async def do_request(self, url, method, request_data=None, read_timeout=BaseRequest.DEFAULT_NONE,
+                         write_timeout=BaseRequest.DEFAULT_NONE, connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE):
+        if read_timeout is BaseRequest.DEFAULT_NONE:
+            read_timeout = self.timeouts.get(url.rsplit("/", 1)[-1], read_timeout)
+        request = self.lanes.get(lane.get()) or self.lanes[CRITICAL]
+        return await request.do_request(url, method, request_data, read_timeout, write_timeout, connect_timeout,
+                                        pool_timeout)
+
+
+def bot_request() -> LaneRequest:
+    """يُمرَّر إلى Application.builder().request()."""
+    version = http_version()
+    return LaneRequest({
+        CRITICAL: httpx_request(HTTP_POOL_SIZE, version=version),
+        BULK: httpx_request(HTTP_BULK_POOL_SIZE, version=version),
+    })
+
+
+def http_client(pool_size: int, read_timeout: float) -> httpx.AsyncClient:
+    """عميل httpx لخدمة خارجية (Aladhan) بنفس إعدادات الـ pool و keep-alive."""
+    return httpx.AsyncClient(
+        limits=limits(pool_size),
+        timeout=httpx.Timeout(read_timeout, connect=HTTP_CONNECT_TIMEOUT),
+        http2=http_version() == "2",
+    )
@@ -0,0 +1,110 @@
+# updates.py
+"""
+معالجة تحديثات Telegram بالتوازي (يُمرَّر إلى Application.builder().concurrent_updates).
+
+- حتى UPDATE_CONCURRENCY تحديثًا في نفس الوقت؛ تحديثات نفس الشات تبقى بالترتيب (واحد بعد الآخر).
+  الانتظار على دور الشات لا يحجز مكانًا من الحد، فشات مزدحم لا يعطّل بقية الشاتات.
+- background(): الأوامر الطويلة للمالك (/announce، /close_all، /job_retry...) تعمل كمهمة في الخلفية
+  تُبلغ بنتيجتها، فيرجع الـ handler فورًا ولا ينتظر الأمر التالي في نفس الـ DM.
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import metrics
+from config import UPDATE_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+# حد PTB الداخلي (يُطبَّق قبل do_process_update): واسع، والحد الفعلي هو _workers
+_PTB_LIMIT = 10000
+
+_background: Set[asyncio.Task] = set()
+
+
+class ChatOrderedProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates: int = UPDATE_CONCURRENCY):
+        super().__init__(_PTB_LIMIT)
+        self.limit = max_concurrent_updates
+        self._workers = asyncio.Semaphore(max_concurrent_updates)
+        # chat_id -> [Lock, عدد التحديثات المنتظرة/الجارية]؛ يُحذف عند الفراغ
+        self._chats: Dict[int, list] = {}
+        self.running = 0
+
+    async def _run(self, coroutine: Awaitable):
+        async with self._workers:
+            self.running += 1
+            try:
+                await coroutine
+            finally:
+                self.running -= 1
+
+    async def do_process_update(self, update: object, coroutine: Awaitable) -> None:
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            await self._run(coroutine)
+            return
+        entry = self._chats.get(chat.id)
+        if entry is None:
+            entry = self._chats[chat.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # Lock في asyncio يخدم المنتظرين بالترتيب (FIFO) = ترتيب وصول التحديثات
+            async with entry[0]:
+                await self._run(coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chats[chat.id]
+
+    def waiting(self) -> int:
+        return sum(n for _, n in self._chats.values()) - self.running
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        # مهام الإرسال الجماعي تُستأنف من آخر checkpoint عند التشغيل التالي
+        for task in list(_background):
+            task.cancel()
+        await asyncio.gather(*_background, return_exceptions=True)
+
+
+processor = ChatOrderedProcessor()
+
+
+@metrics.collector
+def _collect():
+    metrics.UPDATES.set(processor.running, state="running")
+    metrics.UPDATES.set(max(0, processor.waiting()), state="waiting")
+    metrics.UPDATES.set(len(_background), state="background")
+
+
+async def _run_background(coro: Awaitable, name: str, on_error: Optional[Callable[[Exception], Awaitable]]):
+    try:
+        await coro
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.exception("background %s failed", name)
+        if on_error is not None:
+            try:
+                await on_error(e)
+            except Exception:
+                logger.exception("background %s: failed to report error", name)
+
+
+def background(coro: Awaitable, name: str, on_error: Optional[Callable[[Exception], Awaitable]] = None) -> asyncio.Task:
+    """تشغيل coro بعد رجوع الـ handler؛ on_error(e) يُبلغ المستخدم إن فشل."""
+    task = asyncio.create_task(_run_background(coro, name, on_error), name=name)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    return task
+
+
+def pending() -> List[asyncio.Task]:
+    """المهام الجارية في الخلفية (للانتظار عليها في bench)."""
+    return list(_background)
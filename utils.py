@@ -1,39 +1,116 @@
+import functools
 import logging
+import time
 from telegram import ChatPermissions
+from telegram.error import TelegramError
 from telegram.ext import ContextTypes
 
-async def close_topic_or_lock(chat_id: int, thread_id: int, ctx: ContextTypes.DEFAULT_TYPE, reason_text: str):
-    """إذا كان thread_id موجودًا، نحاول إغلاق الموضوع، وإلا نغير صلاحيات الشات (fallback)."""
+import health
+import metrics
+import outbound
+
+
+def _instrumented(action: str):
+    """مدة الإغلاق/الفتح (كل نداءات Bot API) وعدّاد النتائج في metrics."""
+    def deco(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            ok = await fn(*args, **kwargs)
+            metrics.TRANSITION_SECONDS.observe(time.perf_counter() - start, action=action)
+            metrics.TRANSITIONS.inc(action=action, result="ok" if ok else "failed")
+            return ok
+        return wrapper
+    return deco
+
+
+async def _handle_error(name: str, chat_id: int, e: Exception, errors: list = None) -> bool:
+    """
+    تصنيف الخطأ وتسجيله في health؛ True إذا كان "not modified" (الحالة مطبّقة أصلًا).
+    errors (إن وُجدت) يُضاف إليها صنف الخطأ (لسجل الأحداث).
+    """
+    kind = await health.record_failure(chat_id, e)
+    if kind == health.NOT_MODIFIED:
+        return True
+    if errors is not None:
+        errors.append(type(e).__name__)
+    if isinstance(e, TelegramError):
+        # خطأ Telegram متوقع (بوت مطرود، لا صلاحيات، timeout...): سطر واحد بدل traceback كامل
+        logging.warning("%s %s: %s (%s)", name, chat_id, e, kind)
+    else:
+        logging.exception("%s failed for %s:", name, chat_id)
+    return False
+
+@_instrumented("close")
+async def close_topic_or_lock(chat_id: int, thread_id: int, ctx: ContextTypes.DEFAULT_TYPE, reason_text: str, priority: int = outbound.CRITICAL,
+                              notice: bool = True, deadline: float = None, errors: list = None):
+    """
+    إذا كان thread_id موجودًا، نحاول إغلاق الموضوع، وإلا نغير صلاحيات الشات (fallback).
+    notice=False: رسالة التنبيه أُرسلت مسبقًا (burst.py)، فقط الإغلاق نفسه.
+    errors: قائمة يُضاف إليها صنف الخطأ عند الفشل.
+    """
+    # عملية جديدة لهذا الشات: أي فتح/إغلاق أقدم ما زال في الطابور يُسقَط
+    rl = outbound.queue.transition_args(chat_id, priority, deadline)
     try:
         if thread_id:
-            await ctx.bot.send_message(chat_id=chat_id, text=reason_text, message_thread_id=thread_id)
-            await ctx.bot.close_forum_topic(chat_id=chat_id, message_thread_id=thread_id)
-            return True
+            if notice:
+                await ctx.bot.send_message(chat_id=chat_id, text=reason_text, message_thread_id=thread_id, rate_limit_args=rl)
+            await ctx.bot.close_forum_topic(chat_id=chat_id, message_thread_id=thread_id, rate_limit_args=rl)
         else:
-            await ctx.bot.set_chat_permissions(chat_id=chat_id, permissions=ChatPermissions(can_send_messages=False))
-            await ctx.bot.send_message(chat_id=chat_id, text=reason_text)
-            return True
-    except Exception as e:
-        logging.exception("close_topic_or_lock failed:")
+            await ctx.bot.set_chat_permissions(chat_id=chat_id, permissions=ChatPermissions(can_send_messages=False), rate_limit_args=rl)
+            if notice:
+                await ctx.bot.send_message(chat_id=chat_id, text=reason_text, rate_limit_args=rl)
+    except outbound.Superseded as e:
+        logging.info("close_topic_or_lock: %s", e)
+        if errors is not None:
+            errors.append(type(e).__name__)
         return False
+    except Exception as e:
+        return await _handle_error("close_topic_or_lock", chat_id, e, errors)
+    await health.record_success(chat_id)
+    return True
 
-async def reopen_topic_or_unlock(chat_id: int, thread_id: int, ctx: ContextTypes.DEFAULT_TYPE, text: str):
-    """اعادة فتح الموضوع أو استرجاع صلاحيات الدردشة"""
+@_instrumented("open")
+async def reopen_topic_or_unlock(chat_id: int, thread_id: int, ctx: ContextTypes.DEFAULT_TYPE, text: str, priority: int = outbound.CRITICAL,
+                                 deadline: float = None, errors: list = None):
+    """اعادة فتح الموضوع أو استرجاع صلاحيات الدردشة (errors: كما في close_topic_or_lock)"""
+    rl = outbound.queue.transition_args(chat_id, priority, deadline)
     try:
         if thread_id:
-            await ctx.bot.send_message(chat_id=chat_id, text=text, message_thread_id=thread_id)
-            await ctx.bot.reopen_forum_topic(chat_id=chat_id, message_thread_id=thread_id)
-            return True
+            await ctx.bot.send_message(chat_id=chat_id, text=text, message_thread_id=thread_id, rate_limit_args=rl)
+            await ctx.bot.reopen_forum_topic(chat_id=chat_id, message_thread_id=thread_id, rate_limit_args=rl)
         else:
             await ctx.bot.set_chat_permissions(chat_id=chat_id, permissions=ChatPermissions(
                 can_send_messages=True,
-                can_send_media_messages=True,
+                # can_send_media_messages لم يعد موجودًا (صلاحيات الوسائط أصبحت منفصلة)
+                can_send_audios=True,
+                can_send_documents=True,
+                can_send_photos=True,
+                can_send_videos=True,
+                can_send_video_notes=True,
+                can_send_voice_notes=True,
                 can_send_polls=True,
                 can_send_other_messages=True,
                 can_add_web_page_previews=True,
-            ))
-            await ctx.bot.send_message(chat_id=chat_id, text=text)
-            return True
-    except Exception as e:
-        logging.exception("reopen_topic_or_unlock failed:")
+            ), rate_limit_args=rl)
+            await ctx.bot.send_message(chat_id=chat_id, text=text, rate_limit_args=rl)
+    except outbound.Superseded as e:
+        logging.info("reopen_topic_or_unlock: %s", e)
+        if errors is not None:
+            errors.append(type(e).__name__)
         return False
+    except Exception as e:
+        return await _handle_error("reopen_topic_or_unlock", chat_id, e, errors)
+    await health.record_success(chat_id)
+    return True
+
+
+async def send_notice(chat_id: int, thread_id: int, ctx: ContextTypes.DEFAULT_TYPE, text: str, deadline: float) -> bool:
+    """رسالة التنبيه قبل إغلاق مجدول (burst.py)، بدون تغيير الصلاحيات؛ deadline: موعد الإغلاق."""
+    try:
+        await ctx.bot.send_message(chat_id=chat_id, text=text, message_thread_id=thread_id,
+                                   rate_limit_args={"priority": outbound.CRITICAL, "deadline": deadline})
+    except Exception as e:
+        return await _handle_error("send_notice", chat_id, e)
+    await health.record_success(chat_id)
+    return True
@@ -0,0 +1,91 @@
+# webserver.py
+"""
+خادم HTTP (tornado، يأتي مع python-telegram-bot[webhooks]) على PORT:
+
+- POST /webhook/<BOT_TOKEN> : تحديثات Telegram -> application.update_queue (مثل run_webhook).
+- GET /metrics              : مقاييس Prometheus (metrics.py).
+- GET /healthz              : 200 بعد attach() (الـ Application جاهز)، 503 قبلها.
+
+نستعمله بدل application.run_webhook لأن خادم PTB لا يسمح بإضافة مسارات أخرى على نفس المنفذ.
+يُشغَّل قبل بناء الـ Application حتى يفتح المنفذ فورًا عند التشغيل البارد؛ تحديثات الـ webhook
+التي تصل قبل attach() تنتظرها (حتى READY_TIMEOUT ثم 503 فيعيد Telegram إرسالها).
+"""
+import asyncio
+import json
+import logging
+from http import HTTPStatus
+from typing import Optional
+
+import tornado.web
+from tornado.httpserver import HTTPServer
+from telegram import Update
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+READY_TIMEOUT = 30
+
+_bot_app = None
+_ready: Optional[asyncio.Event] = None
+
+
+def attach(application):
+    """ربط الـ Application بعد بنائه: من هنا تُقبل تحديثات الـ webhook."""
+    global _bot_app
+    _bot_app = application
+    _ready.set()
+
+
+class WebhookHandler(tornado.web.RequestHandler):
+    async def post(self):
+        if not _ready.is_set():
+            try:
+                await asyncio.wait_for(_ready.wait(), READY_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise tornado.web.HTTPError(HTTPStatus.SERVICE_UNAVAILABLE)
+        try:
+            update = Update.de_json(json.loads(self.request.body), _bot_app.bot)
+        except Exception:
+            logger.exception("webhook: invalid update payload")
+            raise tornado.web.HTTPError(HTTPStatus.BAD_REQUEST)
+        if update:
+            # قبل application.start() تبقى في الطابور وتُعالج عند البدء
+            await _bot_app.update_queue.put(update)
+        self.set_status(HTTPStatus.OK)
+
+
+class HealthHandler(tornado.web.RequestHandler):
+    def get(self):
+        if not _ready.is_set():
+            self.set_status(HTTPStatus.SERVICE_UNAVAILABLE)
+            self.write("starting")
+            return
+        self.write("ok")
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.write(metrics.render())
+
+
+def _log_request(handler):
+    # سجل tornado الافتراضي يكتب المسار كاملًا، ومسار الـ webhook يحتوي BOT_TOKEN
+    path = "/webhook/***" if isinstance(handler, WebhookHandler) else handler.request.path
+    log = logger.warning if handler.get_status() >= 400 else logger.debug
+    log("%d %s %s %.1fms", handler.get_status(), handler.request.method, path, 1000 * handler.request.request_time())
+
+
+def start(port: int, webhook_path: str = None) -> HTTPServer:
+    """تشغيل الخادم على 0.0.0.0:port؛ webhook_path=None -> /metrics و /healthz فقط (وضع worker)."""
+    global _ready
+    _ready = asyncio.Event()
+    routes = [(r"/metrics", MetricsHandler), (r"/healthz", HealthHandler)]
+    if webhook_path:
+        routes.append((webhook_path, WebhookHandler))
+    server = HTTPServer(tornado.web.Application(routes, log_function=_log_request))
+    server.listen(port, address="0.0.0.0")
+    # لا نسجل مسار الـ webhook لأنه يحتوي BOT_TOKEN
+    logger.info("HTTP server listening on :%d (metrics%s)", port, " + webhook" if webhook_path else "")
+    return server